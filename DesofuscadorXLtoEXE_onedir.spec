@@ -0,0 +1,57 @@
+# -*- mode: python ; coding: utf-8 -*-
+# Perfil de arranque rápido: distribución en carpeta (one-dir) sin UPX.
+# A diferencia de DesofuscadorXLtoEXE.spec (one-file), no descomprime todo el
+# paquete en %TEMP% en cada arranque ni paga la descompresión UPX de cada DLL.
+# Construir con: pyinstaller DesofuscadorXLtoEXE_onedir.spec
+from PyInstaller.utils.hooks import collect_all
+
+datas = [('analyzer', 'analyzer'), ('builder', 'builder'), ('cleaner', 'cleaner'), ('deobfuscator', 'deobfuscator'), ('extractor', 'extractor'), ('report', 'report'), ('utils', 'utils')]
+binaries = []
+# Sólo lo que el código importa realmente; openpyxl y lxml no se usan en tiempo de ejecución
+hiddenimports = ['flet', 'flet_core', 'flet_runtime', 'oletools', 'oletools.olevba', 'olefile', 'pefile']
+tmp_ret = collect_all('flet')
+datas += tmp_ret[0]; binaries += tmp_ret[1]; hiddenimports += tmp_ret[2]
+
+
+a = Analysis(
+    ['gui\\desofuscador_futurista.py'],
+    pathex=[],
+    binaries=binaries,
+    datas=datas,
+    hiddenimports=hiddenimports,
+    hookspath=[],
+    hooksconfig={},
+    runtime_hooks=[],
+    excludes=['tkinter', 'unittest', 'pydoc', 'doctest', 'openpyxl', 'lxml', 'matplotlib', 'IPython'],
+    noarchive=False,
+    optimize=1,
+)
+pyz = PYZ(a.pure)
+
+exe = EXE(
+    pyz,
+    a.scripts,
+    [],
+    exclude_binaries=True,
+    name='DesofuscadorXLtoEXE',
+    debug=False,
+    bootloader_ignore_signals=False,
+    strip=False,
+    upx=False,
+    console=True,
+    disable_windowed_traceback=False,
+    argv_emulation=False,
+    target_arch=None,
+    codesign_identity=None,
+    entitlements_file=None,
+)
+
+coll = COLLECT(
+    exe,
+    a.binaries,
+    a.datas,
+    strip=False,
+    upx=False,
+    upx_exclude=[],
+    name='DesofuscadorXLtoEXE',
+)
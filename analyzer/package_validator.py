@@ -0,0 +1,192 @@
+"""
+Validación estructural del paquete OOXML a partir del grafo de relaciones.
+
+Lee ``[Content_Types].xml`` y cada ``.rels`` una sola vez (a través del índice
+``Package``) y recorre el grafo desde ``_rels/.rels``: el coste es lineal en
+partes + relaciones.
+"""
+import logging
+import posixpath
+import xml.etree.ElementTree as ET
+from collections import deque
+
+from extractor.package_index import CONTENT_TYPES_PART, VBA_PROJECT_CONTENT_TYPE, Package
+
+OFFICE_DOCUMENT_REL = 'officeDocument'
+VBA_PROJECT_REL = 'vbaProject'
+MACRO_ENABLED_MARKER = 'macroEnabled'
+
+ERROR = 'error'
+WARNING = 'warning'
+
+
+class PackageValidationError(Exception):
+    def __init__(self, issues):
+        self.issues = issues
+        errors = [i for i in issues if i['level'] == ERROR]
+        detail = '; '.join(f"{i['part'] or '-'}: {i['message']}" for i in errors[:5])
+        if len(errors) > 5:
+            detail += f' (y {len(errors) - 5} más)'
+        super().__init__(f"Paquete inválido ({len(errors)} error(es)): {detail}")
+
+
+def rels_source(rels_part):
+    """Parte de origen de un .rels ('' para el propio paquete), o None si no es un .rels."""
+    directory, base = posixpath.split(rels_part)
+    if posixpath.basename(directory) != '_rels' or not base.endswith('.rels'):
+        return None
+    return posixpath.join(posixpath.dirname(directory), base[:-len('.rels')])
+
+
+def _issue_key(issue):
+    return issue['code'], issue['part'], issue['message']
+
+
+def rel_type_is(rel, suffix):
+    return (rel.get('type') or '').rsplit('/', 1)[-1] == suffix
+
+
+class PackageValidator:
+    def __init__(self, package):
+        # Acepta la ruta (directorio o .xlsm) o un Package ya indexado
+        self.package = Package.coerce(package)
+        self.issues = []
+        self._invalid_rels = set()
+
+    def _issue(self, level, code, part, message):
+        self.issues.append({'level': level, 'code': code, 'part': part, 'message': message})
+
+    @property
+    def errors(self):
+        return [i for i in self.issues if i['level'] == ERROR]
+
+    @property
+    def warnings(self):
+        return [i for i in self.issues if i['level'] == WARNING]
+
+    def is_valid(self):
+        return not self.errors
+
+    def validate(self):
+        """Ejecuta todas las comprobaciones y devuelve la lista de incidencias."""
+        self.issues = []
+        self._invalid_rels = set()
+        if not self._check_content_types():
+            return self.issues
+        reachable = self._walk_graph()
+        if reachable is None:
+            return self.issues
+        self._check_parts(reachable)
+        self._check_vba_linkage()
+        return self.issues
+
+    def raise_for_errors(self, baseline=None):
+        """
+        Lanza PackageValidationError si hay errores. Con ``baseline`` (otro
+        PackageValidator ya ejecutado, p. ej. sobre la entrada) los errores que ya
+        tenía se registran como avisos: sólo fallan los nuevos.
+        """
+        known = {_issue_key(issue) for issue in baseline.errors} if baseline is not None else set()
+        inherited = [issue for issue in self.errors if _issue_key(issue) in known]
+        for issue in self.warnings:
+            logging.warning("Validación del paquete: %s: %s", issue['part'] or '-', issue['message'])
+        for issue in inherited:
+            logging.warning("Validación del paquete (ya en la entrada): %s: %s", issue['part'] or '-',
+                            issue['message'])
+        new = [issue for issue in self.errors if _issue_key(issue) not in known]
+        if new:
+            raise PackageValidationError(new)
+
+    def _check_content_types(self):
+        if CONTENT_TYPES_PART not in self.package:
+            self._issue(ERROR, 'missing_content_types', CONTENT_TYPES_PART, 'Falta [Content_Types].xml')
+            return False
+        try:
+            _, overrides = self.package.content_types()
+        except ET.ParseError as exc:
+            self._issue(ERROR, 'invalid_xml', CONTENT_TYPES_PART, f'XML inválido: {exc}')
+            return False
+        for part_name in overrides:
+            if part_name not in self.package:
+                self._issue(WARNING, 'override_without_part', part_name,
+                            'El tipo de contenido declara una parte que no existe')
+        return True
+
+    def _relationships(self, source):
+        if source in self._invalid_rels:
+            return []
+        try:
+            return self.package.relationships(source)
+        except ET.ParseError as exc:
+            self._invalid_rels.add(source)
+            self._issue(ERROR, 'invalid_xml', Package.rels_name(source), f'XML inválido: {exc}')
+            return []
+
+    def _walk_graph(self):
+        """BFS desde las relaciones del paquete; devuelve las partes alcanzables."""
+        if Package.rels_name('') not in self.package:
+            self._issue(ERROR, 'missing_package_rels', '_rels/.rels', 'Falta _rels/.rels')
+            return None
+        root_rels = self._relationships('')
+        if not any(rel_type_is(rel, OFFICE_DOCUMENT_REL) for rel in root_rels):
+            self._issue(ERROR, 'missing_office_document', '_rels/.rels',
+                        'No hay relación officeDocument hacia el libro')
+
+        reachable = set()
+        pending = deque([''])
+        while pending:
+            source = pending.popleft()
+            for rel in self._relationships(source):
+                target = rel['part']
+                if target is None:
+                    continue
+                if target not in self.package:
+                    self._issue(ERROR, 'missing_target', target,
+                                f"Destino de la relación {rel['id']} de {source or 'paquete'} inexistente")
+                    continue
+                if target not in reachable:
+                    reachable.add(target)
+                    pending.append(target)
+        return reachable
+
+    def _check_parts(self, reachable):
+        for name in self.package:
+            if name == CONTENT_TYPES_PART:
+                continue
+            source = rels_source(name)
+            if source is not None:
+                if source and source not in self.package:
+                    self._issue(WARNING, 'orphan_rels', name, 'Relaciones de una parte que no existe')
+                continue
+            if not self.package.content_type(name):
+                self._issue(ERROR, 'missing_content_type', name, 'Parte sin tipo de contenido')
+            if name not in reachable:
+                self._issue(WARNING, 'orphan_part', name, 'Parte no referenciada por ninguna relación')
+
+    def _check_vba_linkage(self):
+        vba_part = self.package.vba_project()
+        workbook = self._workbook_part()
+        linked = None
+        if workbook:
+            for rel in self._relationships(workbook):
+                if rel_type_is(rel, VBA_PROJECT_REL):
+                    linked = rel['part']
+        if vba_part is None:
+            if workbook and MACRO_ENABLED_MARKER in (self.package.content_type(workbook) or ''):
+                self._issue(WARNING, 'macro_workbook_without_vba', workbook,
+                            'Libro habilitado para macros sin vbaProject.bin')
+            return
+        if linked != vba_part:
+            self._issue(ERROR, 'vba_not_linked', vba_part, 'vbaProject.bin no está relacionado desde el libro')
+        if self.package.content_type(vba_part) != VBA_PROJECT_CONTENT_TYPE:
+            self._issue(ERROR, 'vba_content_type', vba_part,
+                        f'Tipo de contenido de vbaProject.bin incorrecto: {self.package.content_type(vba_part)}')
+        if workbook and MACRO_ENABLED_MARKER not in (self.package.content_type(workbook) or ''):
+            self._issue(WARNING, 'vba_in_macro_free_workbook', workbook,
+                        'Hay vbaProject.bin pero el libro no es de tipo habilitado para macros')
+
+    def _workbook_part(self):
+        for rel in self._relationships(''):
+            if rel_type_is(rel, OFFICE_DOCUMENT_REL) and rel['part'] in self.package:
+                return rel['part']
+        return None
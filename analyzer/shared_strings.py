@@ -0,0 +1,227 @@
+"""
+Lectura de ``xl/sharedStrings.xml`` sin cargar la tabla entera en memoria.
+
+- ``iter_shared_strings`` recorre la tabla en orden con ``iterparse`` liberando
+  cada elemento al terminar.
+- ``SharedStrings`` construye (una vez) un índice de desplazamientos de cada
+  ``<si>`` en un ``array('Q')``, lo guarda en disco y resuelve ``strings[i]``
+  leyendo sólo ese fragmento del archivo mapeado en memoria.
+
+Los desplazamientos son de bytes, así que se asume la codificación UTF-8 que
+usa Excel para esta parte.
+"""
+import array
+import json
+import mmap
+import os
+import struct
+import xml.etree.ElementTree as ET
+from functools import lru_cache
+from xml.parsers import expat
+
+SST_PART = 'xl/sharedStrings.xml'
+INDEX_DIR = '_indices'
+_MAIN_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+_SI = f'{{{_MAIN_NS}}}si'
+_T = f'{{{_MAIN_NS}}}t'
+_R = f'{{{_MAIN_NS}}}r'
+
+_INDEX_MAGIC = b'XLSSIDX1'
+_INDEX_HEADER = struct.Struct('<8sQQQI')  # magic, tamaño, mtime_ns, cantidad, longitud del JSON
+_CHUNK_SIZE = 1024 * 1024
+_SHARED_STRINGS_REL = 'sharedStrings'
+
+
+def si_text(si):
+    """Texto de un ``<si>``: ``<t>`` directo o la concatenación de las ``<r>`` (sin fonética)."""
+    parts = []
+    for child in si:
+        if child.tag == _T:
+            parts.append(child.text or '')
+        elif child.tag == _R:
+            for t in child.iter(_T):
+                parts.append(t.text or '')
+    return ''.join(parts)
+
+
+def iter_shared_strings(source):
+    """Produce las cadenas en orden; ``source`` es una ruta o un archivo binario."""
+    root = None
+    for event, elem in ET.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            if root is None:
+                root = elem
+            continue
+        if elem.tag == _SI:
+            yield si_text(elem)
+            # Soltar lo ya procesado: la memoria no crece con el tamaño de la tabla
+            root.clear()
+
+
+def shared_strings_part(package):
+    """Nombre de la parte sharedStrings según las relaciones del libro."""
+    for workbook_rel in package.relationships(''):
+        if workbook_rel['type'] and workbook_rel['type'].endswith('/officeDocument'):
+            for rel in package.relationships(workbook_rel['part']):
+                if (rel['type'] or '').rsplit('/', 1)[-1] == _SHARED_STRINGS_REL and rel['part'] in package:
+                    return rel['part']
+    return SST_PART if SST_PART in package else None
+
+
+class SharedStrings:
+    """
+    Acceso aleatorio a la tabla de cadenas compartidas con memoria constante.
+
+    El índice ocupa 8 bytes por cadena en disco y también se mapea en memoria;
+    se reconstruye sólo si el XML cambió (tamaño o mtime distintos).
+    """
+
+    def __init__(self, path, index_path=None, cache_size=1024):
+        self.path = path
+        self.index_path = index_path
+        self._file = None
+        self._map = None
+        self._index_file = None
+        self._index_map = None
+        self._offsets = None
+        self._namespaces = {}
+        self._wrapper = (b'', b'')
+        self.get = lru_cache(maxsize=cache_size)(self._get)
+        self._open()
+
+    @classmethod
+    def for_package(cls, package, cache_size=1024):
+        """Abre la tabla de un ``Package`` guardando el índice en ``<raíz>/_indices``."""
+        part = shared_strings_part(package)
+        if part is None:
+            return None
+        index_path = os.path.join(package.root, INDEX_DIR, 'sharedStrings.idx') if package.root else None
+        return cls(package.path(part), index_path, cache_size)
+
+    def _open(self):
+        self._file = open(self.path, 'rb')
+        st = os.fstat(self._file.fileno())
+        if st.st_size:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if not (self.index_path and self._load_index(st)):
+            offsets = self._build_offsets()
+            if self.index_path:
+                self._write_index(st, offsets)
+                self._load_index(st)
+            else:
+                self._offsets = memoryview(offsets)
+        prefixes = b''.join(
+            (b' xmlns="%s"' % uri.encode() if not prefix else b' xmlns:%s="%s"' % (prefix.encode(), uri.encode()))
+            for prefix, uri in self._namespaces.items())
+        self._wrapper = (b'<w' + prefixes + b'>', b'</w>')
+
+    def _build_offsets(self):
+        """Un solo recorrido con expat: desplazamiento de cada <si> y del cierre de la raíz."""
+        offsets = array.array('Q')
+        parser = expat.ParserCreate(namespace_separator=' ')
+        depth = 0
+
+        def start_ns(prefix, uri):
+            if depth == 0:
+                self._namespaces[prefix or ''] = uri
+
+        def start(name, attrs):
+            nonlocal depth
+            if depth == 1 and name.rsplit(' ', 1)[-1] == 'si':
+                offsets.append(parser.CurrentByteIndex)
+            depth += 1
+
+        def end(name):
+            nonlocal depth
+            depth -= 1
+            if depth == 0:
+                offsets.append(parser.CurrentByteIndex)
+
+        parser.StartNamespaceDeclHandler = start_ns
+        parser.StartElementHandler = start
+        parser.EndElementHandler = end
+        self._file.seek(0)
+        while True:
+            chunk = self._file.read(_CHUNK_SIZE)
+            if not chunk:
+                break
+            parser.Parse(chunk, False)
+        parser.Parse(b'', True)
+        if not offsets:
+            offsets.append(0)
+        return offsets
+
+    def _write_index(self, st, offsets):
+        os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+        namespaces = json.dumps(self._namespaces).encode('utf-8')
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(_INDEX_HEADER.pack(_INDEX_MAGIC, st.st_size, st.st_mtime_ns, len(offsets), len(namespaces)))
+            f.write(namespaces)
+            # Alinear los desplazamientos a 8 bytes para poder usar memoryview.cast('Q')
+            f.write(b'\0' * (-(_INDEX_HEADER.size + len(namespaces)) % 8))
+            offsets.tofile(f)
+        os.replace(tmp_path, self.index_path)
+
+    def _load_index(self, st):
+        if not os.path.exists(self.index_path):
+            return False
+        index_file = open(self.index_path, 'rb')
+        try:
+            header = index_file.read(_INDEX_HEADER.size)
+            if len(header) != _INDEX_HEADER.size:
+                index_file.close()
+                return False
+            magic, size, mtime_ns, count, ns_len = _INDEX_HEADER.unpack(header)
+            if magic != _INDEX_MAGIC or size != st.st_size or mtime_ns != st.st_mtime_ns:
+                index_file.close()
+                return False
+            self._namespaces = json.loads(index_file.read(ns_len).decode('utf-8'))
+            start = _INDEX_HEADER.size + ns_len
+            start += -start % 8
+            index_map = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError, struct.error):
+            index_file.close()
+            return False
+        self._index_file = index_file
+        self._index_map = index_map
+        self._offsets = memoryview(index_map)[start:start + count * 8].cast('Q')
+        return True
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index):
+        return self.get(index)
+
+    def _get(self, index):
+        count = len(self)
+        if index < 0:
+            index += count
+        if not 0 <= index < count:
+            raise IndexError(f"Índice de cadena compartida fuera de rango: {index}")
+        fragment = self._map[self._offsets[index]:self._offsets[index + 1]]
+        root = ET.fromstring(self._wrapper[0] + fragment + self._wrapper[1])
+        return si_text(root[0])
+
+    def __iter__(self):
+        # Lectura secuencial: más rápida que resolver cada índice por separado
+        with open(self.path, 'rb') as f:
+            yield from iter_shared_strings(f)
+
+    def close(self):
+        self.get.cache_clear()
+        if self._offsets is not None and self._index_map is not None:
+            self._offsets.release()
+        self._offsets = None
+        for handle in (self._index_map, self._index_file, self._map, self._file):
+            if handle is not None:
+                handle.close()
+        self._index_map = self._index_file = self._map = self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
@@ -1,24 +1,22 @@
-import os
+from analyzer.package_validator import PackageValidator
+from extractor.package_index import Package
 
 class StructureChecker:
     def __init__(self, working_dir):
-        self.working_dir = working_dir
+        # Acepta la ruta o un Package ya indexado
+        self.package = Package.coerce(working_dir)
+        self.working_dir = self.package.root
 
     def has_xl_folder(self):
-        return os.path.isdir(os.path.join(self.working_dir, 'xl'))
+        return any(name.startswith('xl/') for name in self.package)
 
     def has_vba_project(self):
-        for root, dirs, files in os.walk(self.working_dir):
-            for file in files:
-                if file.lower() == 'vbaproject.bin':
-                    return True
-        return False
+        return self.package.vba_project() is not None
+
+    def validate(self):
+        """Incidencias del grafo de relaciones (ver PackageValidator)."""
+        return PackageValidator(self.package).validate()
 
     def check_integrity(self):
-        # Valida que existan los componentes clave de un xlsm
-        xl_dir = os.path.join(self.working_dir, 'xl')
-        required = ['workbook.xml', 'sharedStrings.xml']
-        for req in required:
-            if not os.path.exists(os.path.join(xl_dir, req)):
-                return False
-        return True
+        # Válido si el grafo de relaciones no tiene errores (los avisos no cuentan)
+        return not any(issue['level'] == 'error' for issue in self.validate())
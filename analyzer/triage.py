@@ -0,0 +1,360 @@
+"""
+Clasificación rápida de archivos sin extraerlos (triaje).
+
+Sólo se leen el directorio central del ZIP, ``xl/workbook.xml`` y sus
+relaciones, el comienzo de cada hoja, las propiedades del documento y el stream
+``PROJECT`` de ``vbaProject.bin``. En un EXE se leen las cabeceras PE y el
+comienzo del overlay (los datos añadidos tras la última sección). Nada se
+escribe en disco.
+
+El resultado es un dict serializable a JSON con el veredicto: si el archivo
+está empaquetado con XLtoEXE, qué protecciones tiene, si lleva VBA o macros
+XLM, y si hace falta pasarlo por el proceso completo (``needs_pipeline``).
+"""
+import io
+import os
+import posixpath
+import re
+import struct
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from extractor.package_index import Package
+
+WORKBOOK_EXTENSIONS = ('.xlsm', '.xlsx', '.xltm', '.xltx', '.xlam', '.xls', '.zip')
+EXE_EXTENSIONS = ('.exe',)
+TRIAGE_EXTENSIONS = WORKBOOK_EXTENSIONS + EXE_EXTENSIONS
+
+# Las hojas de hasta SHEET_LIMIT bytes se leen enteras; de las demás sólo el
+# comienzo (<sheetPr>). <sheetProtection> va detrás de <sheetData>, así que en
+# las hojas grandes queda sin determinar
+SHEET_LIMIT = 64 * 1024
+SHEET_HEAD = 4096
+OVERLAY_HEAD = 64 * 1024
+# Libro anidado dentro del ZIP de un EXE: se carga en memoria hasta este tamaño
+NESTED_LIMIT = 64 * 1024 * 1024
+
+_OLE_MAGIC = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+_ZIP_MAGIC = b'PK\x03\x04'
+
+_OFFICE_DOCUMENT_REL = 'officeDocument'
+_UI_EXTENSIBILITY_REL = 'extensibility'
+_DOC_PROPERTIES = ('docProps/custom.xml', 'docProps/app.xml', 'docProps/core.xml')
+_SHEET_KINDS = {
+    'worksheet': 'worksheet',
+    'chartsheet': 'chartsheet',
+    'dialogsheet': 'dialogsheet',
+    'xlMacrosheet': 'macrosheet',
+    'xlIntlMacrosheet': 'intlmacrosheet',
+}
+
+_ATTR = re.compile(rb'([\w:]+)\s*=\s*(["\'])(.*?)\2', re.S)
+_SHEET = re.compile(rb'<(?:\w+:)?sheet\b([^>]*)/?>')
+_DEFINED_NAME = re.compile(rb'<(?:\w+:)?definedName\b([^>]*)>')
+_WORKBOOK_PROTECTION = re.compile(rb'<(?:\w+:)?workbookProtection\b')
+_FILE_SHARING = re.compile(rb'<(?:\w+:)?fileSharing\b([^>]*)')
+_SHEET_PROTECTION = re.compile(rb'<(?:\w+:)?sheetProtection\b')
+_CODE_NAME = re.compile(rb'<(?:\w+:)?sheetPr\b[^>]*?\bcodeName\s*=\s*(["\'])(.*?)\1')
+_PROJECT_MODULE = re.compile(rb'^(Module|Class|BaseClass|Document|Package)=([^\r\n]*)', re.M)
+_PROJECT_PASSWORD = re.compile(rb'^DPB="([0-9A-Fa-f]*)"', re.M)
+_PROJECT_PASSWORD_REMOVED = re.compile(rb'^DP[Xx]=', re.M)
+_EMBEDDED_WORKBOOK = re.compile(rb'[\w\\/:.~-]{1,200}\.xl[st][mxb]\b', re.IGNORECASE)
+_XLTOEXE_PART = re.compile(r'xlto_?exe', re.IGNORECASE)
+
+# Un DPB sin contraseña cifra un solo byte (a lo sumo 15 bytes, 30 hex); con
+# contraseña lleva el hash de 29 bytes (36 bytes o más, MS-OVBA 2.4.4)
+_PASSWORD_HEX_MIN = 72
+
+
+def _attrs(text):
+    return {key.decode('latin-1'): value.decode('utf-8', 'replace') for key, _, value in _ATTR.findall(text)}
+
+
+def _rel_type(rel):
+    return (rel.get('type') or '').rsplit('/', 1)[-1]
+
+
+def iter_candidates(paths):
+    """Archivos a clasificar: los indicados y los de las carpetas con extensión conocida."""
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for dirpath, dirs, files in os.walk(path):
+            dirs.sort()
+            for file in sorted(files):
+                if file.lower().endswith(TRIAGE_EXTENSIONS):
+                    yield os.path.join(dirpath, file)
+
+
+class FileTriage:
+    def __init__(self, path, matcher=None, sheet_limit=SHEET_LIMIT):
+        self.path = path
+        self.sheet_limit = sheet_limit
+        if matcher is None:
+            from cleaner.xlt_exe_cleaner import default_matcher
+            matcher = default_matcher()
+        self.matcher = matcher
+
+    def triage(self):
+        """Veredicto del archivo; los errores de lectura se informan en ``error``."""
+        result = {
+            'path': self.path,
+            'size': None,
+            'kind': 'unknown',
+            'xltoexe': False,
+            'markers': [],
+            'protections': {},
+            'vba': None,
+            'sheets': None,
+            'needs_pipeline': False,
+            'error': None,
+        }
+        try:
+            result['size'] = os.path.getsize(self.path)
+            with open(self.path, 'rb') as f:
+                magic = f.read(8)
+            if magic[:2] == b'MZ':
+                self._triage_exe(result)
+            elif zipfile.is_zipfile(self.path):
+                result['kind'] = 'ooxml'
+                self._triage_workbook(Package.from_zip(self.path), result)
+            elif magic == _OLE_MAGIC:
+                self._triage_ole(result)
+        except (OSError, ValueError, KeyError, struct.error, zipfile.BadZipFile) as e:
+            result['error'] = f'{type(e).__name__}: {e}'
+        result['needs_pipeline'] = bool(
+            result['xltoexe'] or any(result['protections'].values()) or result['vba']
+            or (result['sheets'] and result['sheets']['macro_sheets']))
+        return result
+
+    # Libros OOXML
+
+    def _triage_workbook(self, package, result, prefix=''):
+        with package:
+            for name in package:
+                if _XLTOEXE_PART.search(name):
+                    self._marker(result, prefix + name, [posixpath.basename(name)])
+            for name in _DOC_PROPERTIES:
+                if name in package:
+                    self._scan_markers(result, prefix + name, package.read(name))
+            workbook = None
+            for rel in package.relationships(''):
+                if rel['part'] not in package:
+                    continue
+                if _rel_type(rel) == _OFFICE_DOCUMENT_REL:
+                    workbook = rel['part']
+                elif _rel_type(rel) == _UI_EXTENSIBILITY_REL:
+                    self._scan_markers(result, prefix + rel['part'], package.read(rel['part']))
+            workbook = workbook or ('xl/workbook.xml' if 'xl/workbook.xml' in package else None)
+            protections = result['protections']
+            if workbook:
+                data = package.read(workbook)
+                self._scan_markers(result, prefix + workbook, data)
+                protections['workbook'] = bool(_WORKBOOK_PROTECTION.search(data))
+                sharing = _FILE_SHARING.search(data)
+                protections['file_sharing'] = bool(sharing and any(
+                    key.endswith(('Password', 'password', 'HashValue')) for key in _attrs(sharing.group(1))))
+                result['sheets'] = self._sheets(package, workbook, data)
+                protections['sheets'] = [s['name'] for s in result['sheets']['list'] if s['protected']]
+            vba_part = package.vba_project()
+            if vba_part:
+                result['vba'] = self._vba(package, vba_part, result, prefix)
+                protections['vba_password'] = result['vba']['password']
+
+    def _sheets(self, package, workbook, data):
+        targets = {rel['id']: rel for rel in package.relationships(workbook)}
+        sheets = []
+        for match in _SHEET.finditer(data):
+            attrs = _attrs(match.group(1))
+            rel_id = next((v for k, v in attrs.items() if k.endswith(':id')), None)
+            rel = targets.get(rel_id) or {}
+            part = rel.get('part')
+            sheet = {
+                'name': attrs.get('name'),
+                'state': attrs.get('state', 'visible'),
+                'kind': _SHEET_KINDS.get(_rel_type(rel), 'worksheet'),
+                'code_name': None,
+                'protected': None,
+            }
+            if part and part in package:
+                self._sheet_head(package, part, sheet)
+            sheets.append(sheet)
+        defined_names = [_attrs(m.group(1)) for m in _DEFINED_NAME.finditer(data)]
+        return {
+            'count': len(sheets),
+            'hidden': [s['name'] for s in sheets if s['state'] == 'hidden'],
+            'very_hidden': [s['name'] for s in sheets if s['state'] == 'veryHidden'],
+            'macro_sheets': [s['name'] for s in sheets if s['kind'] in ('macrosheet', 'intlmacrosheet')],
+            'defined_names': len(defined_names),
+            'hidden_names': sum(1 for n in defined_names if n.get('hidden') in ('1', 'true')),
+            'protection_unknown': sum(1 for s in sheets if s['protected'] is None),
+            'list': sheets,
+        }
+
+    def _sheet_head(self, package, part, sheet):
+        # Las hojas pequeñas se leen enteras; de las grandes sólo el comienzo y
+        # la protección queda como desconocida (None)
+        complete = package.size(part) <= self.sheet_limit
+        data = package.read_head(part, self.sheet_limit if complete else SHEET_HEAD)
+        code_name = _CODE_NAME.search(data, 0, SHEET_HEAD)
+        if code_name:
+            sheet['code_name'] = code_name.group(2).decode('utf-8', 'replace')
+        # Sólo se busca detrás de las celdas (o en todo lo leído si no se llegó a su final)
+        tail = max(data.rfind(b'sheetData>'), 0)
+        # Búsqueda literal primero: la expresión regular sólo confirma el candidato
+        index = data.find(b'sheetProtection', tail)
+        if index >= 0 and _SHEET_PROTECTION.search(data, max(index - 32, tail), index + 16):
+            sheet['protected'] = True
+        elif complete:
+            sheet['protected'] = False
+
+    def _vba(self, package, vba_part, result, prefix):
+        data = package.read(vba_part)
+        project = self._project_stream(data)
+        modules = []
+        for kind, value in _PROJECT_MODULE.findall(project):
+            name = value.split(b'/')[0].decode('latin-1').strip()
+            modules.append({'name': name, 'kind': kind.decode('ascii')})
+        self._scan_markers(result, prefix + vba_part, b'\n'.join(m['name'].encode('latin-1') for m in modules),
+                           ('vba_modules',))
+        password = _PROJECT_PASSWORD.search(project)
+        return {
+            'part': vba_part,
+            'size': package.size(vba_part),
+            'modules': modules,
+            'password': bool(password and len(password.group(1)) >= _PASSWORD_HEX_MIN),
+            'password_removed': bool(_PROJECT_PASSWORD_REMOVED.search(project)),
+        }
+
+    @staticmethod
+    def _project_stream(data):
+        """Contenido del stream PROJECT; si el OLE no se puede leer, el binario entero."""
+        import olefile
+        try:
+            ole = olefile.OleFileIO(data)
+        except (OSError, ValueError, struct.error):
+            return data
+        try:
+            for entry in ole.listdir(streams=True, storages=False):
+                if len(entry) == 1 and entry[0].upper() == 'PROJECT':
+                    return ole.openstream(entry).read()
+        finally:
+            ole.close()
+        return data
+
+    def _scan_markers(self, result, part, data, categories=None):
+        # Una misma firma suele estar en varias categorías: se informa el texto encontrado
+        data = bytes(data)
+        found = {data[start:end].decode('utf-8', 'replace') for start, end, label in self.matcher.finditer(data)
+                 if not categories or label in categories}
+        if found:
+            self._marker(result, part, sorted(found))
+
+    @staticmethod
+    def _marker(result, part, matches):
+        result['markers'].append({'part': part, 'matches': matches})
+        result['xltoexe'] = True
+
+    # Contenedores OLE (libros cifrados o .xls)
+
+    def _triage_ole(self, result):
+        import olefile
+        result['kind'] = 'ole'
+        with olefile.OleFileIO(self.path) as ole:
+            streams = {'/'.join(entry).lower() for entry in ole.listdir(streams=True, storages=True)}
+        result['protections']['encrypted'] = 'encryptioninfo' in streams and 'encryptedpackage' in streams
+        if any(name.startswith('_vba_project_cur/') for name in streams):
+            result['vba'] = {'part': '_VBA_PROJECT_CUR', 'modules': None, 'password': None}
+
+    # Ejecutables
+
+    def _triage_exe(self, result):
+        result['kind'] = 'exe'
+        exe = self._pe_headers()
+        result['exe'] = exe
+        if exe.get('overlay_size'):
+            with open(self.path, 'rb') as f:
+                f.seek(exe['overlay_offset'])
+                head = f.read(OVERLAY_HEAD)
+            exe['overlay_format'] = ('zip' if head.startswith(_ZIP_MAGIC)
+                                     else 'ole' if head.startswith(_OLE_MAGIC) else None)
+            self._scan_markers(result, 'overlay', head)
+            exe['embedded_names'] = sorted({m.decode('latin-1').strip() for m in _EMBEDDED_WORKBOOK.findall(head)})[:20]
+        if not zipfile.is_zipfile(self.path):
+            return
+        # ZIP añadido al ejecutable (autoextraíble): se clasifica el libro que contiene
+        with zipfile.ZipFile(self.path) as zf:
+            names = zf.namelist()
+            if 'xl/workbook.xml' in names:
+                exe['embedded_workbook'] = ''
+                self._triage_workbook(Package.from_zip(self.path), result, 'exe:')
+            else:
+                members = [info for info in zf.infolist()
+                           if info.filename.lower().endswith(WORKBOOK_EXTENSIONS) and not info.is_dir()]
+                if members:
+                    info = members[0]
+                    exe['embedded_workbook'] = info.filename
+                    if info.file_size <= NESTED_LIMIT:
+                        nested = io.BytesIO(zf.read(info))
+                        if zipfile.is_zipfile(nested):
+                            self._triage_workbook(Package.from_zip(nested), result, f'{info.filename}:')
+        if 'embedded_workbook' in exe:
+            self._marker(result, 'exe', [exe['embedded_workbook'] or 'xl/workbook.xml'])
+
+    def _pe_headers(self):
+        with open(self.path, 'rb') as f:
+            dos = f.read(64)
+            (pe_offset,) = struct.unpack_from('<I', dos, 0x3C)
+            f.seek(pe_offset)
+            header = f.read(24)
+            if header[:4] != b'PE\0\0':
+                raise ValueError('Cabecera PE no encontrada')
+            machine, section_count, timestamp, _, _, optional_size, characteristics = struct.unpack_from(
+                '<HHIIIHH', header, 4)
+            optional = f.read(optional_size)
+            sections = f.read(40 * section_count)
+        magic = struct.unpack_from('<H', optional, 0)[0] if len(optional) >= 2 else 0
+        end_of_image = 0
+        names = []
+        for index in range(section_count):
+            name, _, _, raw_size, raw_offset = struct.unpack_from('<8sIIII', sections, index * 40)
+            names.append(name.rstrip(b'\0').decode('latin-1'))
+            end_of_image = max(end_of_image, raw_offset + raw_size)
+        file_size = os.path.getsize(self.path)
+        # La firma Authenticode también va tras las secciones: no cuenta como overlay
+        security_dir = 128 if magic == 0x10B else 144
+        signature_offset = signature_size = 0
+        if len(optional) >= security_dir + 8:
+            signature_offset, signature_size = struct.unpack_from('<II', optional, security_dir)
+        overlay_end = file_size
+        if signature_size and signature_offset >= end_of_image and signature_offset + signature_size >= file_size:
+            overlay_end = signature_offset
+        return {
+            'machine': hex(machine),
+            'pe32_plus': magic == 0x20B,
+            'dll': bool(characteristics & 0x2000),
+            'timestamp': timestamp,
+            'sections': names,
+            'signed': bool(signature_size),
+            'overlay_offset': end_of_image,
+            'overlay_size': max(0, overlay_end - end_of_image),
+        }
+
+
+def triage_file(path, matcher=None, sheet_limit=SHEET_LIMIT):
+    return FileTriage(path, matcher, sheet_limit).triage()
+
+
+def triage_files(paths, workers=None, sheet_limit=SHEET_LIMIT):
+    """Clasifica ``paths`` (carpetas incluidas) en un pool de hilos; produce los resultados en orden."""
+    from cleaner.xlt_exe_cleaner import default_matcher
+    matcher = default_matcher()
+    files = list(iter_candidates(paths))
+    if len(files) <= 1:
+        for path in files:
+            yield triage_file(path, matcher, sheet_limit)
+        return
+    with ThreadPoolExecutor(max_workers=workers or min(32, (os.cpu_count() or 1) + 4),
+                            thread_name_prefix='xltoexe-triage') as pool:
+        yield from pool.map(lambda path: triage_file(path, matcher, sheet_limit), files)
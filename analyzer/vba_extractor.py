@@ -1,65 +1,50 @@
-import os
-import pathlib
-from oletools.olevba import VBA_Parser
+from extractor.package_index import Package
 
 class VBAExtractor:
     def __init__(self, working_dir):
-        self.working_dir = working_dir
+        # Acepta la ruta o un Package ya indexado
+        self.package = Package.coerce(working_dir)
+        self.working_dir = self.package.root
+        self.vba_part = self.package.vba_project()
         self.vba_path = self._find_vba_project()
         self.macros = []
 
     def _find_vba_project(self):
-        # Busca vbaProject.bin en la estructura extraída
-        for root, dirs, files in os.walk(self.working_dir):
-            for file in files:
-                if file.lower() == 'vbaproject.bin':
-                    return os.path.join(root, file)
-        return None
+        # Busca vbaProject.bin en el índice del paquete
+        if not self.vba_part:
+            return None
+        return self.package.path(self.vba_part) if self.package.root else self.vba_part
 
-    def extract_macros(self, export_dir=None):
+    def extract_macros(self, export_dir=None, export_format='dir'):
         if not self.vba_path:
             print('No se encontró vbaProject.bin')
             return []
-        vba_parser = VBA_Parser(self.vba_path)
+        # oletools tarda en importarse: sólo se carga cuando la etapa se ejecuta
+        from oletools.olevba import VBA_Parser
+        if self.package.root:
+            vba_parser = VBA_Parser(self.vba_path)
+        else:
+            # Paquete sin extraer: el proyecto se descomprime en memoria desde el ZIP
+            vba_parser = VBA_Parser(self.vba_path, data=self.package.read(self.vba_part))
+        extracted = []
         for (filename, stream_path, vba_filename, vba_code) in vba_parser.extract_macros():
             module_name = self._infer_module_name(vba_filename, stream_path)
             module_type = self._infer_module_type(vba_filename, stream_path)
-            macro = {
+            extracted.append({
                 'filename': vba_filename,
                 'stream_path': stream_path,
                 'module_name': module_name,
                 'type': module_type,
                 'code': vba_code,
                 'export_path': None,
-            }
-            if export_dir:
-                macro['export_path'] = self._export_macro(macro, export_dir)
-            self.macros.append(macro)
+            })
+        if export_dir and extracted:
+            # Un solo exportador para todos los módulos (nombres repetidos incluidos)
+            from builder.macro_exporter import export_macros
+            export_macros(extracted, export_dir, export_format, source=self.vba_path)
+        self.macros.extend(extracted)
         return self.macros
 
-    @staticmethod
-    def _export_macro(macro, export_dir):
-        os.makedirs(export_dir, exist_ok=True)
-        name = macro['module_name'] or macro['filename'] or 'Module'
-        safe_name = ''.join(ch if ch.isalnum() or ch in ('_', '-') else '_' for ch in name)
-        module_type = macro.get('type', 'std')
-
-        if module_type == 'form':
-            extension = '.frm'
-        elif module_type in ('class', 'document'):
-            extension = '.cls'
-        else:
-            extension = '.bas'
-
-        filename = safe_name
-        if not filename.lower().endswith(extension):
-            filename += extension
-
-        path = pathlib.Path(export_dir) / filename
-        with open(path, 'w', encoding='utf-8', newline='\r\n') as f:
-            f.write(macro['code'])
-        return str(path)
-
     @staticmethod
     def _infer_module_name(vba_filename, stream_path):
         name = vba_filename or ''
@@ -1,22 +1,23 @@
 import os
 import shutil
 import tempfile
-from oletools.olevba import VBA_Parser
+
+from extractor.package_index import Package
 
 class VBAProjectEditor:
     """
     Permite reemplazar módulos VBA dentro de vbaProject.bin usando un enfoque de extracción y reinserción.
     """
     def __init__(self, working_dir):
-        self.working_dir = working_dir
+        # Acepta la ruta o un Package ya indexado
+        self.package = Package.coerce(working_dir)
+        self.working_dir = self.package.root
         self.vba_path = self._find_vba_project()
 
     def _find_vba_project(self):
-        for root, dirs, files in os.walk(self.working_dir):
-            for file in files:
-                if file.lower() == 'vbaproject.bin':
-                    return os.path.join(root, file)
-        return None
+        # Busca vbaProject.bin en el índice del paquete
+        vba_part = self.package.vba_project()
+        return self.package.path(vba_part) if vba_part else None
 
     def extract_modules(self):
         """
@@ -24,6 +25,7 @@ class VBAProjectEditor:
         """
         if not self.vba_path:
             return []
+        from oletools.olevba import VBA_Parser
         vba_parser = VBA_Parser(self.vba_path)
         modules = []
         for (_, _, vba_filename, vba_code) in vba_parser.extract_macros():
@@ -0,0 +1,412 @@
+"""
+Análisis del contenido del libro: hojas, nombres definidos y fórmulas.
+
+Cada hoja (de cálculo, de macros XLM, de diálogo) se recorre con ``iterparse``
+liberando cada fila al terminarla, así que la memoria no depende del número de
+celdas. Las hojas se reparten entre procesos y los resultados se guardan en
+columnas (``array`` para los números, listas para los textos).
+
+Se marcan las fórmulas y nombres que usan funciones XLM con las que los
+cargadores ejecutan código: EXEC, CALL, REGISTER, FORMULA, GET.WORKSPACE...
+
+Lo mismo se busca en las cadenas compartidas, donde los cargadores guardan el
+texto de las fórmulas que luego escriben con FORMULA(): se recorren una vez
+sin cargar la tabla (``iter_shared_strings``), las hojas anotan sólo las
+celdas que usan una cadena marcada y el texto de las que se informan se lee
+con el índice de desplazamientos de ``SharedStrings``.
+"""
+import io
+import logging
+import os
+import re
+import xml.etree.ElementTree as ET
+from array import array
+
+from analyzer.package_validator import OFFICE_DOCUMENT_REL, rel_type_is
+from analyzer.shared_strings import SharedStrings, iter_shared_strings, shared_strings_part
+from extractor.package_index import Package
+from utils.helpers import process_pool
+
+_MAIN_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+_REL_ID = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id'
+_ROW = f'{_MAIN_NS}row'
+_CELL = f'{_MAIN_NS}c'
+_FORMULA = f'{_MAIN_NS}f'
+_VALUE = f'{_MAIN_NS}v'
+_COL = f'{_MAIN_NS}col'
+_SHEET_DATA = f'{_MAIN_NS}sheetData'
+_SHEET = f'{_MAIN_NS}sheet'
+_DEFINED_NAME = f'{_MAIN_NS}definedName'
+
+# Tipo de relación -> tipo de hoja
+SHEET_KINDS = {
+    'worksheet': 'worksheet',
+    'chartsheet': 'chartsheet',
+    'dialogsheet': 'dialogsheet',
+    'xlMacrosheet': 'macrosheet',
+    'xlIntlMacrosheet': 'intlmacrosheet',
+}
+MACRO_SHEET_KINDS = ('macrosheet', 'intlmacrosheet')
+
+# Indicadores (bits) de una fórmula o nombre
+FLAGS = {
+    'EXEC': 1 << 0,
+    'CALL': 1 << 1,
+    'REGISTER': 1 << 2,
+    'FORMULA': 1 << 3,
+    'RUN': 1 << 4,
+    'FILE_IO': 1 << 5,
+    'ENVIRONMENT': 1 << 6,
+    'SET': 1 << 7,
+    'NETWORK': 1 << 8,
+    'CHAR': 1 << 9,
+    'AUTO_OPEN': 1 << 10,
+    'HIDDEN': 1 << 11,
+}
+# HIDDEN y CHAR por sí solos no hacen sospechosa una fórmula
+SUSPICIOUS_MASK = sum(bit for label, bit in FLAGS.items() if label not in ('HIDDEN', 'CHAR'))
+
+_PATTERNS = re.compile(r'''
+    (?P<EXEC>\bEXEC\s*\()
+  | (?P<CALL>\bCALL\s*\()
+  | (?P<REGISTER>\bREGISTER(?:\.ID)?\s*\()
+  | (?P<FORMULA>\bFORMULA(?:\.FILL|\.ARRAY)?\s*\()
+  | (?P<RUN>\b(?:RUN|GOTO)\s*\()
+  | (?P<FILE_IO>\bF(?:OPEN|WRITE|WRITELN|READ|CLOSE)\s*\()
+  | (?P<ENVIRONMENT>\bGET\.(?:WORKSPACE|WINDOW|DOCUMENT|CELL)\s*\()
+  | (?P<SET>\bSET\.(?:VALUE|NAME)\s*\()
+  | (?P<NETWORK>URLDownloadToFile|\bWEBSERVICE\s*\(|https?://)
+  | (?P<CHAR>\bCHAR\s*\()
+''', re.IGNORECASE | re.VERBOSE)
+_AUTO_OPEN = re.compile(r'(?:^|\.)auto_(?:open|close|activate|deactivate)', re.IGNORECASE)
+
+MAX_REPORTED = 200
+# XML de hojas a partir del cual compensa repartirlas entre procesos: arrancar
+# un pool propio cuesta 0,05-0,15 s (varios MB de análisis en el propio
+# proceso); con el pool ya caliente del orquestador sólo se paga el envío
+PARALLEL_MIN_BYTES = 4 * 1024 * 1024
+EXECUTOR_MIN_BYTES = 256 * 1024
+
+
+def formula_flags(text):
+    flags = 0
+    for match in _PATTERNS.finditer(text):
+        flags |= FLAGS[match.lastgroup]
+    return flags
+
+
+def flag_labels(flags):
+    return [label for label, bit in FLAGS.items() if flags & bit]
+
+
+def column_index(ref):
+    """'AB12' -> 28 (columnas desde 1)."""
+    index = 0
+    for ch in ref:
+        if 'A' <= ch <= 'Z':
+            index = index * 26 + ord(ch) - 64
+        elif 'a' <= ch <= 'z':
+            index = index * 26 + ord(ch) - 96
+        else:
+            break
+    return index
+
+
+def column_name(index):
+    name = ''
+    while index:
+        index, rest = divmod(index - 1, 26)
+        name = chr(65 + rest) + name
+    return name
+
+
+def scan_sheet(source, keep_all, strings=None):
+    """
+    Recorre una hoja y devuelve sus columnas de fórmulas.
+
+    ``source`` es la ruta de la parte, sus bytes o un SharedBuffer con ellos.
+    Con ``keep_all`` se guardan todas las fórmulas; si no, sólo las marcadas (el
+    resto sólo se cuenta). ``strings`` (índice de cadena compartida ->
+    indicadores) son las cadenas marcadas: se anotan las celdas que las usan.
+    """
+    strings = strings or {}
+    if isinstance(source, (str, bytes, bytearray)):
+        return _scan_sheet(io.BytesIO(source) if not isinstance(source, str) else source, keep_all, strings)
+    from utils.shared_buffers import BufferReader
+    reader = BufferReader(source.view())
+    try:
+        return _scan_sheet(io.BufferedReader(reader), keep_all, strings)
+    finally:
+        reader.close()
+        source.close()
+
+
+def _scan_sheet(source, keep_all, strings):
+    rows, cols, flags, texts = array('I'), array('I'), array('I'), []
+    string_rows, string_cols, string_flags, string_ids = array('I'), array('I'), array('I'), array('I')
+    cells = formulas = 0
+    hidden_cols = []
+    sheet_data = None
+    for event, elem in ET.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            if elem.tag == _SHEET_DATA:
+                sheet_data = elem
+            continue
+        if elem.tag == _COL:
+            if elem.get('hidden') in ('1', 'true'):
+                hidden_cols.append((int(elem.get('min', 0)), int(elem.get('max', 0))))
+        elif elem.tag == _ROW:
+            row_hidden = elem.get('hidden') in ('1', 'true')
+            row_number = int(elem.get('r', 0))
+            for cell in elem:
+                if cell.tag != _CELL:
+                    continue
+                cells += 1
+                formula = cell.find(_FORMULA)
+                if formula is None or not formula.text:
+                    if strings and cell.get('t') == 's':
+                        value = cell.find(_VALUE)
+                        index = int(value.text) if value is not None and (value.text or '').isdigit() else -1
+                        if index in strings:
+                            col = column_index(cell.get('r', ''))
+                            cell_flags = strings[index]
+                            if row_hidden or any(low <= col <= high for low, high in hidden_cols):
+                                cell_flags |= FLAGS['HIDDEN']
+                            string_rows.append(row_number)
+                            string_cols.append(col)
+                            string_flags.append(cell_flags)
+                            string_ids.append(index)
+                    continue
+                formulas += 1
+                ref = cell.get('r', '')
+                col = column_index(ref)
+                cell_flags = formula_flags(formula.text)
+                if row_hidden or any(low <= col <= high for low, high in hidden_cols):
+                    cell_flags |= FLAGS['HIDDEN']
+                if keep_all or cell_flags & SUSPICIOUS_MASK:
+                    rows.append(row_number)
+                    cols.append(col)
+                    flags.append(cell_flags)
+                    texts.append(formula.text)
+            # Soltar las filas ya procesadas: memoria constante por hoja
+            if sheet_data is not None:
+                sheet_data.clear()
+            else:
+                elem.clear()
+    return {'cells': cells, 'formulas': formulas, 'rows': rows, 'cols': cols, 'flags': flags, 'texts': texts,
+            'strings': {'rows': string_rows, 'cols': string_cols, 'flags': string_flags, 'ids': string_ids}}
+
+
+class FormulaTable:
+    """Fórmulas en columnas: hoja (índice), fila, columna, indicadores y texto."""
+
+    def __init__(self):
+        self.sheet = array('H')
+        self.row = array('I')
+        self.col = array('I')
+        self.flags = array('I')
+        self.text = []
+
+    def extend(self, sheet_index, columns):
+        count = len(columns['texts'])
+        self.sheet.extend(array('H', [sheet_index]) * count)
+        self.row.extend(columns['rows'])
+        self.col.extend(columns['cols'])
+        self.flags.extend(columns['flags'])
+        self.text.extend(columns['texts'])
+
+    def __len__(self):
+        return len(self.text)
+
+    def where(self, mask):
+        """Posiciones cuyas marcas intersecan ``mask``."""
+        return [i for i, value in enumerate(self.flags) if value & mask]
+
+
+class WorkbookScanner:
+    def __init__(self, working_dir, keep_all_formulas=False, max_workers=None, executor=None):
+        # Acepta la ruta o un Package ya indexado
+        self.package = Package.coerce(working_dir)
+        self.working_dir = self.package.root
+        self.keep_all_formulas = keep_all_formulas
+        self.max_workers = max_workers
+        self.executor = executor
+        self.sheets = []
+        self.names = {'name': [], 'sheet': array('i'), 'hidden': array('B'), 'formula': [], 'flags': array('I')}
+        self.formulas = FormulaTable()
+        self.strings = self._string_cells()
+
+    @staticmethod
+    def _string_cells():
+        # Celdas que usan una cadena compartida marcada, en columnas
+        return {'sheet': array('H'), 'row': array('I'), 'col': array('I'), 'flags': array('I'), 'id': array('I'),
+                'text': {}}
+
+    def scan(self):
+        """Analiza el libro y devuelve el resumen (ver ``summary``)."""
+        self.sheets = []
+        self.names = {'name': [], 'sheet': array('i'), 'hidden': array('B'), 'formula': [], 'flags': array('I')}
+        self.formulas = FormulaTable()
+        self.strings = self._string_cells()
+        workbook = self._workbook_part()
+        if workbook is None:
+            logging.warning("No se encontró el libro principal para analizar.")
+            return self.summary()
+        self._read_workbook(workbook)
+        strings = self._flag_shared_strings()
+
+        jobs = [(index, sheet) for index, sheet in enumerate(self.sheets) if sheet['part'] in self.package]
+        keep = [self.keep_all_formulas or sheet['kind'] in MACRO_SHEET_KINDS for _, sheet in jobs]
+        workers = self._workers([sheet['part'] for _, sheet in jobs])
+        arena = None
+        if not self.package.root and workers != 1:
+            from utils.shared_buffers import SharedArena
+            arena = SharedArena()
+        try:
+            sources = [self._source(sheet['part'], arena) for _, sheet in jobs]
+            for (index, sheet), columns in zip(jobs, self._map(sources, keep, [strings] * len(jobs), workers)):
+                sheet['cells'] = columns['cells']
+                sheet['formulas'] = columns['formulas']
+                sheet['suspicious'] = sum(1 for value in columns['flags'] if value & SUSPICIOUS_MASK)
+                sheet['suspicious_strings'] = len(columns['strings']['ids'])
+                self.formulas.extend(index, columns)
+                self._add_string_cells(index, columns['strings'])
+        finally:
+            if arena is not None:
+                arena.close()
+        self._resolve_strings()
+        return self.summary()
+
+    def _flag_shared_strings(self):
+        """Índice -> indicadores de las cadenas compartidas sospechosas (un recorrido, memoria constante)."""
+        part = shared_strings_part(self.package)
+        if part is None:
+            return {}
+        source = self.package.path(part) if self.package.root else io.BytesIO(self.package.read(part))
+        flagged = {}
+        for index, text in enumerate(iter_shared_strings(source)):
+            flags = formula_flags(text)
+            if flags & SUSPICIOUS_MASK:
+                flagged[index] = flags
+        return flagged
+
+    def _add_string_cells(self, sheet_index, columns):
+        count = len(columns['ids'])
+        self.strings['sheet'].extend(array('H', [sheet_index]) * count)
+        self.strings['row'].extend(columns['rows'])
+        self.strings['col'].extend(columns['cols'])
+        self.strings['flags'].extend(columns['flags'])
+        self.strings['id'].extend(columns['ids'])
+
+    def _resolve_strings(self):
+        # Sólo se lee el texto de las cadenas que se van a informar
+        wanted = set(self.strings['id'][:MAX_REPORTED])
+        if not wanted:
+            return
+        part = shared_strings_part(self.package)
+        if self.package.root:
+            with SharedStrings(self.package.path(part)) as table:
+                self.strings['text'] = {index: table[index] for index in wanted}
+        else:
+            self.strings['text'] = {index: text for index, text in
+                                    enumerate(iter_shared_strings(io.BytesIO(self.package.read(part))))
+                                    if index in wanted}
+
+    def _workers(self, parts):
+        """0: pool del llamador; 1: en este proceso; n: pool propio de n procesos."""
+        if len(parts) < 2:
+            return 1
+        total = sum(self.package.size(part) for part in parts)
+        if self.executor is not None:
+            return 0 if total >= EXECUTOR_MIN_BYTES else 1
+        if total < PARALLEL_MIN_BYTES:
+            return 1
+        return min(self.max_workers or os.cpu_count() or 1, len(parts))
+
+    def _map(self, sources, keep, strings, workers):
+        if workers == 0:
+            return self.executor.map(scan_sheet, sources, keep, strings)
+        if workers <= 1:
+            return map(scan_sheet, sources, keep, strings)
+        with process_pool(workers) as pool:
+            return list(pool.map(scan_sheet, sources, keep, strings))
+
+    def _source(self, part, arena=None):
+        # Los procesos reciben la ruta; sin directorio de trabajo, la hoja se
+        # descomprime en memoria compartida (o en bytes si no hay procesos)
+        if self.package.root:
+            return self.package.path(part)
+        if arena is None:
+            return self.package.read(part)
+        buffer = arena.allocate(self.package.size(part))
+        with buffer.view() as view:
+            self.package.readinto(part, view)
+        return buffer
+
+    def _workbook_part(self):
+        for rel in self.package.relationships(''):
+            if rel_type_is(rel, OFFICE_DOCUMENT_REL) and rel['part'] in self.package:
+                return rel['part']
+        return 'xl/workbook.xml' if 'xl/workbook.xml' in self.package else None
+
+    def _read_workbook(self, workbook):
+        targets = {rel['id']: rel for rel in self.package.relationships(workbook)}
+        for _, elem in ET.iterparse(io.BytesIO(self.package.read(workbook))):
+            if elem.tag == _SHEET:
+                rel = targets.get(elem.get(_REL_ID)) or {}
+                kind = SHEET_KINDS.get((rel.get('type') or '').rsplit('/', 1)[-1], 'worksheet')
+                self.sheets.append({'name': elem.get('name'), 'part': rel.get('part'), 'kind': kind,
+                                    'state': elem.get('state', 'visible'), 'cells': 0, 'formulas': 0,
+                                    'suspicious': 0, 'suspicious_strings': 0})
+            elif elem.tag == _DEFINED_NAME:
+                name = elem.get('name', '')
+                text = elem.text or ''
+                flags = formula_flags(text)
+                if _AUTO_OPEN.search(name):
+                    flags |= FLAGS['AUTO_OPEN']
+                hidden = elem.get('hidden') in ('1', 'true')
+                if hidden:
+                    flags |= FLAGS['HIDDEN']
+                self.names['name'].append(name)
+                self.names['sheet'].append(int(elem.get('localSheetId', -1)))
+                self.names['hidden'].append(hidden)
+                self.names['formula'].append(text)
+                self.names['flags'].append(flags)
+            elem.clear()
+
+    def summary(self):
+        suspicious = self.formulas.where(SUSPICIOUS_MASK)
+        strings = self.strings
+        names = [i for i, value in enumerate(self.names['flags']) if value & (SUSPICIOUS_MASK | FLAGS['HIDDEN'])]
+        for i in suspicious[:MAX_REPORTED]:
+            logging.info("Fórmula sospechosa en %s!%s%d: %s", self.sheets[self.formulas.sheet[i]]['name'],
+                         column_name(self.formulas.col[i]), self.formulas.row[i], self.formulas.text[i][:200])
+        for i in range(min(len(strings['id']), MAX_REPORTED)):
+            logging.info("Cadena sospechosa en %s!%s%d: %s", self.sheets[strings['sheet'][i]]['name'],
+                         column_name(strings['col'][i]), strings['row'][i],
+                         strings['text'].get(strings['id'][i], '')[:200])
+        return {
+            'sheets': [dict(sheet) for sheet in self.sheets],
+            'hidden_sheets': [sheet['name'] for sheet in self.sheets if sheet['state'] != 'visible'],
+            'macro_sheets': [sheet['name'] for sheet in self.sheets if sheet['kind'] in MACRO_SHEET_KINDS],
+            'defined_names_total': len(self.names['name']),
+            'defined_names': [
+                {'name': self.names['name'][i], 'local_sheet': self.names['sheet'][i] if self.names['sheet'][i] >= 0
+                 else None, 'formula': self.names['formula'][i][:200], 'flags': flag_labels(self.names['flags'][i])}
+                for i in names[:MAX_REPORTED]
+            ],
+            'suspicious_total': len(suspicious),
+            'suspicious_formulas': [
+                {'sheet': self.sheets[self.formulas.sheet[i]]['name'],
+                 'cell': f'{column_name(self.formulas.col[i])}{self.formulas.row[i]}',
+                 'formula': self.formulas.text[i][:200], 'flags': flag_labels(self.formulas.flags[i])}
+                for i in suspicious[:MAX_REPORTED]
+            ],
+            'suspicious_strings_total': len(strings['id']),
+            'suspicious_strings': [
+                {'sheet': self.sheets[strings['sheet'][i]]['name'],
+                 'cell': f"{column_name(strings['col'][i])}{strings['row'][i]}",
+                 'text': strings['text'].get(strings['id'][i], '')[:200], 'flags': flag_labels(strings['flags'][i])}
+                for i in range(min(len(strings['id']), MAX_REPORTED))
+            ],
+        }
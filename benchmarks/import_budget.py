@@ -0,0 +1,110 @@
+"""
+Control del presupuesto de importación del CLI y de los módulos de etapa.
+
+Comprueba, en intérpretes nuevos, que:
+  * ``import main`` cabe en el presupuesto (``-X importtime``),
+  * ningún módulo de etapa carga dependencias pesadas al importarse,
+  * ``main.py --help`` arranca en el tiempo indicado.
+
+Uso: python -m benchmarks.import_budget --budget-ms 60 --help-budget-ms 400
+Devuelve código 1 si se supera algún límite.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+HEAVY_MODULES = ('oletools', 'olefile', 'pefile', 'lxml', 'openpyxl', 'xlwings', 'flet', 'pyparsing', 'numpy')
+
+STAGE_MODULES = (
+    'extractor.exe_detector',
+    'extractor.xlsm_unpacker',
+    'extractor.zip_handler',
+    'cleaner.protection_remover',
+    'cleaner.xlt_exe_cleaner',
+    'analyzer.vba_extractor',
+    'analyzer.vba_project_editor',
+    'analyzer.structure_checker',
+    'deobfuscator.vba_deobfuscator',
+    'deobfuscator.advanced_vba_deobfuscator',
+    'deobfuscator.vba_optimizer',
+    'deobfuscator.identifier_scorer',
+    'builder.xlsm_rebuilder',
+    'builder.manual_exporter',
+    'builder.macro_injector',
+    'report.report_generator',
+)
+
+
+def import_profile(module):
+    """Importa ``module`` en un proceso nuevo y devuelve (ms acumulados, módulos cargados)."""
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                          cwd=REPO_ROOT, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f'No se pudo importar {module}:\n{proc.stderr}')
+    loaded = set()
+    cumulative_us = 0
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        name = name.strip()
+        loaded.add(name)
+        if name == module and cumulative.strip().isdigit():
+            cumulative_us = int(cumulative)
+    return cumulative_us / 1000.0, loaded
+
+
+def heavy_in(loaded):
+    return sorted({name for name in loaded for heavy in HEAVY_MODULES
+                   if name == heavy or name.startswith(heavy + '.')})
+
+
+def help_startup_ms(runs):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, 'main.py', '--help'], cwd=REPO_ROOT,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Presupuesto de tiempo de importación.')
+    parser.add_argument('--budget-ms', type=float, default=60.0, help='Máximo acumulado para `import main`')
+    parser.add_argument('--help-budget-ms', type=float, default=400.0, help='Máximo para `main.py --help` (mediana)')
+    parser.add_argument('--runs', type=int, default=5, help='Repeticiones de `main.py --help`')
+    args = parser.parse_args()
+
+    failures = []
+    main_ms, loaded = import_profile('main')
+    print(f'import main: {main_ms:.1f} ms')
+    if main_ms > args.budget_ms:
+        failures.append(f'import main tarda {main_ms:.1f} ms (presupuesto {args.budget_ms} ms)')
+    if heavy_in(loaded):
+        failures.append(f'import main carga dependencias pesadas: {", ".join(heavy_in(loaded))}')
+
+    for module in STAGE_MODULES:
+        module_ms, loaded = import_profile(module)
+        heavy = heavy_in(loaded)
+        print(f'  {module:<42}{module_ms:>8.1f} ms{"  PESADO: " + ", ".join(heavy) if heavy else ""}')
+        if heavy:
+            failures.append(f'{module} importa {", ".join(heavy)} al cargarse')
+
+    help_ms = help_startup_ms(args.runs)
+    print(f'main.py --help: {help_ms:.1f} ms (mediana de {args.runs})')
+    if help_ms > args.help_budget_ms:
+        failures.append(f'main.py --help tarda {help_ms:.1f} ms (presupuesto {args.help_budget_ms} ms)')
+
+    for failure in failures:
+        print(f'FALLO: {failure}')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
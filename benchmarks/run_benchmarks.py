@@ -0,0 +1,186 @@
+"""
+Benchmarks del pipeline sobre libros sintéticos de tamaño escalable.
+
+Uso (desde la raíz del repositorio):
+
+    python -m benchmarks.run_benchmarks --sizes small medium --repeat 3
+    python -m benchmarks.run_benchmarks --custom sheets=40 modules=200 --output resultados.json
+    python -m benchmarks.run_benchmarks --compare benchmarks/results/base.json --threshold 0.15
+
+Cada etapa se mide con StageProfiler y los resultados se guardan como JSON
+junto con el commit actual, de modo que dos ejecuciones se puedan comparar.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from benchmarks.synthetic_workbook import PRESETS, SyntheticWorkbookSpec, build_synthetic_xlsm
+from utils.helpers import file_size
+from utils.profiler import StageProfiler
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+
+def run_pipeline_once(xlsm_path, work_root, profiler):
+    """Ejecuta todas las etapas medibles sobre una copia nueva del libro."""
+    from analyzer.vba_extractor import VBAExtractor
+    from builder.xlsm_rebuilder import XLSMRebuilder
+    from cleaner.protection_remover import ProtectionRemover
+    from deobfuscator.advanced_vba_deobfuscator import AdvancedVBADeobfuscator
+    from deobfuscator.vba_deobfuscator import VBADeobfuscator
+    from deobfuscator.vba_optimizer import VBAOptimizer
+    from extractor.package_index import Package
+    from extractor.xlsm_unpacker import XLSMUnpacker
+
+    working_dir = tempfile.mkdtemp(prefix='bench_', dir=work_root)
+    package = None
+    try:
+        with profiler.stage('unpack', lambda: file_size(xlsm_path)):
+            XLSMUnpacker(xlsm_path, working_dir).unpack()
+            package = Package.from_zip(xlsm_path, working_dir)
+        remover = ProtectionRemover(package)
+        with profiler.stage('protection.sheets_workbook', lambda: package.total_size(('.xml',))):
+            remover.remove_sheet_and_workbook_protection()
+        with profiler.stage('protection.vba_password', lambda: package.total_size(('vbaproject.bin',))):
+            remover.remove_vba_project_password()
+        with profiler.stage('vba_extract', lambda: package.total_size(('vbaproject.bin',))):
+            macros = VBAExtractor(package).extract_macros()
+        code_size = sum(len(m['code']) for m in macros)
+        with profiler.stage('deobfuscate.basic', code_size):
+            basic = VBADeobfuscator(macros).deobfuscate()
+        with profiler.stage('deobfuscate.advanced', code_size):
+            AdvancedVBADeobfuscator(macros).deobfuscate()
+        with profiler.stage('optimize', code_size):
+            VBAOptimizer(basic).optimize()
+        output_path = os.path.join(work_root, 'reconstruido.xlsm')
+        with profiler.stage('rebuild', package.total_size):
+            XLSMRebuilder(package).rebuild(output_path)
+    finally:
+        if package is not None:
+            package.close()
+        shutil.rmtree(working_dir, ignore_errors=True)
+
+
+def benchmark_size(name, spec, repeat, work_root):
+    xlsm_path = os.path.join(work_root, f'{name}.xlsm')
+    size = build_synthetic_xlsm(xlsm_path, spec)
+    runs = []
+    for _ in range(repeat):
+        profiler = StageProfiler(enabled=True)
+        run_pipeline_once(xlsm_path, work_root, profiler)
+        runs.append(profiler.records)
+
+    stages = {}
+    for records in runs:
+        for record in records:
+            entry = stages.setdefault(record['stage'], {'seconds': [], 'bytes': record['bytes']})
+            entry['seconds'].append(record['seconds'])
+    for entry in stages.values():
+        samples = entry.pop('seconds')
+        entry['min'] = min(samples)
+        entry['median'] = statistics.median(samples)
+        entry['mean'] = statistics.fmean(samples)
+        entry['samples'] = samples
+    return {'spec': spec.to_dict(), 'input_bytes': size, 'stages': stages}
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_results(current, baseline, threshold):
+    """Devuelve las etapas cuya mediana empeoró más que ``threshold`` (fracción)."""
+    regressions = []
+    for size_name, size_result in current['sizes'].items():
+        base_size = baseline.get('sizes', {}).get(size_name)
+        if not base_size:
+            continue
+        for stage, entry in size_result['stages'].items():
+            base_entry = base_size['stages'].get(stage)
+            if not base_entry or base_entry['median'] <= 0:
+                continue
+            ratio = entry['median'] / base_entry['median']
+            print(f"{size_name:<10}{stage:<30}{base_entry['median']:>10.4f}{entry['median']:>10.4f}{ratio:>8.2f}x")
+            if ratio > 1 + threshold:
+                regressions.append((size_name, stage, ratio))
+    return regressions
+
+
+def _parse_custom(values):
+    params = {}
+    for item in values:
+        key, _, value = item.partition('=')
+        if not hasattr(SyntheticWorkbookSpec(), key):
+            raise SystemExit(f'Parámetro desconocido para --custom: {key}')
+        params[key] = float(value) if key == 'obfuscation' else int(value)
+    return SyntheticWorkbookSpec(**params)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks del desofuscador sobre libros sintéticos.')
+    parser.add_argument('--sizes', nargs='*', default=['small', 'medium'], choices=sorted(PRESETS),
+                        help='Tamaños predefinidos a medir')
+    parser.add_argument('--custom', nargs='*', default=[], metavar='CLAVE=VALOR',
+                        help='Tamaño adicional (sheets, cells_per_sheet, shared_strings, media, modules, obfuscation...)')
+    parser.add_argument('--repeat', type=int, default=3, help='Repeticiones por tamaño')
+    parser.add_argument('--output', help='Archivo JSON de resultados (por defecto benchmarks/results/)')
+    parser.add_argument('--compare', help='JSON de una ejecución anterior contra el que comparar')
+    parser.add_argument('--threshold', type=float, default=0.15,
+                        help='Empeoramiento relativo de la mediana que se considera regresión')
+    args = parser.parse_args()
+
+    sizes = {name: PRESETS[name] for name in args.sizes}
+    if args.custom:
+        sizes['custom'] = _parse_custom(args.custom)
+
+    revision = git_revision()
+    result = {
+        'revision': revision,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'repeat': args.repeat,
+        'sizes': {},
+    }
+    work_root = tempfile.mkdtemp(prefix='xltoexe_bench_')
+    try:
+        for name, spec in sizes.items():
+            print(f'Midiendo tamaño {name}...')
+            result['sizes'][name] = benchmark_size(name, spec, args.repeat, work_root)
+            for stage, entry in result['sizes'][name]['stages'].items():
+                print(f"  {stage:<30}{entry['median']:>10.4f} s")
+    finally:
+        shutil.rmtree(work_root, ignore_errors=True)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"bench_{revision or 'local'}_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(result, f, indent=2)
+    print(f'Resultados guardados en {output}')
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_results(result, baseline, args.threshold)
+        if regressions:
+            for size_name, stage, ratio in regressions:
+                print(f'REGRESIÓN: {size_name}/{stage} {ratio:.2f}x más lento')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
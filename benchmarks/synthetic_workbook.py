@@ -0,0 +1,290 @@
+"""
+Generador de libros .xlsm sintéticos con el aspecto de los protegidos por XLtoEXE.
+
+Todos los tamaños son parametrizables (hojas, celdas por hoja, cadenas
+compartidas, imágenes, módulos VBA y densidad de ofuscación) y la salida es
+determinista para una misma semilla.
+"""
+import os
+import random
+import zipfile
+
+from benchmarks.vba_project_writer import build_vba_project
+
+NS_MAIN = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+NS_REL = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+NS_PKG_REL = 'http://schemas.openxmlformats.org/package/2006/relationships'
+REL_BASE = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+
+READABLE_WORDS = [
+    'total', 'importe', 'cliente', 'factura', 'fecha', 'cuenta', 'saldo', 'asiento',
+    'periodo', 'empresa', 'registro', 'detalle', 'proveedor', 'ventas', 'compras',
+    'amount', 'customer', 'invoice', 'balance', 'ledger', 'report', 'index', 'value',
+]
+CONSONANTS = 'bcdfghjklmnpqrstvwxz'
+
+
+class SyntheticWorkbookSpec:
+    def __init__(self, sheets=4, cells_per_sheet=2000, shared_strings=1000, media=4,
+                 modules=10, obfuscation=0.5, lines_per_module=120, media_size=64 * 1024, seed=1234):
+        self.sheets = sheets
+        self.cells_per_sheet = cells_per_sheet
+        self.shared_strings = shared_strings
+        self.media = media
+        self.modules = modules
+        self.obfuscation = obfuscation
+        self.lines_per_module = lines_per_module
+        self.media_size = media_size
+        self.seed = seed
+
+    def to_dict(self):
+        return dict(vars(self))
+
+
+PRESETS = {
+    'small': SyntheticWorkbookSpec(sheets=2, cells_per_sheet=500, shared_strings=200, media=2, modules=4),
+    'medium': SyntheticWorkbookSpec(sheets=8, cells_per_sheet=5000, shared_strings=5000, media=10, modules=25),
+    'large': SyntheticWorkbookSpec(sheets=20, cells_per_sheet=25000, shared_strings=50000, media=40,
+                                   modules=80, media_size=256 * 1024),
+}
+
+
+def _column_name(index):
+    name = ''
+    index += 1
+    while index:
+        index, rem = divmod(index - 1, 26)
+        name = chr(65 + rem) + name
+    return name
+
+
+def _obfuscated_name(rnd):
+    if rnd.random() < 0.3:
+        return rnd.choice('abcdefghijklmnopqrstuvwxyz') + str(rnd.randint(1, 999))
+    return ''.join(rnd.choice(CONSONANTS) for _ in range(rnd.randint(10, 30)))
+
+
+def _identifier(rnd, obfuscation):
+    if rnd.random() < obfuscation:
+        return _obfuscated_name(rnd)
+    return rnd.choice(READABLE_WORDS) + rnd.choice(READABLE_WORDS).capitalize() + str(rnd.randint(1, 99))
+
+
+def _module_code(rnd, spec):
+    lines = []
+    while len(lines) < spec.lines_per_module:
+        proc = _identifier(rnd, spec.obfuscation)
+        kind = rnd.choice(['Sub', 'Function'])
+        lines.append(f'{kind} {proc}()')
+        names = [_identifier(rnd, spec.obfuscation) for _ in range(rnd.randint(2, 6))]
+        for name in names:
+            lines.append(f'    Dim {name} As Variant')
+        for _ in range(rnd.randint(3, 12)):
+            a, b = rnd.choice(names), rnd.choice(names)
+            choice = rnd.random()
+            if choice < 0.15:
+                lines.append(f'    Set {a} = CreateObject("Scripting.FileSystemObject")')
+            elif choice < 0.25:
+                lines.append(f'    {a} = Chr({rnd.randint(65, 90)}) & Chr({rnd.randint(65, 90)}) & "{rnd.choice(READABLE_WORDS)}"')
+            elif choice < 0.3:
+                lines.append('    On Error Resume Next')
+            else:
+                lines.append(f'    {a} = {b} + {rnd.randint(1, 1000)}')
+        lines.append(f'End {kind}')
+        lines.append('')
+    return '\r\n'.join(lines) + '\r\n'
+
+
+def _modules(rnd, spec):
+    if spec.modules <= 0:
+        return []
+    modules = [{'name': 'ThisWorkbook', 'kind': 'document', 'code': _module_code(rnd, spec)}]
+    for i in range(1, spec.sheets + 1):
+        if len(modules) >= spec.modules:
+            break
+        modules.append({'name': f'Hoja{i}', 'kind': 'document', 'code': _module_code(rnd, spec)})
+    i = 0
+    while len(modules) < spec.modules:
+        i += 1
+        kind = 'class' if i % 5 == 0 else 'std'
+        name = f'Clase{i}' if kind == 'class' else f'Modulo{i}'
+        modules.append({'name': name, 'kind': kind, 'code': _module_code(rnd, spec)})
+    return modules[:spec.modules]
+
+
+def _sheet_xml(rnd, spec, index, has_drawing):
+    columns = 20
+    rows = -(-spec.cells_per_sheet // columns)
+    parts = [f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<worksheet xmlns="{NS_MAIN}" xmlns:r="{NS_REL}">',
+             f'<sheetPr codeName="Hoja{index}"/><dimension ref="A1:{_column_name(columns - 1)}{rows}"/><sheetData>']
+    written = 0
+    for r in range(1, rows + 1):
+        cells = []
+        for c in range(columns):
+            if written >= spec.cells_per_sheet:
+                break
+            ref = f'{_column_name(c)}{r}'
+            choice = rnd.random()
+            if choice < 0.4 and spec.shared_strings:
+                cells.append(f'<c r="{ref}" t="s"><v>{rnd.randrange(spec.shared_strings)}</v></c>')
+            elif choice < 0.5:
+                cells.append(f'<c r="{ref}"><f>SUM(A1:A{r})</f><v>{rnd.randint(0, 10000)}</v></c>')
+            else:
+                cells.append(f'<c r="{ref}"><v>{rnd.random() * 1000:.4f}</v></c>')
+            written += 1
+        parts.append(f'<row r="{r}">{"".join(cells)}</row>')
+    parts.append('</sheetData>')
+    parts.append('<sheetProtection algorithmName="SHA-512" hashValue="AAAA" saltValue="BBBB" spinCount="100000" '
+                 'sheet="1" objects="1" scenarios="1"/>')
+    if has_drawing:
+        parts.append('<drawing r:id="rId1"/>')
+    parts.append('</worksheet>')
+    return ''.join(parts)
+
+
+def _shared_strings_xml(rnd, spec):
+    parts = [f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+             f'<sst xmlns="{NS_MAIN}" count="{spec.shared_strings}" uniqueCount="{spec.shared_strings}">']
+    for i in range(spec.shared_strings):
+        words = ' '.join(rnd.choice(READABLE_WORDS) for _ in range(rnd.randint(1, 6)))
+        parts.append(f'<si><t>{words} {i}</t></si>')
+    parts.append('</sst>')
+    return ''.join(parts)
+
+
+def _drawing_xml(media_count):
+    anchors = []
+    for i in range(1, media_count + 1):
+        anchors.append(
+            '<xdr:oneCellAnchor><xdr:from><xdr:col>0</xdr:col><xdr:colOff>0</xdr:colOff><xdr:row>{0}</xdr:row>'
+            '<xdr:rowOff>0</xdr:rowOff></xdr:from><xdr:ext cx="952500" cy="952500"/><xdr:pic><xdr:nvPicPr>'
+            '<xdr:cNvPr id="{1}" name="Imagen {0}"/><xdr:cNvPicPr/></xdr:nvPicPr><xdr:blipFill>'
+            '<a:blip r:embed="rId{0}"/><a:stretch><a:fillRect/></a:stretch></xdr:blipFill><xdr:spPr>'
+            '<a:prstGeom prst="rect"><a:avLst/></a:prstGeom></xdr:spPr></xdr:pic><xdr:clientData/>'
+            '</xdr:oneCellAnchor>'.format(i, i + 1)
+        )
+    return ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<xdr:wsDr xmlns:xdr="http://schemas.openxmlformats.org/drawingml/2006/spreadsheetDrawing" '
+            'xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main" '
+            f'xmlns:r="{NS_REL}">' + ''.join(anchors) + '</xdr:wsDr>')
+
+
+def _rels_xml(relationships):
+    body = ''.join(f'<Relationship Id="{rid}" Type="{rtype}" Target="{target}"/>' for rid, rtype, target in relationships)
+    return f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<Relationships xmlns="{NS_PKG_REL}">{body}</Relationships>'
+
+
+def _media_bytes(rnd, size):
+    # Cabecera PNG + bytes aleatorios: incomprimible, como una imagen real
+    return b'\x89PNG\r\n\x1a\n' + rnd.randbytes(max(size - 8, 0))
+
+
+def generate_parts(spec):
+    """Devuelve la lista ordenada [(nombre_de_parte, bytes)] del libro sintético."""
+    rnd = random.Random(spec.seed)
+    modules = _modules(rnd, spec)
+    has_vba = bool(modules)
+    has_media = spec.media > 0 and spec.sheets > 0
+
+    overrides = ['<Override PartName="/xl/workbook.xml" ContentType="application/vnd.ms-excel.sheet.macroEnabled.main+xml"/>']
+    for i in range(1, spec.sheets + 1):
+        overrides.append(f'<Override PartName="/xl/worksheets/sheet{i}.xml" '
+                         'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>')
+    overrides.append('<Override PartName="/xl/sharedStrings.xml" '
+                     'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/>')
+    overrides.append('<Override PartName="/xl/styles.xml" '
+                     'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>')
+    if has_media:
+        overrides.append('<Override PartName="/xl/drawings/drawing1.xml" '
+                         'ContentType="application/vnd.openxmlformats-officedocument.drawing+xml"/>')
+    if has_vba:
+        overrides.append('<Override PartName="/xl/vbaProject.bin" ContentType="application/vnd.ms-office.vbaProject"/>')
+    overrides.append('<Override PartName="/docProps/core.xml" ContentType="application/vnd.openxmlformats-package.core-properties+xml"/>')
+    overrides.append('<Override PartName="/docProps/app.xml" '
+                     'ContentType="application/vnd.openxmlformats-officedocument.extended-properties+xml"/>')
+    overrides.append('<Override PartName="/docProps/custom.xml" '
+                     'ContentType="application/vnd.openxmlformats-officedocument.custom-properties+xml"/>')
+    content_types = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Default Extension="png" ContentType="image/png"/>' + ''.join(overrides) + '</Types>'
+    )
+
+    parts = [('[Content_Types].xml', content_types.encode('utf-8'))]
+    parts.append(('_rels/.rels', _rels_xml([
+        ('rId1', f'{REL_BASE}/officeDocument', 'xl/workbook.xml'),
+        ('rId2', 'http://schemas.openxmlformats.org/package/2006/relationships/metadata/core-properties', 'docProps/core.xml'),
+        ('rId3', f'{REL_BASE}/extended-properties', 'docProps/app.xml'),
+        ('rId4', f'{REL_BASE}/custom-properties', 'docProps/custom.xml'),
+    ]).encode('utf-8')))
+
+    sheets_xml = ''.join(f'<sheet name="Hoja{i}" sheetId="{i}" r:id="rId{i}"/>' for i in range(1, spec.sheets + 1))
+    workbook = (f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<workbook xmlns="{NS_MAIN}" xmlns:r="{NS_REL}">'
+                '<workbookPr codeName="ThisWorkbook"/>'
+                '<workbookProtection workbookAlgorithmName="SHA-512" workbookHashValue="AAAA" '
+                'workbookSaltValue="BBBB" workbookSpinCount="100000" lockStructure="1"/>'
+                f'<sheets>{sheets_xml}</sheets>'
+                '<definedNames><definedName name="_xltoexe_loader" hidden="1">Hoja1!$A$1</definedName></definedNames>'
+                '</workbook>')
+    parts.append(('xl/workbook.xml', workbook.encode('utf-8')))
+
+    workbook_rels = [(f'rId{i}', f'{REL_BASE}/worksheet', f'worksheets/sheet{i}.xml') for i in range(1, spec.sheets + 1)]
+    next_id = spec.sheets + 1
+    workbook_rels.append((f'rId{next_id}', f'{REL_BASE}/sharedStrings', 'sharedStrings.xml'))
+    workbook_rels.append((f'rId{next_id + 1}', f'{REL_BASE}/styles', 'styles.xml'))
+    if has_vba:
+        workbook_rels.append((f'rId{next_id + 2}', 'http://schemas.microsoft.com/office/2006/relationships/vbaProject',
+                              'vbaProject.bin'))
+    parts.append(('xl/_rels/workbook.xml.rels', _rels_xml(workbook_rels).encode('utf-8')))
+
+    for i in range(1, spec.sheets + 1):
+        drawing = has_media and i == 1
+        parts.append((f'xl/worksheets/sheet{i}.xml', _sheet_xml(rnd, spec, i, drawing).encode('utf-8')))
+        if drawing:
+            parts.append(('xl/worksheets/_rels/sheet1.xml.rels', _rels_xml([
+                ('rId1', f'{REL_BASE}/drawing', '../drawings/drawing1.xml')]).encode('utf-8')))
+
+    parts.append(('xl/sharedStrings.xml', _shared_strings_xml(rnd, spec).encode('utf-8')))
+    parts.append(('xl/styles.xml', (f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<styleSheet xmlns="{NS_MAIN}">'
+                                    '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+                                    '<fills count="1"><fill><patternFill patternType="none"/></fill></fills>'
+                                    '<borders count="1"><border/></borders><cellStyleXfs count="1"><xf/></cellStyleXfs>'
+                                    '<cellXfs count="1"><xf/></cellXfs></styleSheet>').encode('utf-8')))
+
+    if has_media:
+        parts.append(('xl/drawings/drawing1.xml', _drawing_xml(spec.media).encode('utf-8')))
+        parts.append(('xl/drawings/_rels/drawing1.xml.rels', _rels_xml([
+            (f'rId{i}', f'{REL_BASE}/image', f'../media/image{i}.png') for i in range(1, spec.media + 1)]).encode('utf-8')))
+        for i in range(1, spec.media + 1):
+            parts.append((f'xl/media/image{i}.png', _media_bytes(rnd, spec.media_size)))
+
+    if has_vba:
+        parts.append(('xl/vbaProject.bin', build_vba_project(modules)))
+
+    parts.append(('docProps/core.xml', (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<cp:coreProperties xmlns:cp="http://schemas.openxmlformats.org/package/2006/metadata/core-properties" '
+        'xmlns:dc="http://purl.org/dc/elements/1.1/"><dc:creator>XLtoEXE</dc:creator></cp:coreProperties>').encode('utf-8')))
+    parts.append(('docProps/app.xml', (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Properties xmlns="http://schemas.openxmlformats.org/officeDocument/2006/extended-properties">'
+        '<Application>Microsoft Excel</Application><Company>XLtoEXE</Company></Properties>').encode('utf-8')))
+    parts.append(('docProps/custom.xml', (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Properties xmlns="http://schemas.openxmlformats.org/officeDocument/2006/custom-properties" '
+        'xmlns:vt="http://schemas.openxmlformats.org/officeDocument/2006/docPropsVTypes">'
+        '<property fmtid="{D5CDD505-2E9C-101B-9397-08002B2CF9AE}" pid="2" name="XLtoEXE_Build">'
+        '<vt:lpwstr>XLtoEXE 4.0</vt:lpwstr></property></Properties>').encode('utf-8')))
+    return parts
+
+
+def build_synthetic_xlsm(path, spec=None):
+    """Escribe el libro sintético en ``path`` y devuelve su tamaño en bytes."""
+    spec = spec or SyntheticWorkbookSpec()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zipf:
+        for name, data in generate_parts(spec):
+            zipf.writestr(name, data)
+    return os.path.getsize(path)
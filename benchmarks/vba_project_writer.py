@@ -0,0 +1,247 @@
+"""
+Escritor mínimo de vbaProject.bin para los benchmarks.
+
+Genera un compound file (CFB v3) con los streams PROJECT, VBA/dir,
+VBA/_VBA_PROJECT y un stream por módulo, con el código comprimido según
+MS-OVBA. Es suficiente para que oletools.olevba lo procese; no pretende
+producir proyectos que Excel pueda compilar.
+"""
+import struct
+import uuid
+
+SECTOR_SIZE = 512
+MINI_SECTOR_SIZE = 64
+MINI_STREAM_CUTOFF = 4096
+ENDOFCHAIN = 0xFFFFFFFE
+FREESECT = 0xFFFFFFFF
+FATSECT = 0xFFFFFFFD
+NOSTREAM = 0xFFFFFFFF
+
+
+def compress_ovba(data: bytes) -> bytes:
+    """Comprime ``data`` con el algoritmo RLE/LZ77 de MS-OVBA (2.4.1.3)."""
+    out = bytearray(b'\x01')
+    for chunk_start in range(0, len(data), 4096):
+        chunk = data[chunk_start:chunk_start + 4096]
+        compressed = _compress_chunk(chunk)
+        if len(compressed) <= 4096:
+            header = 0xB000 | (len(compressed) + 2 - 3)
+            out += struct.pack('<H', header) + compressed
+        else:
+            out += struct.pack('<H', 0x3FFF) + chunk.ljust(4096, b'\x00')
+    return bytes(out)
+
+
+def _compress_chunk(chunk: bytes) -> bytes:
+    out = bytearray()
+    pos = 0
+    candidates = {}
+    size = len(chunk)
+    while pos < size:
+        flag_index = len(out)
+        out.append(0)
+        flags = 0
+        for bit in range(8):
+            if pos >= size:
+                break
+            offset, length = 0, 0
+            if pos >= 1 and pos + 3 <= size:
+                bit_count = max((pos - 1).bit_length(), 4)
+                max_length = (0xFFFF >> bit_count) + 3
+                for candidate in reversed(candidates.get(chunk[pos:pos + 3], ())[-16:]):
+                    match = 3
+                    limit = min(max_length, size - pos)
+                    while match < limit and chunk[candidate + match] == chunk[pos + match]:
+                        match += 1
+                    if match > length:
+                        offset, length = pos - candidate, match
+                        if match == limit:
+                            break
+            if length >= 3:
+                token = ((offset - 1) << (16 - bit_count)) | (length - 3)
+                out += struct.pack('<H', token)
+                flags |= 1 << bit
+                step = length
+            else:
+                out.append(chunk[pos])
+                step = 1
+            for i in range(pos, pos + step):
+                if i + 3 <= size:
+                    candidates.setdefault(chunk[i:i + 3], []).append(i)
+            pos += step
+        out[flag_index] = flags
+    return bytes(out)
+
+
+def _record(record_id, payload=b''):
+    return struct.pack('<HI', record_id, len(payload)) + payload
+
+
+def _dir_stream(project_name, modules, codepage=1252):
+    encoding = f'cp{codepage}'
+    name = project_name.encode(encoding)
+    out = bytearray()
+    out += _record(0x0001, struct.pack('<I', 1))          # PROJECTSYSKIND (win32)
+    out += _record(0x0002, struct.pack('<I', 0x409))      # PROJECTLCID
+    out += _record(0x0014, struct.pack('<I', 0x409))      # PROJECTLCIDINVOKE
+    out += _record(0x0003, struct.pack('<H', codepage))   # PROJECTCODEPAGE
+    out += _record(0x0004, name)                          # PROJECTNAME
+    out += _record(0x0005) + _record(0x0040)              # PROJECTDOCSTRING
+    out += _record(0x0006) + _record(0x003D)              # PROJECTHELPFILEPATH
+    out += _record(0x0007, struct.pack('<I', 0))          # PROJECTHELPCONTEXT
+    out += _record(0x0008, struct.pack('<I', 0))          # PROJECTLIBFLAGS
+    out += struct.pack('<HIIH', 0x0009, 4, 1, 0)          # PROJECTVERSION
+    out += _record(0x000C) + _record(0x003C)              # PROJECTCONSTANTS
+    out += _record(0x000F, struct.pack('<H', len(modules)))
+    out += _record(0x0013, struct.pack('<H', 0xFFFF))     # PROJECTCOOKIE
+    for module in modules:
+        mod_name = module['name'].encode(encoding)
+        mod_unicode = module['name'].encode('utf-16-le')
+        out += _record(0x0019, mod_name)
+        out += _record(0x0047, mod_unicode)
+        out += _record(0x001A, mod_name) + _record(0x0032, mod_unicode)
+        out += _record(0x001C) + _record(0x0048)
+        out += _record(0x0031, struct.pack('<I', 0))      # MODULEOFFSET: sin caché de rendimiento
+        out += _record(0x001E, struct.pack('<I', 0))
+        out += _record(0x002C, struct.pack('<H', 0xFFFF))
+        out += _record(0x0022 if module['kind'] in ('class', 'document') else 0x0021)
+        out += _record(0x002B)
+    out += _record(0x0010)
+    return compress_ovba(bytes(out))
+
+
+def _project_stream(project_name, modules, protected):
+    lines = [f'ID="{{{str(uuid.UUID(int=0x1234)).upper()}}}"']
+    for module in modules:
+        if module['kind'] == 'document':
+            lines.append(f"Document={module['name']}/&H00000000")
+        elif module['kind'] == 'class':
+            lines.append(f"Class={module['name']}")
+        else:
+            lines.append(f"Module={module['name']}")
+    lines += [f'Name="{project_name}"', 'HelpContextID="0"', 'VersionCompatible32="393222000"']
+    if protected:
+        lines += ['CMG="C9CB4B8C4F8C4F8C4F8C4F"', 'DPB="0E0CCC2BD12CD12C2ED3D22D"', 'GC="9C9E5E5F5F5F5F"']
+    else:
+        lines += ['CMG="C9CB4B8C4F8C4F8C4F8C4F"', 'DPB="0E0CCC2BD1"', 'GC="9C9E5E5F5F"']
+    lines += ['', '[Host Extender Info]', '&H00000001={3832D640-CF90-11CF-8E43-00A0C911005A};VBE;&H00000000', '']
+    return ('\r\n'.join(lines) + '\r\n').encode('cp1252')
+
+
+def build_vba_project(modules, project_name='VBAProject', protected=True):
+    """
+    Construye los bytes de un vbaProject.bin.
+
+    ``modules`` es una lista de dicts con ``name``, ``kind`` (std, class,
+    document) y ``code`` (texto VBA con CRLF).
+    """
+    vba_streams = [('dir', _dir_stream(project_name, modules)),
+                   ('_VBA_PROJECT', b'\xCC\x61\xFF\xFF\x00\x00\x00')]
+    for module in modules:
+        attributes = f'Attribute VB_Name = "{module["name"]}"\r\n'
+        vba_streams.append((module['name'], compress_ovba((attributes + module['code']).encode('cp1252', 'replace'))))
+    tree = [('PROJECT', _project_stream(project_name, modules, protected)), ('VBA', vba_streams)]
+    return _CompoundFileWriter(tree).build()
+
+
+class _CompoundFileWriter:
+    """Serializa un árbol [(nombre, bytes | [hijos])] como CFB v3."""
+
+    def __init__(self, tree):
+        self.entries = [{'name': 'Root Entry', 'type': 5, 'data': b'', 'children': []}]
+        self._add_children(0, tree)
+
+    def _add_children(self, parent, items):
+        for name, value in items:
+            index = len(self.entries)
+            if isinstance(value, list):
+                self.entries.append({'name': name, 'type': 1, 'data': b'', 'children': []})
+                self._add_children(index, value)
+            else:
+                self.entries.append({'name': name, 'type': 2, 'data': value, 'children': []})
+            self.entries[parent]['children'].append(index)
+
+    def build(self):
+        mini_stream = bytearray()
+        mini_fat = []
+        big_streams = []
+        for entry in self.entries:
+            if entry['type'] != 2:
+                continue
+            data = entry['data']
+            if len(data) < MINI_STREAM_CUTOFF:
+                count = -(-len(data) // MINI_SECTOR_SIZE)
+                entry['start'] = len(mini_fat) if count else ENDOFCHAIN
+                mini_fat += [len(mini_fat) + i + 1 for i in range(count - 1)] + ([ENDOFCHAIN] if count else [])
+                mini_stream += data.ljust(count * MINI_SECTOR_SIZE, b'\x00')
+            else:
+                big_streams.append(entry)
+
+        dir_sectors = -(-len(self.entries) * 128 // SECTOR_SIZE)
+        minifat_sectors = -(-len(mini_fat) * 4 // SECTOR_SIZE)
+        ministream_sectors = -(-len(mini_stream) // SECTOR_SIZE)
+        stream_sectors = sum(-(-len(e['data']) // SECTOR_SIZE) for e in big_streams)
+        payload = dir_sectors + minifat_sectors + ministream_sectors + stream_sectors
+        fat_sectors = 1
+        while fat_sectors * (SECTOR_SIZE // 4) < payload + fat_sectors:
+            fat_sectors += 1
+        if fat_sectors > 109:
+            raise ValueError('Proyecto VBA demasiado grande para el escritor sin DIFAT')
+
+        fat = [FATSECT] * fat_sectors
+        sectors = []
+
+        def allocate(data, count):
+            start = len(fat)
+            for i in range(count):
+                fat.append(start + i + 1 if i < count - 1 else ENDOFCHAIN)
+            sectors.append(data.ljust(count * SECTOR_SIZE, b'\x00'))
+            return start if count else ENDOFCHAIN
+
+        self.entries[0]['data_size'] = len(mini_stream)
+        dir_start_placeholder = len(fat)
+        fat += [0] * dir_sectors
+        sectors.append(None)
+        minifat_start = allocate(b''.join(struct.pack('<I', v) for v in mini_fat), minifat_sectors)
+        self.entries[0]['start'] = allocate(bytes(mini_stream), ministream_sectors)
+        for entry in big_streams:
+            entry['start'] = allocate(entry['data'], -(-len(entry['data']) // SECTOR_SIZE))
+
+        for i in range(dir_sectors):
+            fat[dir_start_placeholder + i] = dir_start_placeholder + i + 1 if i < dir_sectors - 1 else ENDOFCHAIN
+        sectors[0] = self._directory().ljust(dir_sectors * SECTOR_SIZE, b'\x00')
+        fat += [FREESECT] * (fat_sectors * (SECTOR_SIZE // 4) - len(fat))
+
+        difat = list(range(fat_sectors)) + [FREESECT] * (109 - fat_sectors)
+        header = struct.pack(
+            '<8s16sHHHHH6sIIIIIIIII',
+            b'\xD0\xCF\x11\xE0\xA1\xB1\x1A\xE1', b'\x00' * 16, 0x003E, 3, 0xFFFE, 9, 6, b'\x00' * 6,
+            0, fat_sectors, dir_start_placeholder, 0, MINI_STREAM_CUTOFF,
+            minifat_start if minifat_sectors else ENDOFCHAIN, minifat_sectors, ENDOFCHAIN, 0,
+        ) + struct.pack('<109I', *difat)
+        fat_bytes = struct.pack(f'<{len(fat)}I', *fat)
+        return header + fat_bytes + b''.join(sectors)
+
+    def _directory(self):
+        for entry in self.entries:
+            children = sorted(entry['children'], key=lambda i: (len(self.entries[i]['name']), self.entries[i]['name'].upper()))
+            entry['child'] = children[0] if children else NOSTREAM
+            for current, following in zip(children, children[1:] + [None]):
+                self.entries[current]['right'] = following if following is not None else NOSTREAM
+        out = bytearray()
+        for entry in self.entries:
+            name = entry['name'].encode('utf-16-le') + b'\x00\x00'
+            if entry['type'] == 5:
+                size = entry.get('data_size', 0)
+            elif entry['type'] == 2:
+                size = len(entry['data'])
+            else:
+                size = 0
+            start = entry.get('start', 0) if entry['type'] != 1 else 0
+            out += struct.pack(
+                '<64sHBBIII16sIQQIQ',
+                name.ljust(64, b'\x00'), len(name), entry['type'], 1,
+                NOSTREAM, entry.get('right', NOSTREAM), entry.get('child', NOSTREAM),
+                b'\x00' * 16, 0, 0, 0, start, size,
+            )
+        return bytes(out)
@@ -0,0 +1,161 @@
+"""
+Exportación en bloque de los módulos VBA extraídos.
+
+Todos los módulos de una o varias extracciones se escriben con un único
+exportador: el código se codifica una vez (CRLF ya incluido) y se escribe en
+binario, y los nombres repetidos se resuelven de forma determinista (``_2``,
+``_3``... en el orden de llegada, sin distinguir mayúsculas). En lugar de
+archivos sueltos se puede generar un único ``.zip`` o ``.tar`` con un
+``manifest.json`` que describe cada módulo.
+"""
+import hashlib
+import io
+import json
+import os
+import tarfile
+import zipfile
+
+FORMATS = ('dir', 'zip', 'tar')
+MANIFEST_NAME = 'manifest.json'
+DEFAULT_NAME = 'macros_extraidas'
+
+_EXTENSIONS = {'form': '.frm', 'class': '.cls', 'document': '.cls'}
+# Fecha fija en los paquetes: mismo contenido, mismos bytes
+_ZIP_DATE = (1980, 1, 1, 0, 0, 0)
+
+
+def module_filename(macro):
+    """Nombre de archivo saneado del módulo, con la extensión de su tipo."""
+    name = macro.get('module_name') or macro.get('filename') or 'Module'
+    safe_name = ''.join(ch if ch.isalnum() or ch in ('_', '-') else '_' for ch in name)
+    extension = _EXTENSIONS.get(macro.get('type', 'std'), '.bas')
+    if not safe_name.lower().endswith(extension):
+        safe_name += extension
+    return safe_name
+
+
+def encode_module(code, encoding='utf-8'):
+    """Código con saltos CRLF, codificado para escribirse tal cual."""
+    code = (code or '').replace('\r\n', '\n').replace('\r', '\n')
+    return code.replace('\n', '\r\n').encode(encoding, 'replace')
+
+
+class MacroExporter:
+    """
+    ``target`` es el directorio (formato ``dir``) o la ruta del paquete
+    (``zip``/``tar``; si no lleva extensión se le añade). Se puede llamar a
+    ``add`` varias veces (p. ej. una por libro, con ``prefix``) antes de ``close``.
+    """
+
+    def __init__(self, target, fmt='dir', encoding='utf-8'):
+        if fmt not in FORMATS:
+            raise ValueError(f"Formato de exportación de macros desconocido: {fmt}")
+        if fmt != 'dir' and not target.lower().endswith('.' + fmt):
+            target += '.' + fmt
+        self.target = target
+        self.format = fmt
+        self.encoding = encoding
+        self.manifest = []
+        self._used = set()
+        self._bundle = None
+        if fmt == 'dir':
+            os.makedirs(target, exist_ok=True)
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(target)), exist_ok=True)
+            if fmt == 'zip':
+                self._bundle = zipfile.ZipFile(target, 'w', zipfile.ZIP_DEFLATED)
+            else:
+                self._bundle = tarfile.open(target, 'w', format=tarfile.PAX_FORMAT)
+
+    def add(self, macros, prefix=None, source=None):
+        """
+        Exporta ``macros`` y devuelve las rutas (o nombres dentro del paquete).
+
+        En formato ``dir`` también rellena ``macro['export_path']``, que usa
+        ``MacroInjector`` para importar el módulo.
+        """
+        names = [self._unique_name(module_filename(macro), prefix) for macro in macros]
+        paths = []
+        for macro, name in zip(macros, names):
+            data = encode_module(macro.get('code'), self.encoding)
+            path = self._write(name, data)
+            if self.format == 'dir':
+                macro['export_path'] = path
+            paths.append(path)
+            self.manifest.append({
+                'path': name,
+                'module_name': macro.get('module_name'),
+                'type': macro.get('type', 'std'),
+                'filename': macro.get('filename'),
+                'stream_path': macro.get('stream_path'),
+                'source': source,
+                'size': len(data),
+                'sha256': hashlib.sha256(data).hexdigest(),
+            })
+        return paths
+
+    def _unique_name(self, filename, prefix):
+        stem, extension = os.path.splitext(filename)
+        if prefix:
+            stem = f'{prefix}/{stem}'
+        candidate, index = stem + extension, 1
+        # Sin distinguir mayúsculas: VBA y los sistemas de archivos de Windows no lo hacen
+        while candidate.lower() in self._used:
+            index += 1
+            candidate = f'{stem}_{index}{extension}'
+        self._used.add(candidate.lower())
+        return candidate
+
+    def _write(self, name, data):
+        if self.format == 'dir':
+            path = os.path.join(self.target, *name.split('/'))
+            if '/' in name:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0), 0o644)
+            try:
+                view = memoryview(data)
+                while view:
+                    view = view[os.write(fd, view):]
+            finally:
+                os.close(fd)
+            return path
+        self._add_member(name, data)
+        return name
+
+    def _add_member(self, name, data):
+        if self.format == 'zip':
+            info = zipfile.ZipInfo(name, date_time=_ZIP_DATE)
+            info.compress_type = zipfile.ZIP_DEFLATED
+            self._bundle.writestr(info, data)
+        else:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mode = 0o644
+            info.mtime = 0
+            self._bundle.addfile(info, io.BytesIO(data))
+
+    def close(self):
+        """Escribe el manifiesto y cierra el paquete; devuelve ``target``."""
+        manifest = json.dumps({'modules': self.manifest}, indent=2, ensure_ascii=False).encode('utf-8')
+        if self.format == 'dir':
+            with open(os.path.join(self.target, MANIFEST_NAME), 'wb') as f:
+                f.write(manifest)
+        elif self._bundle is not None:
+            self._add_member(MANIFEST_NAME, manifest)
+            self._bundle.close()
+            self._bundle = None
+        return self.target
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+def export_macros(macros, target, fmt='dir', source=None):
+    """Atajo para exportar un solo lote; devuelve ``target``."""
+    with MacroExporter(target, fmt) as exporter:
+        exporter.add(macros, source=source)
+    return exporter.target
@@ -0,0 +1,191 @@
+"""
+Índice consultable de todas las macros extraídas (SQLite FTS5).
+
+Cada libro procesado añade sus módulos VBA al índice: el código fuente, los
+nombres de los procedimientos (Sub/Function/Property) y el contenido de los
+literales de cadena van a una tabla FTS5, y aparte se guardan el SHA-256 de
+cada archivo de entrada y qué módulos contiene. Un módulo con el mismo código
+en varios libros (el cargador de XLtoEXE, un módulo de negocio copiado) se
+indexa una sola vez y queda enlazado a todos ellos.
+
+El tokenizador trata ``_`` como parte de la palabra, así que ``Auto_Open`` es
+un único término. Las búsquedas son frases: ``http://host/ruta`` encuentra la
+URL completa y no cada una de sus palabras por separado. Como las consultas
+van contra el índice invertido, no contra el texto, responden en milisegundos
+aunque el corpus tenga cientos de miles de módulos.
+
+Estructura::
+
+    files        sha256, ruta del último archivo indexado con ese contenido
+    modules      sha256 del código, nombre, tipo, líneas
+    occurrences  archivo -> módulo (con el nombre del módulo en ese libro)
+    module_fts   FTS5 (name, procedures, literals, code), rowid = modules.id
+"""
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import time
+
+INDEX_VERSION = 1
+DEFAULT_LIMIT = 50
+FIELDS = ('module', 'procedure', 'literal', 'code')
+_FTS_COLUMNS = {'module': 'name', 'procedure': 'procedures', 'literal': 'literals', 'code': 'code'}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    sha256 TEXT NOT NULL UNIQUE,
+    path TEXT NOT NULL,
+    indexed REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS modules (
+    id INTEGER PRIMARY KEY,
+    sha256 TEXT NOT NULL UNIQUE,
+    name TEXT NOT NULL,
+    type TEXT,
+    lines INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS occurrences (
+    file_id INTEGER NOT NULL,
+    module_id INTEGER NOT NULL,
+    module_name TEXT NOT NULL,
+    PRIMARY KEY (file_id, module_id, module_name)
+);
+CREATE INDEX IF NOT EXISTS occurrences_module ON occurrences (module_id);
+CREATE VIRTUAL TABLE IF NOT EXISTS module_fts USING fts5(
+    name, procedures, literals, code, tokenize="unicode61 tokenchars '_'"
+);
+"""
+
+# Sub/Function/Property con cualquier visibilidad (las declaraciones Declare no son procedimientos del módulo)
+_PROCEDURE = re.compile(
+    r'^[ \t]*(?:(?:Public|Private|Friend|Global)[ \t]+)?(?:Static[ \t]+)?'
+    r'(?:Sub|Function|Property[ \t]+(?:Get|Let|Set))[ \t]+([A-Za-z_]\w*)',
+    re.IGNORECASE | re.MULTILINE)
+
+
+def procedure_names(code):
+    found = {}
+    for name in _PROCEDURE.findall(code):
+        found.setdefault(name.lower(), name)
+    return list(found.values())
+
+
+def fts_phrase(text):
+    """Frase FTS5 que busca ``text`` literalmente (sin operadores)."""
+    return '"' + text.replace('"', '""') + '"'
+
+
+class MacroIndex:
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Varios trabajos pueden indexar a la vez: cada uno espera su turno para escribir
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(_SCHEMA)
+        self.conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('version', ?)", (str(INDEX_VERSION),))
+        self.stats = {'modules': 0, 'new_modules': 0}
+
+    # Alta
+
+    def add_file(self, file_sha256, path, macros):
+        """
+        Indexa los módulos de un archivo; un archivo ya indexado (mismo SHA-256)
+        sólo actualiza su ruta. Devuelve cuántos módulos eran nuevos en el índice.
+        """
+        from deobfuscator.identifier_scorer import string_literals
+
+        cur = self.conn.cursor()
+        cur.execute('BEGIN IMMEDIATE')
+        try:
+            row = cur.execute('SELECT id FROM files WHERE sha256 = ?', (file_sha256,)).fetchone()
+            if row is not None:
+                cur.execute('UPDATE files SET path = ?, indexed = ? WHERE id = ?', (path, time.time(), row[0]))
+                cur.execute('COMMIT')
+                return 0
+            file_id = cur.execute('INSERT INTO files (sha256, path, indexed) VALUES (?, ?, ?)',
+                                  (file_sha256, path, time.time())).lastrowid
+            new_modules = 0
+            for macro in macros:
+                code = macro.get('code') or ''
+                name = macro.get('module_name') or macro.get('filename') or 'Module'
+                digest = hashlib.sha256(code.encode('utf-8', 'surrogatepass')).hexdigest()
+                row = cur.execute('SELECT id FROM modules WHERE sha256 = ?', (digest,)).fetchone()
+                if row is None:
+                    procedures = procedure_names(code)
+                    module_id = cur.execute('INSERT INTO modules (sha256, name, type, lines) VALUES (?, ?, ?, ?)',
+                                            (digest, name, macro.get('type'), code.count('\n') + 1)).lastrowid
+                    cur.execute('INSERT INTO module_fts (rowid, name, procedures, literals, code) '
+                                'VALUES (?, ?, ?, ?, ?)',
+                                (module_id, name, ' '.join(procedures), '\n'.join(string_literals(code)), code))
+                    new_modules += 1
+                else:
+                    module_id = row[0]
+                cur.execute('INSERT OR IGNORE INTO occurrences (file_id, module_id, module_name) VALUES (?, ?, ?)',
+                            (file_id, module_id, name))
+            cur.execute('COMMIT')
+        except BaseException:
+            cur.execute('ROLLBACK')
+            raise
+        self.stats['modules'] += len(macros)
+        self.stats['new_modules'] += new_modules
+        return new_modules
+
+    # Consultas
+
+    def search(self, text, field=None, limit=DEFAULT_LIMIT):
+        """
+        Archivos cuyos módulos contienen la frase ``text``, en todo el módulo o
+        sólo en ``field`` (module, procedure, literal o code). Devuelve una lista
+        de diccionarios con el archivo, el módulo y un fragmento del texto, en
+        orden de indexación: sin ordenar por relevancia, la consulta se detiene
+        en ``limit`` coincidencias en vez de puntuar todas.
+        """
+        if field is not None and field not in FIELDS:
+            raise ValueError(f"Campo de búsqueda desconocido: {field} (válidos: {', '.join(FIELDS)})")
+        query = fts_phrase(text)
+        if field is not None:
+            query = f'{_FTS_COLUMNS[field]} : {query}'
+        rows = self.conn.execute(
+            "SELECT f.sha256, f.path, o.module_name, m.sha256, m.type, "
+            "snippet(module_fts, -1, '[', ']', '...', 12) "
+            "FROM module_fts JOIN modules m ON m.id = module_fts.rowid "
+            "JOIN occurrences o ON o.module_id = m.id JOIN files f ON f.id = o.file_id "
+            "WHERE module_fts MATCH ? LIMIT ?", (query, limit)).fetchall()
+        return [{'file_sha256': file_sha, 'path': path, 'module': module, 'module_sha256': module_sha,
+                 'type': module_type, 'snippet': snippet}
+                for file_sha, path, module, module_sha, module_type, snippet in rows]
+
+    def module_source(self, module_sha256):
+        row = self.conn.execute('SELECT module_fts.code FROM modules m JOIN module_fts ON module_fts.rowid = m.id '
+                                'WHERE m.sha256 = ?', (module_sha256,)).fetchone()
+        return row[0] if row else None
+
+    def counts(self):
+        return {table: self.conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+                for table in ('files', 'modules', 'occurrences')}
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+def index_macros(index_path, input_path, macros):
+    """Añade al índice los módulos de ``input_path``; devuelve la ruta del índice."""
+    from utils.helpers import file_sha256
+
+    with MacroIndex(index_path) as index:
+        new_modules = index.add_file(file_sha256(input_path), os.path.abspath(input_path), macros)
+    logging.info("Índice de macros %s: %d módulo(s), %d nuevo(s)", index_path, len(macros), new_modules)
+    return index_path
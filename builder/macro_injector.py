@@ -2,10 +2,14 @@ import os
 import logging
 from typing import List, Tuple
 
-try:
-    import xlwings as xw
-except ImportError:  # pragma: no cover - xlwings is optional at runtime
-    xw = None
+
+def _load_xlwings():
+    # xlwings es opcional y costoso de importar: se carga sólo al reinsertar
+    try:
+        import xlwings as xw
+    except ImportError:  # pragma: no cover - xlwings is optional at runtime
+        return None
+    return xw
 
 
 class MacroInjector:
@@ -27,6 +31,7 @@ class MacroInjector:
     ) -> Tuple[bool, str]:
         if not self.macros:
             return False, "No hay macros para reinsertar"
+        xw = _load_xlwings()
         if xw is None:
             return False, "xlwings no está instalado; no se puede automatizar Excel"
         if not os.path.exists(self.workbook_path):
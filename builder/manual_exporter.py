@@ -1,18 +1,162 @@
+import errno
+import logging
 import os
 import shutil
+import zipfile
+
+from extractor.package_index import Package
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+# ioctl FICLONE de Linux (btrfs, XFS con reflink, bcachefs...)
+_FICLONE = 0x40049409
+_CHUNK_SIZE = 1024 * 1024
+_LINK_ERRORS = (errno.EXDEV, errno.EPERM, errno.EACCES, errno.EMLINK, errno.ENOTSUP, errno.EOPNOTSUPP,
+                errno.EINVAL, errno.ENOTTY, errno.EBADF, errno.ENOSYS)
+
+PART_TYPES = ('vba', 'xml', 'media', 'other')
+_MEDIA_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tif', '.tiff', '.emf', '.wmf', '.svg', '.ico')
+
+
+def classify_part(name):
+    """Clasifica una parte del paquete en vba, xml, media u other."""
+    lower = name.replace('\\', '/').lower()
+    base = lower.rsplit('/', 1)[-1]
+    if base in ('vbaproject.bin', 'vbadata.xml') or base.endswith('.bas') or base.endswith('.cls') or base.endswith('.frm'):
+        return 'vba'
+    if '/media/' in lower or '/images/' in lower or base.endswith(_MEDIA_EXTENSIONS):
+        return 'media'
+    if base.endswith(('.xml', '.rels', '.vml')):
+        return 'xml'
+    return 'other'
+
 
 class ManualExporter:
-    def __init__(self, working_dir):
-        self.working_dir = working_dir
+    """
+    Exporta los componentes del paquete a ``componentes_extraidos``.
+
+    ``working_dir`` puede ser la ruta o un ``Package`` ya indexado. Para cada
+    parte se intenta, por orden, reflink (copia en escritura), hardlink y copia
+    por bloques, según el modo y lo que soporte el sistema de archivos. Sin
+    directorio de trabajo se exporta directamente desde el ZIP de origen. Las
+    etapas reescriben partes con ``Package.write_part`` (reemplazo atómico), así
+    que una reescritura posterior no altera lo ya exportado con hardlinks.
+    """
 
-    def export(self):
-        export_dir = os.path.join(self.working_dir, 'componentes_extraidos')
+    MODES = ('auto', 'reflink', 'hardlink', 'copy')
+
+    def __init__(self, working_dir, source_zip=None, part_types=None, mode='auto'):
+        self.package = working_dir if isinstance(working_dir, Package) else None
+        self.working_dir = self.package.root if self.package else working_dir
+        self.source_zip = source_zip
+        self.part_types = set(part_types) if part_types else set(PART_TYPES)
+        unknown = self.part_types - set(PART_TYPES)
+        if unknown:
+            raise ValueError(f"Tipos de parte desconocidos: {', '.join(sorted(unknown))}")
+        if mode not in self.MODES:
+            raise ValueError(f"Modo de exportación desconocido: {mode}")
+        self.mode = mode
+        self.stats = {'reflink': 0, 'hardlink': 0, 'copy': 0, 'zip': 0, 'skipped': 0, 'bytes_written': 0}
+
+    def export(self, export_dir=None):
+        """
+        Exporta a ``export_dir``; por defecto ``componentes_extraidos`` dentro del
+        directorio de trabajo o, sin él, ``<nombre>_componentes_extraidos`` junto al ZIP de origen.
+        """
+        package = self.package
+        if package is None and self.working_dir and os.path.isdir(self.working_dir):
+            package = Package.from_directory(self.working_dir)
+        from_package = package is not None and package.root and len(package)
+        if not from_package:
+            self.source_zip = self.source_zip or (package.zip_path if package is not None else None)
+            if not self.source_zip:
+                raise ValueError("No hay directorio de trabajo ni ZIP de origen para exportar")
+        export_dir = export_dir or self._default_export_dir()
         os.makedirs(export_dir, exist_ok=True)
-        for root, dirs, files in os.walk(self.working_dir):
-            for file in files:
-                file_path = os.path.join(root, file)
-                if not file_path.startswith(export_dir):
-                    rel_path = os.path.relpath(file_path, self.working_dir)
-                    dest_path = os.path.join(export_dir, rel_path)
-                    os.makedirs(os.path.dirname(dest_path), exist_ok=True)
-                    shutil.copy2(file_path, dest_path)
+        if from_package:
+            self._export_from_package(package, export_dir)
+        else:
+            self._export_from_zip(export_dir)
+        logging.info("Exportación manual: %s", self.stats)
+        return export_dir
+
+    def _default_export_dir(self):
+        if self.working_dir:
+            return os.path.join(self.working_dir, 'componentes_extraidos')
+        stem = os.path.splitext(os.path.basename(self.source_zip))[0] or 'libro'
+        return os.path.join(os.path.dirname(os.path.abspath(self.source_zip)), f'{stem}_componentes_extraidos')
+
+    def _export_from_package(self, package, export_dir):
+        export_abs = os.path.abspath(export_dir)
+        for name in package.names():
+            if classify_part(name) not in self.part_types:
+                self.stats['skipped'] += 1
+                continue
+            file_path = package.path(name)
+            if os.path.abspath(file_path).startswith(export_abs + os.sep):
+                continue
+            dest_path = os.path.join(export_dir, *name.split('/'))
+            os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+            if os.path.lexists(dest_path):
+                os.remove(dest_path)
+            self._place(file_path, dest_path)
+
+    def _place(self, src, dst):
+        if self.mode in ('auto', 'reflink') and self._try_reflink(src, dst):
+            self.stats['reflink'] += 1
+            return
+        if self.mode in ('auto', 'hardlink'):
+            try:
+                os.link(src, dst)
+                self.stats['hardlink'] += 1
+                return
+            except OSError as exc:
+                if exc.errno not in _LINK_ERRORS:
+                    raise
+        self._chunked_copy(src, dst)
+        self.stats['copy'] += 1
+
+    @staticmethod
+    def _try_reflink(src, dst):
+        if fcntl is None:
+            return False
+        try:
+            with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+                fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+        except OSError as exc:
+            if os.path.exists(dst):
+                os.remove(dst)
+            if exc.errno in _LINK_ERRORS:
+                return False
+            raise
+        shutil.copystat(src, dst)
+        return True
+
+    def _chunked_copy(self, src, dst):
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            shutil.copyfileobj(fsrc, fdst, _CHUNK_SIZE)
+        shutil.copystat(src, dst)
+        self.stats['bytes_written'] += os.path.getsize(dst)
+
+    def _export_from_zip(self, export_dir):
+        export_root = os.path.abspath(export_dir)
+        with zipfile.ZipFile(self.source_zip) as zf:
+            for info in zf.infolist():
+                if info.is_dir():
+                    continue
+                if classify_part(info.filename) not in self.part_types:
+                    self.stats['skipped'] += 1
+                    continue
+                dest_path = os.path.abspath(os.path.join(export_root, info.filename))
+                if not dest_path.startswith(export_root + os.sep):
+                    logging.warning("Se omite la entrada con ruta insegura: %s", info.filename)
+                    self.stats['skipped'] += 1
+                    continue
+                os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+                with zf.open(info) as fsrc, open(dest_path, 'wb') as fdst:
+                    shutil.copyfileobj(fsrc, fdst, _CHUNK_SIZE)
+                self.stats['zip'] += 1
+                self.stats['bytes_written'] += info.file_size
@@ -0,0 +1,333 @@
+"""
+Almacén de salidas direccionado por contenido.
+
+Las variantes de un mismo libro (p. ej. las versiones mensuales) producen
+``.xlsm`` y módulos exportados casi idénticos. En lugar de guardar cada salida
+completa, el almacén guarda cada miembro ZIP y cada archivo una sola vez,
+identificado por el SHA-256 de su contenido descomprimido, y cada salida pasa
+a ser un manifiesto JSON con la lista ordenada de miembros.
+
+Los blobs se guardan ya comprimidos (flujo deflate sin cabeceras), así que un
+``.xlsm`` se materializa copiando los blobs tras sus cabeceras locales, sin
+recomprimir ni pasar por archivos temporales, y puede escribirse en cualquier
+flujo binario (incluso uno que no admita ``seek``). Al añadir un ZIP, los
+miembros deflate se guardan tal cual vienen: sólo se descomprimen para
+calcular el hash y comprobar el CRC.
+
+Estructura::
+
+    <raíz>/blobs/ab/abcdef...      flujo deflate del contenido
+    <raíz>/manifests/<nombre>.json
+
+Un manifiesto nunca se sustituye por otro con contenido distinto: si el nombre
+ya está ocupado se usa ``libro_2.xlsm``, ``libro_3.xlsm``... (ver ``_save_manifest``).
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import zipfile
+import zlib
+
+STORE_VERSION = 1
+BLOB_DIR = 'blobs'
+MANIFEST_DIR = 'manifests'
+BLOB_LEVEL = 6
+READ_SIZE = 1024 * 1024
+
+
+def _deflate(data, level=BLOB_LEVEL):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _inflated_digest(raw):
+    """SHA-256, CRC y tamaño del contenido de un flujo deflate."""
+    decompressor = zlib.decompressobj(-15)
+    digest, crc, size = hashlib.sha256(), 0, 0
+    view = memoryview(raw)
+    for start in range(0, len(view), READ_SIZE):
+        chunk = decompressor.decompress(view[start:start + READ_SIZE])
+        digest.update(chunk)
+        crc = zlib.crc32(chunk, crc)
+        size += len(chunk)
+    tail = decompressor.flush()
+    digest.update(tail)
+    return digest.hexdigest(), zlib.crc32(tail, crc), size + len(tail)
+
+
+class OutputStore:
+    def __init__(self, root):
+        self.root = root
+        self.stats = {'members': 0, 'stored': 0, 'reused': 0, 'bytes': 0, 'stored_bytes': 0}
+
+    # Blobs
+
+    def blob_path(self, digest):
+        return os.path.join(self.root, BLOB_DIR, digest[:2], digest)
+
+    def _put(self, digest, size, raw=None, data=None):
+        """Guarda el blob si no existe; devuelve su tamaño comprimido."""
+        path = self.blob_path(digest)
+        self.stats['members'] += 1
+        self.stats['bytes'] += size
+        try:
+            compress_size = os.path.getsize(path)
+        except OSError:
+            pass
+        else:
+            self.stats['reused'] += 1
+            return compress_size
+        if raw is None:
+            raw = _deflate(data)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Varios trabajos pueden guardar a la vez el mismo blob: cada uno escribe su temporal
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(raw)
+        os.replace(tmp_path, path)
+        self.stats['stored'] += 1
+        self.stats['stored_bytes'] += len(raw)
+        return len(raw)
+
+    def put_bytes(self, data):
+        """Guarda ``data``; devuelve la entrada de manifiesto (sin nombre)."""
+        digest = hashlib.sha256(data).hexdigest()
+        compress_size = self._put(digest, len(data), data=data)
+        return {'sha256': digest, 'size': len(data), 'crc': zlib.crc32(data), 'compress_size': compress_size}
+
+    def _put_member(self, src, zf, info):
+        from utils.parallel_zip import seek_member_data
+
+        if info.flag_bits & 0x1 or info.compress_type != zipfile.ZIP_DEFLATED:
+            # Sin comprimir, cifrado u otro método: se lee descomprimido y se guarda con deflate
+            entry = self.put_bytes(zf.read(info))
+        else:
+            seek_member_data(src, info)
+            raw = src.read(info.compress_size)
+            if len(raw) != info.compress_size:
+                raise zipfile.BadZipFile(f"Datos truncados en {info.filename}")
+            digest, crc, size = _inflated_digest(raw)
+            if crc != info.CRC:
+                raise zipfile.BadZipFile(f"CRC incorrecto en {info.filename}")
+            entry = {'sha256': digest, 'size': size, 'crc': crc, 'compress_size': self._put(digest, size, raw=raw)}
+        entry.update(name=info.filename, date_time=list(info.date_time), external_attr=info.external_attr)
+        return entry
+
+    def _blob_chunks(self, entry):
+        with open(self.blob_path(entry['sha256']), 'rb') as f:
+            while True:
+                chunk = f.read(READ_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+
+    def _inflated_chunks(self, entry):
+        decompressor = zlib.decompressobj(-15)
+        for chunk in self._blob_chunks(entry):
+            yield decompressor.decompress(chunk)
+        yield decompressor.flush()
+
+    # Manifiestos
+
+    def manifest_path(self, name):
+        parts = [part for part in name.replace('\\', '/').split('/') if part]
+        if not parts or any(part in ('.', '..') for part in parts):
+            raise ValueError(f"Nombre de manifiesto no válido: {name}")
+        return os.path.join(self.root, MANIFEST_DIR, *parts[:-1], parts[-1] + '.json')
+
+    def _save_manifest(self, name, kind, source, entries):
+        """
+        Escribe el manifiesto sin pisar nunca otro: si ``name`` ya existe con el
+        mismo contenido se reutiliza y, si no, se prueba ``<name>_2``, ``<name>_3``... (antes de la extensión).
+        Devuelve el nombre con el que quedó guardado.
+        """
+        (base, ext), index = os.path.splitext(name), 1
+        while True:
+            path = self.manifest_path(name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            manifest = {'version': STORE_VERSION, 'name': name, 'kind': kind,
+                        'source': os.path.basename(os.path.normpath(source)), 'entries': entries}
+            tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(manifest, f, ensure_ascii=False)
+            try:
+                # link() no sustituye un destino existente, a diferencia de replace()
+                os.link(tmp_path, path)
+            except FileExistsError:
+                if self._same_content(name, kind, entries):
+                    logging.info("Almacén: manifiesto %s ya guardado", name)
+                    return name
+                index += 1
+                name = f'{base}_{index}{ext}'
+                continue
+            finally:
+                os.remove(tmp_path)
+            logging.info("Almacén: manifiesto %s (%d miembro(s))", name, len(entries))
+            return name
+
+    def _same_content(self, name, kind, entries):
+        try:
+            existing = self.load(name)
+        except (OSError, ValueError):
+            return False
+        key = ['name', 'sha256']
+        return existing.get('kind') == kind and \
+            [[e.get(k) for k in key] for e in existing.get('entries', [])] == [[e[k] for k in key] for e in entries]
+
+    def load(self, name):
+        with open(self.manifest_path(name), 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def names(self):
+        base = os.path.join(self.root, MANIFEST_DIR)
+        found = []
+        for dirpath, _dirnames, filenames in os.walk(base):
+            for filename in filenames:
+                if filename.endswith('.json'):
+                    rel = os.path.relpath(os.path.join(dirpath, filename[:-5]), base)
+                    found.append(rel.replace(os.sep, '/'))
+        return sorted(found)
+
+    # Alta de salidas
+
+    def add_zip(self, name, zip_path):
+        """Guarda los miembros de un ZIP (``.xlsm``, paquete de macros...)."""
+        with open(zip_path, 'rb') as src, zipfile.ZipFile(src) as zf:
+            entries = [self._put_member(src, zf, info) for info in zf.infolist()]
+        return self._save_manifest(name, 'zip', zip_path, entries)
+
+    def add_directory(self, name, directory):
+        entries = []
+        for dirpath, dirnames, filenames in os.walk(directory):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                path = os.path.join(dirpath, filename)
+                with open(path, 'rb') as f:
+                    entry = self.put_bytes(f.read())
+                entry.update(name=os.path.relpath(path, directory).replace(os.sep, '/'),
+                             mode=os.stat(path).st_mode & 0o777)
+                entries.append(entry)
+        return self._save_manifest(name, 'dir', directory, entries)
+
+    def add_file(self, name, path):
+        with open(path, 'rb') as f:
+            entry = self.put_bytes(f.read())
+        entry['name'] = os.path.basename(path)
+        return self._save_manifest(name, 'file', path, [entry])
+
+    def add(self, name, path):
+        """Guarda ``path`` según su tipo: carpeta, ZIP o archivo suelto."""
+        if os.path.isdir(path):
+            return self.add_directory(name, path)
+        if zipfile.is_zipfile(path):
+            return self.add_zip(name, path)
+        return self.add_file(name, path)
+
+    # Materialización
+
+    def materialize(self, name, target):
+        """
+        Reconstruye la salida ``name`` en ``target``: una ruta (carpeta para
+        los manifiestos de tipo ``dir``) o un flujo binario abierto para
+        escritura (sólo ``zip`` y ``file``). Devuelve ``target``.
+        """
+        manifest = self.load(name)
+        kind = manifest['kind']
+        if kind == 'dir':
+            for entry in manifest['entries']:
+                path = os.path.join(target, *entry['name'].split('/'))
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                self._write_file(entry, path)
+                os.chmod(path, entry.get('mode', 0o644))
+            return target
+        if hasattr(target, 'write'):
+            self._write_stream(kind, manifest['entries'], target)
+            return target
+        os.makedirs(os.path.dirname(os.path.abspath(target)), exist_ok=True)
+        with open(target, 'wb') as f:
+            self._write_stream(kind, manifest['entries'], f)
+        return target
+
+    def _write_stream(self, kind, entries, fp):
+        if kind == 'zip':
+            self._write_zip(entries, fp)
+        elif kind == 'file':
+            for chunk in self._inflated_chunks(entries[0]):
+                fp.write(chunk)
+        else:
+            raise ValueError(f"Un manifiesto de tipo {kind} sólo se materializa en una carpeta")
+
+    def _write_file(self, entry, path):
+        crc = 0
+        with open(path, 'wb') as f:
+            for chunk in self._inflated_chunks(entry):
+                crc = zlib.crc32(chunk, crc)
+                f.write(chunk)
+        if crc != entry['crc']:
+            raise ValueError(f"CRC incorrecto al materializar {entry['name']}")
+
+    def _write_zip(self, entries, fp):
+        # Se cuentan los bytes escritos en vez de usar tell(): el flujo puede no admitir seek
+        from utils.parallel_zip import ZipEntry, central_header, end_records, local_header
+
+        offset = 0
+        written = []
+        for item in entries:
+            entry = ZipEntry(item['name'], item['size'], tuple(item['date_time']), item['external_attr'],
+                             zipfile.ZIP_DEFLATED)
+            entry.crc = item['crc']
+            entry.compress_size = item['compress_size']
+            entry.header_offset = offset
+            header = local_header(entry)
+            fp.write(header)
+            offset += len(header)
+            for chunk in self._blob_chunks(item):
+                fp.write(chunk)
+                offset += len(chunk)
+            written.append(entry)
+        start = offset
+        for entry in written:
+            header = central_header(entry)
+            fp.write(header)
+            offset += len(header)
+        fp.write(end_records(len(written), start, offset))
+
+    # Mantenimiento
+
+    def collect_garbage(self):
+        """Borra los blobs que ningún manifiesto referencia; devuelve cuántos."""
+        referenced = set()
+        for name in self.names():
+            referenced.update(entry['sha256'] for entry in self.load(name)['entries'])
+        removed = 0
+        for dirpath, _dirnames, filenames in os.walk(os.path.join(self.root, BLOB_DIR)):
+            for filename in filenames:
+                if filename not in referenced:
+                    os.remove(os.path.join(dirpath, filename))
+                    removed += 1
+        return removed
+
+
+def store_outputs(store_dir, prefix, outputs):
+    """
+    Pasa al almacén las salidas ``{clave: ruta}`` y borra los originales;
+    devuelve ``{clave: nombre de manifiesto}``. Cada original se borra sólo
+    después de que su manifiesto quede escrito (sin pisar el de otro trabajo).
+    """
+    import shutil
+
+    store = OutputStore(store_dir)
+    manifests = {}
+    for key, path in outputs.items():
+        if not path or not os.path.exists(path):
+            continue
+        manifests[key] = store.add(f'{prefix}/{os.path.basename(os.path.normpath(path))}', path)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+    logging.info("Almacén %s: %d de %d byte(s) nuevos en blobs",
+                 store_dir, store.stats['stored_bytes'], store.stats['bytes'])
+    return manifests
@@ -0,0 +1,169 @@
+"""
+Selección de las partes que se emiten al reconstruir el .xlsm.
+
+Sólo se conservan las partes alcanzables desde ``_rels/.rels`` (más una lista
+de permitidas); se descartan las cargas propias de XLtoEXE y, opcionalmente,
+las imágenes de customUI que el XML de la cinta no usa. ``[Content_Types].xml``
+y los ``.rels`` afectados se reescriben para que no apunten a partes omitidas.
+"""
+import io
+import posixpath
+import re
+import xml.etree.ElementTree as ET
+from collections import deque
+
+from extractor.package_index import CONTENT_TYPES_PART, Package
+
+_PROPS_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/custom-properties}'
+
+# Prefijos que se conservan aunque ninguna relación los alcance
+ALLOWLIST = ('docProps/', 'customXml/')
+
+# Partes y propiedades que sólo existen por el empaquetado de XLtoEXE
+XLTOEXE_PART_PATTERN = re.compile(r'xlto_?exe', re.IGNORECASE)
+CUSTOM_PROPERTIES_PART = 'docProps/custom.xml'
+
+# Relationship y Override son siempre elementos vacíos: se eliminan sobre el texto
+# para no alterar el resto del XML (prefijos, BOM, orden de atributos)
+_RELATIONSHIP_ELEMENT = re.compile(rb'<(?:\w+:)?Relationship\b[^>]*?\bId=(["\'])(.*?)\1[^>]*/>\s*')
+_OVERRIDE_ELEMENT = re.compile(rb'<(?:\w+:)?Override\b[^>]*?\bPartName=(["\'])(.*?)\1[^>]*/>\s*')
+
+_UI_EXTENSIBILITY_REL = 'extensibility'
+_IMAGE_REL = 'image'
+
+
+def _rel_type(rel):
+    return (rel.get('type') or '').rsplit('/', 1)[-1]
+
+
+class PackagePruner:
+    def __init__(self, package, allowlist=ALLOWLIST, drop_xltoexe=True, prune_customui_images=False):
+        self.package = Package.coerce(package)
+        self.allowlist = tuple(allowlist)
+        self.drop_xltoexe = drop_xltoexe
+        self.prune_customui_images = prune_customui_images
+        self.dropped = {}
+        self._unused_images = set()
+
+    def plan(self):
+        """
+        Devuelve ``(partes, reescritas)``: la lista ordenada de partes a emitir y
+        un dict nombre -> bytes con las partes cuyo contenido hay que sustituir.
+        """
+        self.dropped = {}
+        self._unused_images = set()
+        excluded = self._xltoexe_parts() if self.drop_xltoexe else set()
+        removed_rels = self._unused_customui_images() if self.prune_customui_images else {}
+
+        emitted = set()
+        pending = deque([''])
+        while pending:
+            source = pending.popleft()
+            for rel in self.package.relationships(source):
+                target = rel['part']
+                if target is None or target in excluded or rel['id'] in removed_rels.get(source, ()):
+                    continue
+                if target in self.package and target not in emitted:
+                    emitted.add(target)
+                    pending.append(target)
+
+        for name in self.package:
+            if name in excluded or name in emitted or name == CONTENT_TYPES_PART:
+                continue
+            source = self._rels_source(name)
+            if source is not None:
+                if source == '' or source in emitted:
+                    continue
+                if source in self.package and source not in excluded and source.startswith(self.allowlist):
+                    continue
+                self.dropped.setdefault(name, 'relaciones de una parte omitida')
+            elif name.startswith(self.allowlist):
+                emitted.add(name)
+            elif name in self._unused_images:
+                self.dropped[name] = 'imagen de customUI sin usar'
+            else:
+                self.dropped[name] = 'no referenciada'
+
+        parts = [name for name in self.package if name not in self.dropped]
+        rewritten = {}
+        for name in parts:
+            source = self._rels_source(name)
+            if source is None:
+                continue
+            data = self._rewrite_rels(source, set(self.dropped), removed_rels.get(source, ()))
+            if data is not None:
+                rewritten[name] = data
+        content_types = self._rewrite_content_types(set(self.dropped))
+        if content_types is not None:
+            rewritten[CONTENT_TYPES_PART] = content_types
+        return parts, rewritten
+
+    @staticmethod
+    def _rels_source(name):
+        directory, base = posixpath.split(name)
+        if posixpath.basename(directory) != '_rels' or not base.endswith('.rels'):
+            return None
+        return posixpath.join(posixpath.dirname(directory), base[:-len('.rels')])
+
+    def _xltoexe_parts(self):
+        parts = set()
+        for name in self.package:
+            if XLTOEXE_PART_PATTERN.search(name):
+                parts.add(name)
+                self.dropped[name] = 'carga de XLtoEXE'
+        if CUSTOM_PROPERTIES_PART in self.package and self._only_xltoexe_properties():
+            parts.add(CUSTOM_PROPERTIES_PART)
+            self.dropped[CUSTOM_PROPERTIES_PART] = 'propiedades exclusivas de XLtoEXE'
+        return parts
+
+    def _only_xltoexe_properties(self):
+        """True si custom.xml sólo contiene propiedades de la base de firmas de XLtoEXE."""
+        try:
+            root = ET.fromstring(self.package.read(CUSTOM_PROPERTIES_PART))
+        except ET.ParseError:
+            return False
+        # Sin propiedades (p. ej. tras XLtoEXECleaner) la parte tampoco aporta nada
+        from cleaner.xlt_exe_cleaner import default_matcher
+        matcher = default_matcher()
+        names = [prop.get('name', '') for prop in root.iter(f'{_PROPS_NS}property')]
+        return all(matcher.matches(name, 'custom_properties') for name in names)
+
+    def _unused_customui_images(self):
+        """Por cada parte customUI, ids de relaciones de imagen que su XML no usa."""
+        removed = {}
+        for rel in self.package.relationships(''):
+            ui_part = rel['part']
+            if _rel_type(rel) != _UI_EXTENSIBILITY_REL or ui_part not in self.package:
+                continue
+            used = set()
+            for _, elem in ET.iterparse(io.BytesIO(self.package.read(ui_part))):
+                image = elem.get('image')
+                if image:
+                    used.add(image)
+                elem.clear()
+            unused = set()
+            for image_rel in self.package.relationships(ui_part):
+                if _rel_type(image_rel) == _IMAGE_REL and image_rel['id'] not in used:
+                    unused.add(image_rel['id'])
+                    # Si otra parte emitida también la usa, el recorrido la conserva
+                    self._unused_images.add(image_rel['part'])
+            if unused:
+                removed[ui_part] = unused
+        return removed
+
+    def _rewrite_rels(self, source, dropped, removed_ids):
+        remove = {rel['id'] for rel in self.package.relationships(source)
+                  if rel['part'] in dropped or rel['id'] in removed_ids}
+        if not remove:
+            return None
+        return _RELATIONSHIP_ELEMENT.sub(
+            lambda m: b'' if m.group(2).decode('utf-8') in remove else m.group(0),
+            self.package.read(Package.rels_name(source)))
+
+    def _rewrite_content_types(self, dropped):
+        _, overrides = self.package.content_types()
+        if not any(name in dropped for name in overrides):
+            return None
+        return _OVERRIDE_ELEMENT.sub(
+            lambda m: b'' if m.group(2).decode('utf-8').lstrip('/') in dropped else m.group(0),
+            self.package.read(CONTENT_TYPES_PART))
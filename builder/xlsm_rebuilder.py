@@ -1,17 +1,56 @@
-import zipfile
+import logging
 import os
+import time
+
+from extractor.package_index import CONTENT_TYPES_PART, Package
+from utils.parallel_zip import ParallelZipWriter
+
+# Modo determinista: misma entrada y opciones, mismos bytes de salida
+DETERMINISTIC_LEVEL = 6
+DETERMINISTIC_ATTR = 0o644 << 16
+_ZIP_EPOCH = (1980, 1, 1, 0, 0, 0)
+
+
+def deterministic_date_time():
+    """Fecha fija de los miembros: ``SOURCE_DATE_EPOCH`` si está definida, si no 1980-01-01."""
+    epoch = os.environ.get('SOURCE_DATE_EPOCH')
+    if not epoch:
+        return _ZIP_EPOCH
+    try:
+        date_time = time.gmtime(int(epoch))[:6]
+    except (ValueError, OverflowError):
+        logging.warning("SOURCE_DATE_EPOCH no válido (%s): se usa 1980-01-01", epoch)
+        return _ZIP_EPOCH
+    return max(date_time, _ZIP_EPOCH)
 
 class XLSMRebuilder:
-    def __init__(self, working_dir):
-        self.working_dir = working_dir
+    def __init__(self, working_dir, prune=True, prune_customui_images=False, workers=None, deterministic=False):
+        # Acepta la ruta o un Package ya indexado
+        self.package = Package.coerce(working_dir)
+        self.working_dir = self.package.root
+        self.prune = prune
+        self.prune_customui_images = prune_customui_images
+        # Hilos de compresión (por defecto, según los núcleos disponibles)
+        self.workers = workers
+        self.deterministic = deterministic
+        self.dropped = {}
 
-    def rebuild(self, output_path=None):
+    def rebuild(self, output_path=None, validate=True):
         """
         Reconstruye el archivo XLSM a partir de los archivos extraídos.
         
         Args:
             output_path (str, optional): Ruta completa donde guardar el archivo reconstruido.
                                        Si no se especifica, se guarda en el directorio de trabajo.
+            validate (bool): Validar el grafo de relaciones del resultado; si tiene errores
+                             que no estaban ya en la entrada, se elimina el archivo y se
+                             lanza una excepción (los heredados sólo se avisan).
+
+        Con ``prune`` sólo se emiten las partes alcanzables por relaciones (ver
+        PackagePruner); lo descartado queda en ``self.dropped``. Con
+        ``deterministic`` todas las partes llevan la misma fecha y permisos, el
+        nivel de compresión es fijo y el orden es el del archivo de origen, así
+        que dos reconstrucciones de la misma entrada dan los mismos bytes.
         """
         if output_path is None:
             output_path = os.path.join(self.working_dir, 'reconstruido.xlsm')
@@ -20,33 +59,78 @@ class XLSMRebuilder:
         os.makedirs(os.path.dirname(output_path), exist_ok=True)
         
         try:
-            with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                # Primero agregar [Content_Types].xml si existe
-                content_types_path = os.path.join(self.working_dir, '[Content_Types].xml')
-                if os.path.exists(content_types_path):
-                    zipf.write(content_types_path, '[Content_Types].xml')
-                
-                # Luego agregar _rels/.rels si existe
-                rels_dir = os.path.join(self.working_dir, '_rels')
-                if os.path.exists(rels_dir):
-                    for file in os.listdir(rels_dir):
-                        file_path = os.path.join(rels_dir, file)
-                        if os.path.isfile(file_path):
-                            zipf.write(file_path, f'_rels/{file}')
-                
-                # Finalmente agregar el resto de los archivos en orden
-                for root, dirs, files in os.walk(self.working_dir):
-                    for file in sorted(files):  # Ordenar archivos para consistencia
-                        file_path = os.path.join(root, file)
-                        # Excluir el archivo de salida si está en el directorio
-                        if os.path.abspath(file_path) != os.path.abspath(output_path):
-                            arcname = os.path.relpath(file_path, self.working_dir)
-                            # No agregar archivos ya agregados
-                            if arcname not in ['[Content_Types].xml'] and not arcname.startswith('_rels/'):
-                                zipf.write(file_path, arcname)
+            parts, rewritten = self._select_parts()
+            # Las partes se comprimen en paralelo; el orden del archivo no cambia
+            if self.deterministic:
+                zipf = ParallelZipWriter(output_path, self.workers, DETERMINISTIC_LEVEL)
+                date_time = deterministic_date_time()
+            else:
+                zipf = ParallelZipWriter(output_path, self.workers)
+            with zipf:
+                # Primero [Content_Types].xml, luego _rels/ y el resto en orden
+                for name in self._ordered_parts(parts, output_path):
+                    if self.deterministic:
+                        data = rewritten[name] if name in rewritten else self.package.view(name)
+                        zipf.add(name, data, date_time, DETERMINISTIC_ATTR)
+                    elif name in rewritten:
+                        zipf.add(name, rewritten[name])
+                    else:
+                        zipf.add_file(name, self.package.path(name), self.package.view(name))
+            if validate:
+                self._validate(output_path)
         
         except Exception as e:
             # Si algo sale mal, eliminar el archivo incompleto
             if os.path.exists(output_path):
                 os.remove(output_path)
             raise Exception(f"Error al reconstruir el archivo: {str(e)}")
+
+    def _validate(self, output_path):
+        from analyzer.package_validator import PackageValidator
+        # Se cierra el resultado antes de que se pueda borrar (en Windows no se borra abierto)
+        with Package.from_zip(output_path) as output:
+            validator = PackageValidator(output)
+            validator.validate()
+            if validator.is_valid():
+                validator.raise_for_errors()
+                return
+            # Hay errores: sólo cuentan los que no traía ya la entrada (Excel abre muchos así).
+            # La entrada es el ZIP de origen, no las partes ya limpiadas
+            if self.package.zip_path and os.path.isfile(self.package.zip_path):
+                with Package.from_zip(self.package.zip_path) as source:
+                    baseline = PackageValidator(source)
+                    baseline.validate()
+            else:
+                baseline = PackageValidator(self.package)
+                baseline.validate()
+            validator.raise_for_errors(baseline)
+
+    def _select_parts(self):
+        if not self.prune:
+            return self.package.names(), {}
+        from builder.package_pruner import PackagePruner
+        pruner = PackagePruner(self.package, prune_customui_images=self.prune_customui_images)
+        parts, rewritten = pruner.plan()
+        self.dropped = pruner.dropped
+        if self.dropped:
+            saved = sum(self.package.size(name) for name in self.dropped)
+            logging.info("Reconstrucción: %d parte(s) omitida(s), %d bytes menos", len(self.dropped), saved)
+            for name, reason in sorted(self.dropped.items()):
+                logging.debug("Parte omitida %s: %s", name, reason)
+        return parts, rewritten
+
+    def _ordered_parts(self, parts, output_path):
+        output_abs = os.path.abspath(output_path)
+        names = [name for name in parts if os.path.abspath(self.package.path(name)) != output_abs]
+        first = [CONTENT_TYPES_PART] if CONTENT_TYPES_PART in names else []
+        rels = [name for name in names if name.startswith('_rels/')]
+        rest = [name for name in names if name != CONTENT_TYPES_PART and not name.startswith('_rels/')]
+        if self.deterministic:
+            # Orden del índice: el del directorio central de origen (o el recorrido ordenado del directorio)
+            order = {name: index for index, name in enumerate(self.package)}
+            rels.sort(key=lambda name: (order.get(name, len(order)), name))
+            rest.sort(key=lambda name: (order.get(name, len(order)), name))
+        else:
+            rels.sort()
+            rest.sort()
+        return first + rels + rest
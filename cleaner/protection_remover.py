@@ -1,39 +1,55 @@
-import os
-import xml.etree.ElementTree as ET
+import posixpath
+import re
+
+from extractor.package_index import Package
+
+# Partes que pueden llevar <workbookProtection> o <sheetProtection>; el resto
+# (sharedStrings, estilos, dibujos...) no se lee
+_PROTECTED_CONTENT_TYPES = ('sheet.main+xml', 'sheet.macroEnabled.main+xml', 'template.main+xml',
+                            'template.macroEnabled.main+xml', 'worksheet+xml', 'chartsheet+xml',
+                            'dialogsheet+xml', 'macrosheet+xml', 'intlmacrosheet+xml')
+_PROTECTED_DIRS = ('xl/worksheets', 'xl/chartsheets', 'xl/dialogsheets', 'xl/macrosheets')
+
+# Los elementos de protección sólo llevan atributos: se quitan sobre el texto,
+# sin reserializar el XML (que perdería prefijos y mc:Ignorable)
+_PROTECTION_ELEMENT = re.compile(
+    rb'<(?:\w+:)?(workbookProtection|sheetProtection)\b[^>]*?(?:/>|>.*?</(?:\w+:)?\1>)\s*', re.S)
 
 class ProtectionRemover:
     def __init__(self, working_dir):
-        self.working_dir = working_dir
+        # Acepta la ruta o un Package ya indexado
+        self.package = Package.coerce(working_dir)
+        self.working_dir = self.package.root
 
     def remove_sheet_and_workbook_protection(self):
         # Elimina protección de workbook y hojas
-        for root, dirs, files in os.walk(self.working_dir):
-            for file in files:
-                if file.endswith('.xml'):
-                    path = os.path.join(root, file)
-                    self._clean_xml(path)
+        for name in self._protectable_parts():
+            self._clean_xml(name)
 
-    def _clean_xml(self, path):
-        ET.register_namespace('', "http://schemas.openxmlformats.org/spreadsheetml/2006/main")
-        tree = ET.parse(path)
-        root = tree.getroot()
-        changed = False
-        for tag in ['{http://schemas.openxmlformats.org/spreadsheetml/2006/main}workbookProtection',
-                    '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}sheetProtection']:
-            for elem in root.findall(tag):
-                root.remove(elem)
-                changed = True
-        if changed:
-            tree.write(path, encoding='utf-8', xml_declaration=True)
+    def _protectable_parts(self):
+        parts = []
+        for name in self.package.names(('.xml',)):
+            content_type = self.package.content_type(name) or ''
+            if (content_type.endswith(_PROTECTED_CONTENT_TYPES) or name == 'xl/workbook.xml'
+                    or posixpath.dirname(name) in _PROTECTED_DIRS):
+                parts.append(name)
+        return parts
+
+    def _clean_xml(self, name):
+        # Búsqueda sobre la parte mapeada: las hojas sin protección no se copian a memoria
+        with self.package.view(name) as view:
+            if _PROTECTION_ELEMENT.search(view) is None:
+                return
+        data = self.package.read(name)
+        self.package.write_part(name, _PROTECTION_ELEMENT.sub(b'', data))
 
     def remove_vba_project_password(self):
         """Parches suaves sobre PROJECT stream para deshabilitar la contraseña sin corromper el binario."""
-        vba_path = self._find_vba_project_path()
-        if not vba_path:
+        vba_part = self.package.vba_project()
+        if not vba_part:
             return False
 
-        with open(vba_path, 'rb') as f:
-            data = f.read()
+        data = self.package.read(vba_part)
 
         replacements = [
             (b'DPB="', b'DPX="'),
@@ -61,13 +77,5 @@ class ProtectionRemover:
         if not changed:
             return False
 
-        with open(vba_path, 'wb') as f:
-            f.write(data)
+        self.package.write_part(vba_part, data)
         return True
-
-    def _find_vba_project_path(self):
-        for root, dirs, files in os.walk(self.working_dir):
-            for file in files:
-                if file.lower() == 'vbaproject.bin':
-                    return os.path.join(root, file)
-        return None
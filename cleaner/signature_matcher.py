@@ -0,0 +1,83 @@
+"""
+Buscador multipatrón Aho-Corasick sobre bytes, sin distinguir mayúsculas ASCII.
+
+El autómata se construye una vez; cada búsqueda recorre el texto una sola vez,
+así que el coste no crece con el número de firmas (sólo con las coincidencias).
+"""
+import re
+from collections import deque
+
+_LOWER = bytes.maketrans(b'ABCDEFGHIJKLMNOPQRSTUVWXYZ', b'abcdefghijklmnopqrstuvwxyz')
+
+
+class SignatureMatcher:
+    def __init__(self, patterns):
+        """``patterns`` es una lista de (patrón, etiqueta); un patrón puede tener varias etiquetas."""
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+        for pattern, label in patterns:
+            self._add(pattern.encode('utf-8') if isinstance(pattern, str) else pattern, label)
+        self._build()
+
+    def _add(self, pattern, label):
+        pattern = pattern.translate(_LOWER)
+        if not pattern:
+            return
+        state = 0
+        for byte in pattern:
+            nxt = self._goto[state].get(byte)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][byte] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = nxt
+        self._out[state].append((len(pattern), label))
+
+    def _build(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for byte, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and byte not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(byte, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+        # Desde el estado raíz se salta (en C) hasta el siguiente byte que inicia algún patrón
+        first = b''.join(re.escape(bytes([b])) for b in sorted(self._goto[0]))
+        self._start = re.compile(b'[' + first + b']') if first else None
+
+    def finditer(self, data):
+        """Produce (inicio, fin, etiqueta) por cada coincidencia en ``data``."""
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        data = bytes(data).translate(_LOWER)
+        if self._start is None:
+            return
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        index, end = 0, len(data)
+        while index < end:
+            if state == 0:
+                found = self._start.search(data, index)
+                if found is None:
+                    return
+                index = found.start()
+            byte = data[index]
+            while state and byte not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(byte, 0)
+            for length, label in out[state]:
+                yield index + 1 - length, index + 1, label
+            index += 1
+
+    def labels(self, data):
+        """Conjunto de etiquetas presentes en ``data``."""
+        return {label for _, _, label in self.finditer(data)}
+
+    def matches(self, data, label):
+        return any(found == label for _, _, found in self.finditer(data))
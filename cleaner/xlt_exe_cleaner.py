@@ -1,17 +1,253 @@
+import json
+import logging
 import os
 import re
 
+from cleaner.signature_matcher import SignatureMatcher
+from extractor.package_index import Package
+
+SIGNATURES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'xltoexe_signatures.json')
+CATEGORIES = ('custom_properties', 'defined_names', 'hidden_sheets', 'vba_modules', 'ribbon_callbacks',
+              'app_properties')
+
+_CUSTOM_PROPERTIES = 'docProps/custom.xml'
+_DOC_PROPERTIES = ('docProps/app.xml', 'docProps/core.xml')
+
+# Los elementos afectados son siempre de forma conocida: se editan sobre el texto
+# para no reescribir el resto del XML (prefijos, mc:Ignorable, BOM)
+_ATTR = re.compile(r'([\w:]+)\s*=\s*(["\'])(.*?)\2', re.S)
+_PROPERTY = re.compile(r'<(?:\w+:)?property\b[^>]*>.*?</(?:\w+:)?property>\s*', re.S)
+_TEXT_ELEMENT = re.compile(r'<((?:\w+:)?\w+)(\s[^>]*)?>([^<]+)</\1>')
+_DEFINED_NAME = re.compile(r'<(?:\w+:)?definedName\b([^>]*)>.*?</(?:\w+:)?definedName>\s*', re.S)
+_SHEET = re.compile(r'<(?:\w+:)?sheet\b([^>]*)/>\s*')
+_WORKBOOK_VIEW = re.compile(r'<(?:\w+:)?workbookView\b[^>]*/?>')
+_ACTIVE_TAB = re.compile(r'\bactiveTab="(\d+)"')
+_SHEET_VIEW = re.compile(r'<(?:\w+:)?sheetView\b[^>]*?/?>')
+_TAB_SELECTED = re.compile(r'\btabSelected\s*=\s*(["\'])(.*?)\1')
+_CALLBACK_ATTR = re.compile(r'\s((?:on|get)[A-Z]\w*)\s*=\s*(["\'])(.*?)\2')
+_RELATIONSHIP = re.compile(r'<(?:\w+:)?Relationship\b[^>]*?\bId=(["\'])(.*?)\1[^>]*/>\s*')
+_VBA_PROJECT_LINE = re.compile(rb'^(Module|Class|BaseClass|Document|Package)=([^\r\n]*)', re.M)
+
+_CALC_CHAIN_REL = 'calcChain'
+_UI_EXTENSIBILITY_REL = 'extensibility'
+_OFFICE_DOCUMENT_REL = 'officeDocument'
+
+_default_matcher = None
+
+
+def load_signatures(path=None):
+    with open(path or SIGNATURES_PATH, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    return {category: list(data.get(category, ())) for category in CATEGORIES}
+
+
+def build_matcher(signatures):
+    return SignatureMatcher([(pattern, category) for category in CATEGORIES
+                             for pattern in signatures.get(category, ())])
+
+
+def default_matcher():
+    global _default_matcher
+    if _default_matcher is None:
+        _default_matcher = build_matcher(load_signatures())
+    return _default_matcher
+
+
+def _attrs(text):
+    return {key: value for key, _, value in _ATTR.findall(text)}
+
+
+def _rel_type(rel):
+    return (rel.get('type') or '').rsplit('/', 1)[-1]
+
+
 class XLtoEXECleaner:
-    def __init__(self, working_dir):
-        self.working_dir = working_dir
+    """
+    Elimina o neutraliza los rastros de XLtoEXE según la base de firmas.
+
+    Cada parte candidata se recorre una sola vez con un autómata Aho-Corasick
+    que contiene todas las firmas; sólo las partes con coincidencias se editan:
+    propiedades personalizadas, nombres definidos, hojas ocultas del cargador,
+    callbacks de la cinta y campos de docProps. Los módulos VBA del cargador se
+    detectan y se informan (no se reescribe el proyecto VBA).
+    """
+
+    def __init__(self, working_dir, signatures=None):
+        # Acepta la ruta o un Package ya indexado
+        self.package = Package.coerce(working_dir)
+        self.working_dir = self.package.root
+        self.matcher = build_matcher(signatures) if signatures else default_matcher()
+        self.findings = []
 
     def remove_xltoexe_traces(self):
-        # Elimina módulos, propiedades y rastros de XLtoEXE
-        # 1. Limpiar propiedades customizadas (custom.xml)
-        custom_xml = os.path.join(self.working_dir, 'docProps', 'custom.xml')
-        if os.path.exists(custom_xml):
-            with open(custom_xml, 'r', encoding='utf-8') as f:
-                xml_content = f.read()
-            xml_content = re.sub(r'XLtoEXE', 'XLT_CLEAN', xml_content)
-            with open(custom_xml, 'w', encoding='utf-8') as f:
-                f.write(xml_content)
+        """Devuelve la lista de rastros encontrados con la acción aplicada a cada uno."""
+        self.findings = []
+        for name, handler in self._candidate_parts():
+            data = self.package.read(name)
+            if handler is self._clean_vba_project:
+                handler(name, data)
+                continue
+            if not self.matcher.labels(data):
+                continue
+            text = data.decode('utf-8')
+            cleaned = handler(name, text)
+            if cleaned != text:
+                self.package.write_part(name, cleaned.encode('utf-8'))
+        for finding in self.findings:
+            logging.info("Rastro de XLtoEXE en %s (%s): %s -> %s", finding['part'], finding['category'],
+                         finding['match'], finding['action'])
+        return self.findings
+
+    def _record(self, part, category, match, action):
+        self.findings.append({'part': part, 'category': category, 'match': match, 'action': action})
+
+    def _matches(self, text, category):
+        return self.matcher.matches(text, category)
+
+    def _candidate_parts(self):
+        candidates = []
+        if _CUSTOM_PROPERTIES in self.package:
+            candidates.append((_CUSTOM_PROPERTIES, self._clean_custom_properties))
+        for name in _DOC_PROPERTIES:
+            if name in self.package:
+                candidates.append((name, self._clean_doc_properties))
+        workbook = None
+        for rel in self.package.relationships(''):
+            if rel['part'] not in self.package:
+                continue
+            if _rel_type(rel) == _OFFICE_DOCUMENT_REL:
+                workbook = rel['part']
+            elif _rel_type(rel) == _UI_EXTENSIBILITY_REL:
+                candidates.append((rel['part'], self._clean_ribbon))
+        workbook = workbook or ('xl/workbook.xml' if 'xl/workbook.xml' in self.package else None)
+        if workbook:
+            candidates.append((workbook, self._clean_workbook))
+        vba_part = self.package.vba_project()
+        if vba_part:
+            candidates.append((vba_part, self._clean_vba_project))
+        return candidates
+
+    def _clean_custom_properties(self, name, text):
+        def replace(match):
+            element = match.group(0)
+            prop_name = _attrs(element[:element.index('>')]).get('name', '')
+            if self._matches(element, 'custom_properties'):
+                self._record(name, 'custom_properties', prop_name, 'eliminada')
+                return ''
+            return element
+        return _PROPERTY.sub(replace, text)
+
+    def _clean_doc_properties(self, name, text):
+        def replace(match):
+            if not self._matches(match.group(3), 'app_properties'):
+                return match.group(0)
+            self._record(name, 'app_properties', f'{match.group(1)}={match.group(3).strip()}', 'vaciado')
+            return f'<{match.group(1)}{match.group(2) or ""}></{match.group(1)}>'
+        return _TEXT_ELEMENT.sub(replace, text)
+
+    def _clean_ribbon(self, name, text):
+        def replace(match):
+            if not self._matches(match.group(3), 'ribbon_callbacks'):
+                return match.group(0)
+            self._record(name, 'ribbon_callbacks', f'{match.group(1)}={match.group(3)}', 'eliminado')
+            return ''
+        return _CALLBACK_ATTR.sub(replace, text)
+
+    def _clean_workbook(self, name, text):
+        removed_indexes = []
+        removed_rel_ids = set()
+        sheets = list(_SHEET.finditer(text))
+        for index, match in enumerate(sheets):
+            attrs = _attrs(match.group(1))
+            if not self._matches(attrs.get('name', ''), 'hidden_sheets'):
+                continue
+            if attrs.get('state') not in ('hidden', 'veryHidden'):
+                self._record(name, 'hidden_sheets', attrs.get('name'), 'detectada (visible, se conserva)')
+                continue
+            if len(removed_indexes) + 1 >= len(sheets):
+                self._record(name, 'hidden_sheets', attrs.get('name'), 'detectada (única hoja, se conserva)')
+                continue
+            removed_indexes.append(index)
+            rel_id = next((v for k, v in attrs.items() if k.endswith(':id')), None)
+            if rel_id:
+                removed_rel_ids.add(rel_id)
+            self._record(name, 'hidden_sheets', attrs.get('name'), 'eliminada')
+
+        for index in reversed(removed_indexes):
+            match = sheets[index]
+            text = text[:match.start()] + text[match.end():]
+
+        def replace_name(match):
+            attrs = _attrs(match.group(1))
+            if self._matches(attrs.get('name', ''), 'defined_names'):
+                self._record(name, 'defined_names', attrs.get('name'), 'eliminado')
+                return ''
+            local = attrs.get('localSheetId')
+            if local is None or not removed_indexes:
+                return match.group(0)
+            local = int(local)
+            if local in removed_indexes:
+                return ''
+            shift = sum(1 for i in removed_indexes if i < local)
+            return match.group(0).replace(f'localSheetId="{local}"', f'localSheetId="{local - shift}"', 1)
+        text = _DEFINED_NAME.sub(replace_name, text)
+
+        if removed_indexes:
+            remaining = [match for index, match in enumerate(sheets) if index not in removed_indexes]
+            text = _WORKBOOK_VIEW.sub(lambda m: self._clamp_view(m.group(0), removed_indexes, len(remaining)), text)
+            view = _WORKBOOK_VIEW.search(text)
+            active = _ACTIVE_TAB.search(view.group(0)) if view else None
+            self._select_tab(name, remaining[int(active.group(1)) if active else 0])
+            self._drop_relationships(name, removed_rel_ids)
+        return text
+
+    @staticmethod
+    def _clamp_view(element, removed_indexes, sheet_count):
+        # Como localSheetId: se descuentan las hojas eliminadas por delante y se acota
+        def shift(attr, match):
+            value = int(match.group(1))
+            value -= sum(1 for i in removed_indexes if i < value)
+            return f'{attr}="{min(value, sheet_count - 1)}"'
+        for attr in ('activeTab', 'firstSheet'):
+            element = re.sub(rf'\b{attr}="(\d+)"', lambda m: shift(attr, m), element)
+        return element
+
+    def _select_tab(self, workbook, sheet):
+        """Marca con tabSelected la hoja que queda activa (la seleccionada pudo eliminarse)."""
+        rel_id = next((v for k, v in _attrs(sheet.group(1)).items() if k.endswith(':id')), None)
+        part = next((rel['part'] for rel in self.package.relationships(workbook) if rel['id'] == rel_id), None)
+        if not part or part not in self.package:
+            return
+        data = self.package.read(part).decode('utf-8')
+        view = _SHEET_VIEW.search(data)
+        if view is None:
+            return
+        element = view.group(0)
+        selected = _TAB_SELECTED.search(element)
+        if selected and selected.group(2) in ('1', 'true'):
+            return
+        if selected:
+            element = element[:selected.start()] + 'tabSelected="1"' + element[selected.end():]
+        else:
+            tag_end = re.match(r'<[\w:]+', element).end()
+            element = element[:tag_end] + ' tabSelected="1"' + element[tag_end:]
+        self.package.write_part(part, (data[:view.start()] + element + data[view.end():]).encode('utf-8'))
+
+    def _drop_relationships(self, source, rel_ids):
+        # La cadena de cálculo referencia las hojas eliminadas: Excel la regenera
+        rel_ids = set(rel_ids)
+        rel_ids.update(rel['id'] for rel in self.package.relationships(source) if _rel_type(rel) == _CALC_CHAIN_REL)
+        rels_part = Package.rels_name(source)
+        if not rel_ids or rels_part not in self.package:
+            return
+        data = self.package.read(rels_part).decode('utf-8')
+        cleaned = _RELATIONSHIP.sub(lambda m: '' if m.group(2) in rel_ids else m.group(0), data)
+        if cleaned != data:
+            self.package.write_part(rels_part, cleaned.encode('utf-8'))
+
+    def _clean_vba_project(self, name, data):
+        # Sólo se leen las líneas del stream PROJECT (texto plano dentro del OLE)
+        for kind, module in _VBA_PROJECT_LINE.findall(data):
+            module_name = module.split(b'/')[0].decode('latin-1').strip()
+            if self._matches(module_name, 'vba_modules'):
+                self._record(name, 'vba_modules', f'{kind.decode()}={module_name}', 'detectado')
@@ -1,49 +1,70 @@
-import re
+import hashlib
+
+from deobfuscator.identifier_scorer import IdentifierScorer, identifiers, rename_identifiers
 
 class AdvancedVBADeobfuscator:
     """
     Desofusca nombres de variables, funciones y módulos ofuscados (ej: kqclqcmqcnqcoqcpqcqqcrqcsqctqc) y los reemplaza por nombres legibles en español.
-    Omite nombres ya entendibles y evita la letra Ñ.
+    Omite nombres ya entendibles y evita la letra Ñ. La decisión la toma
+    ``IdentifierScorer`` para todos los nombres del módulo a la vez; ``thresholds``
+    ajusta sus umbrales.
     """
-    def __init__(self, macros):
+    def __init__(self, macros, thresholds=None):
         self.macros = macros
         self.renaming_map = {}
         self.used_names = set()
+        self.scorer = IdentifierScorer(thresholds)
 
     def is_obfuscated(self, name):
-        # Considera ofuscado si es una cadena larga, sin vocales, y no es palabra reconocible
-        return (len(name) > 8 and not re.search(r'[aeiouáéíóú]', name, re.IGNORECASE) and name.islower())
+        return bool(self.scorer.classify([name])[0])
 
-    def next_var_name(self, prefix):
+    def next_var_name(self, prefix, in_use=()):
         idx = 1
         while True:
             name = f"{prefix}{idx}"
-            if name not in self.used_names:
+            if name not in self.used_names and name not in in_use:
                 self.used_names.add(name)
                 return name
             idx += 1
 
     def deobfuscate(self):
-        deobfuscated_macros = []
-        for macro in self.macros:
-            code = macro['code']
-            code, renaming_map = self._rename_obfuscated_names(code)
-            deobfuscated_macros.append({'filename': macro['filename'], 'code': code})
-        return deobfuscated_macros
-
-    def _rename_obfuscated_names(self, code):
-        # Encuentra nombres tipo kqclqcmqcnqcoqcpqcqqcrqcsqctqc
-        pattern = re.compile(r'\b([a-z]{8,})\b', re.IGNORECASE)
-        found = set(pattern.findall(code))
+        return [self.deobfuscate_module(macro) for macro in self.macros]
+
+    def deobfuscate_module(self, macro, shared_map=None, obfuscated=None):
+        code, renaming_map = self._rename_obfuscated_names(macro['code'], shared_map, obfuscated)
+        return {'filename': macro['filename'], 'code': code}
+
+    def obfuscated_names(self, names):
+        return set(self.scorer.obfuscated([name for name in names if 'ñ' not in name.lower()]))
+
+    @staticmethod
+    def _prefix(name):
+        lowered = name.lower()
+        if lowered.startswith('mod'):  # módulo
+            return 'modulo'
+        if lowered.startswith('sub') or lowered.startswith('fun'):
+            return 'funcion'
+        return 'variable'
+
+    @classmethod
+    def shared_name(cls, name):
+        # Depende sólo del nombre original: estable aunque cambien otros módulos
+        return f"{cls._prefix(name)}_{hashlib.sha1(name.lower().encode('utf-8')).hexdigest()[:6]}"
+
+    def _rename_obfuscated_names(self, code, shared_map=None, obfuscated=None):
+        # Puntúa todos los identificadores del código de una vez
+        shared_map = shared_map or {}
+        found = identifiers(code)
+        if obfuscated is None:
+            obfuscated = self.obfuscated_names(found)
         renaming_map = {}
+        # Los nombres generados no pueden coincidir con otro identificador del módulo
+        in_use = {name.lower() for name in found}
         for name in found:
-            if self.is_obfuscated(name) and 'ñ' not in name:
-                if name.startswith('mod'):  # módulo
-                    new_name = self.next_var_name('modulo')
-                elif name.startswith('sub') or name.startswith('fun'):
-                    new_name = self.next_var_name('funcion')
-                else:
-                    new_name = self.next_var_name('variable')
-                renaming_map[name] = new_name
-                code = re.sub(rf'\b{name}\b', new_name, code)
-        return code, renaming_map
+            lowered = name.lower()
+            if lowered in shared_map:
+                renaming_map[lowered] = shared_map[lowered]
+            elif name in obfuscated:
+                renaming_map[lowered] = self.next_var_name(self._prefix(name), in_use)
+        self.renaming_map.update(renaming_map)
+        return rename_identifiers(code, renaming_map), renaming_map
@@ -0,0 +1,284 @@
+"""
+Puntuación de ofuscación de identificadores y literales con NumPy.
+
+Todas las cadenas se puntúan a la vez: se concatenan en un único buffer de
+puntos de código y las características se calculan con operaciones vectorizadas
+(``reduceat``/``bincount``), sin bucles de Python por nombre:
+
+- verosimilitud media de bigramas de caracteres frente a un modelo entrenado
+  con vocabulario VBA, inglés y español (``identifier_model.json``),
+- entropía de Shannon (bits por carácter),
+- longitud, cambios de caja y proporción de vocales, dígitos y caracteres
+  confundibles (lI1O0).
+
+Se trabaja con caracteres (puntos de código), no con bytes UTF-8, y las
+letras acentuadas cuentan como su letra base: ``Año`` se puntúa como ``Ano``.
+
+NumPy se importa al usarse, no al importar el módulo.
+"""
+import json
+import os
+import re
+import unicodedata
+
+MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'identifier_model.json')
+# Cambia cuando cambia la puntuación: forma parte de la clave de las cachés de desofuscación
+SCORER_VERSION = 3
+
+DEFAULT_THRESHOLDS = {
+    # Nombres más cortos nunca se consideran ofuscados (i, j, ws, rng...)
+    'min_length': 4,
+    # Log-probabilidad media por transición por debajo de la cual el nombre es improbable
+    'bigram': -3.3,
+    # Transiciones raras (log-probabilidad bajo 'rare_bigram') y su proporción típica
+    'rare_bigram': -4.5,
+    'rare_ratio': 0.15,
+    # Cambios minúscula -> mayúscula por carácter a partir de los cuales el camelCase es aleatorio
+    'case_ratio': 0.2,
+    # Entropía (bits/carácter) y proporción de dígitos típicas de cadenas aleatorias
+    'entropy': 3.3,
+    'digit_ratio': 0.25,
+    # Nombres hechos casi sólo de l, I, 1, O, 0 (IlIllI, O0O0O0)
+    'confusable_ratio': 0.85,
+    # Umbral final sobre la puntuación combinada (0-1)
+    'score': 0.5,
+    # Literales: sólo se evalúan a partir de esta longitud
+    'literal_min_length': 16,
+    'literal_entropy': 4.2,
+}
+
+# Símbolos del modelo: 0 = límite (inicio, fin, '_', otros), 1-26 letras, 27 dígito, 28 no ASCII
+_SYMBOLS = 29
+_SMOOTHING = 0.5
+_NON_ASCII = 28
+_COMBINING_MARK = re.compile(r'[\u0300-\u036f]')
+# Notación húngara: prefijo de tipo en minúsculas seguido del nombre en mayúscula (sUrl, lpszPath)
+_HUNGARIAN = re.compile(r'([a-z]{1,4})([A-Z]\w*)$')
+# Prefijos de Win32 y de ámbito que no están en el vocabulario; las letras sueltas se aceptan todas
+_HUNGARIAN_PREFIXES = frozenset(('lp', 'lpsz', 'sz', 'dw', 'ul', 'pv', 'cb', 'fn', 'gs', 'ms', 'dt', 'vb'))
+
+_model_cache = {}
+
+
+def _symbol_table(np):
+    table = np.zeros(128, dtype=np.intp)
+    for index, letter in enumerate(b'abcdefghijklmnopqrstuvwxyz', start=1):
+        table[letter] = index
+        table[letter - 32] = index
+    table[ord('0'):ord('9') + 1] = 27
+    return table
+
+
+def fold_accents(text):
+    """Quita tildes y diéresis (ñ -> n, á -> a); el resto de caracteres no cambia."""
+    if text.isascii():
+        return text
+    return unicodedata.normalize('NFC', _COMBINING_MARK.sub('', unicodedata.normalize('NFD', text)))
+
+
+def _code_points(np, text):
+    """Puntos de código de ``text`` sin tildes, uno por carácter."""
+    return np.frombuffer(fold_accents(text).encode('utf-32-le', 'surrogatepass'), dtype=np.uint32)
+
+
+def _symbols(np, table, chars):
+    return np.where(chars < 128, table[np.minimum(chars, 127)], _NON_ASCII)
+
+
+def load_vocabulary(path=None):
+    with open(path or MODEL_PATH, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    return {key: value for key, value in data.items() if isinstance(value, list)}
+
+
+def build_bigram_model(words):
+    """Matriz de log-probabilidades (29x29) de transición entre símbolos."""
+    import numpy as np
+    table = _symbol_table(np)
+    counts = np.zeros((_SYMBOLS, _SYMBOLS), dtype=np.float64)
+    for word in words:
+        codes = np.concatenate(([0], _symbols(np, table, _code_points(np, word)), [0]))
+        np.add.at(counts, (codes[:-1], codes[1:]), 1)
+    counts += _SMOOTHING
+    return np.log(counts / counts.sum(axis=1, keepdims=True))
+
+
+def default_model(path=None):
+    """
+    (modelo de bigramas, nombres conocidos, prefijos húngaros), en minúsculas y
+    calculado una vez por vocabulario.
+    """
+    path = path or MODEL_PATH
+    if path not in _model_cache:
+        vocabulary = load_vocabulary(path)
+        words = [word for values in vocabulary.values() for word in values]
+        known = frozenset(word.lower() for word in vocabulary.get('vba', ()))
+        prefixes = frozenset(word.lower() for word in vocabulary.get('prefixes', ())) | _HUNGARIAN_PREFIXES
+        _model_cache[path] = (build_bigram_model(words), known, prefixes)
+    return _model_cache[path]
+
+
+class IdentifierScorer:
+    def __init__(self, thresholds=None, model_path=None):
+        self.thresholds = dict(DEFAULT_THRESHOLDS)
+        self.thresholds.update(thresholds or {})
+        self.bigrams, self.known, self.prefixes = default_model(model_path)
+
+    def features(self, names):
+        """Dict de arrays (uno por característica) alineados con ``names``."""
+        import numpy as np
+        table = _symbol_table(np)
+        count = len(names)
+        blob = _code_points(np, '\0'.join(names))
+        separators = np.flatnonzero(blob == 0)
+        bounds = np.concatenate(([-1], separators, [blob.size]))
+        lengths = np.diff(bounds) - 1
+
+        # Bigramas: una transición más que caracteres por nombre (incluye inicio y fin).
+        # En camelCase la mayúscula empieza palabra: se evalúa como inicio de palabra
+        codes = np.concatenate(([0], _symbols(np, table, blob), [0]))
+        previous = codes[:-1].copy()
+        lower = (blob >= ord('a')) & (blob <= ord('z'))
+        upper = (blob >= ord('A')) & (blob <= ord('Z'))
+        camel = np.zeros(previous.size, dtype=bool)
+        camel[1:-1] = lower[:-1] & upper[1:]
+        previous[camel] = 0
+        log_probs = self.bigrams[previous, codes[1:]]
+        starts = bounds[:-1] + 1
+        bigram = np.add.reduceat(log_probs, starts) / (lengths + 1)
+        rare = np.add.reduceat(log_probs < self.thresholds['rare_bigram'], starts) / (lengths + 1)
+        case_changes = np.add.reduceat(camel, starts) / np.maximum(lengths, 1)
+
+        # Proporciones por clase de carácter: una suma por tramos sobre el buffer
+        def ratio(symbols):
+            mask = np.zeros(128, dtype=np.int32)
+            mask[np.frombuffer(symbols, dtype=np.uint8)] = 1
+            return np.add.reduceat(np.append(mask[np.minimum(blob, 127)], 0), starts) / safe_lengths
+
+        safe_lengths = np.maximum(lengths, 1)
+        chars = blob[blob != 0]
+        owner = np.repeat(np.arange(count, dtype=np.uint64), lengths)
+        keys, key_counts = np.unique(owner * np.uint64(0x110000) + chars, return_counts=True)
+        key_owner = (keys // np.uint64(0x110000)).astype(np.intp)
+        p = key_counts / safe_lengths[key_owner]
+        entropy = np.bincount(key_owner, weights=-p * np.log2(p), minlength=count)
+
+        return {
+            'length': lengths,
+            'bigram': bigram,
+            'rare_ratio': rare,
+            'case_ratio': case_changes,
+            'entropy': entropy,
+            'vowel_ratio': ratio(b'aeiouAEIOU'),
+            'digit_ratio': ratio(b'0123456789'),
+            'confusable_ratio': ratio(b'lI1O0'),
+        }
+
+    def score(self, names):
+        """Puntuación de ofuscación en [0, 1] para cada nombre."""
+        import numpy as np
+        if not len(names):
+            return np.zeros(0)
+        t = self.thresholds
+        f = self.features(names)
+        # Cada término vale 0 en su umbral; la suma pasa por una logística
+        z = (3.0 * (t['bigram'] - f['bigram'])
+             + 8.0 * (f['rare_ratio'] - t['rare_ratio'])
+             + 1.5 * (f['entropy'] - t['entropy']) * (f['digit_ratio'] >= t['digit_ratio'])
+             + 6.0 * (f['confusable_ratio'] >= t['confusable_ratio'])
+             + 20.0 * np.maximum(f['case_ratio'] - t['case_ratio'], 0))
+        scores = 1.0 / (1.0 + np.exp(-z))
+        scores[f['length'] < t['min_length']] = 0.0
+        lowered = list(map(str.lower, names))
+        known = self.known.intersection(lowered)
+        if known:
+            scores[np.fromiter(map(known.__contains__, lowered), dtype=bool, count=len(names))] = 0.0
+        # sUrl, lngFila: cuenta el resto del nombre sin el prefijo de tipo; un resto
+        # aleatorio (sQzxkw) sigue puntuando alto; uno corto (sKey) o abreviatura (oHttp) no
+        stems = self._hungarian_stems(names)
+        if stems:
+            indexes, rest = zip(*stems)
+            indexes = list(indexes)
+            stem_scores = self.score(list(rest))
+            stem_scores[[stem.lower() in self.prefixes for stem in rest]] = 0.0
+            scores[indexes] = np.minimum(scores[indexes], stem_scores)
+        return scores
+
+    def _hungarian_stems(self, names):
+        stems = []
+        for index, name in enumerate(names):
+            match = _HUNGARIAN.match(name)
+            if match and (len(match.group(1)) == 1 or match.group(1) in self.prefixes):
+                stems.append((index, match.group(2)))
+        return stems
+
+    def classify(self, names):
+        """Array booleano: True si el nombre se considera ofuscado."""
+        return self.score(names) >= self.thresholds['score']
+
+    def obfuscated(self, names):
+        """Subconjunto de ``names`` clasificado como ofuscado, en el mismo orden."""
+        names = list(names)
+        return [name for name, flag in zip(names, self.classify(names)) if flag]
+
+    def suspicious_literals(self, literals):
+        """Literales largos de entropía alta (codificados, cifrados o en base64)."""
+        import numpy as np
+        literals = list(literals)
+        if not literals:
+            return []
+        f = self.features(literals)
+        mask = ((f['length'] >= self.thresholds['literal_min_length'])
+                & (f['entropy'] >= self.thresholds['literal_entropy']))
+        return [literals[i] for i in np.flatnonzero(mask)]
+
+
+# Identificadores fuera de literales y comentarios: los literales y comentarios
+# se reconocen en la misma pasada para no tocar su contenido al renombrar
+_TOKEN = re.compile(r'''("(?:[^"\n]|"")*"?)|('[^\n]*|\bRem\b[^\n]*)|\b([A-Za-z_][A-Za-z0-9_]*)\b''', re.IGNORECASE)
+
+
+def identifiers(code):
+    """Identificadores distintos del código (sin distinguir mayúsculas, primera grafía)."""
+    found = {}
+    for match in _TOKEN.finditer(code):
+        name = match.group(3)
+        if name:
+            found.setdefault(name.lower(), name)
+    return list(found.values())
+
+
+def string_literals(code):
+    """Contenido de los literales de cadena del código."""
+    return [match.group(1)[1:-1].replace('""', '"') for match in _TOKEN.finditer(code) if match.group(1)]
+
+
+def identifiers_and_tokens(code):
+    """
+    ``identifiers(code)`` y, en la misma pasada, los tokens normalizados para
+    comparar módulos: identificadores y palabras clave en minúsculas y cada
+    literal como un único marcador (los comentarios no cuentan).
+    """
+    found = {}
+    tokens = []
+    for literal, _comment, name in _TOKEN.findall(code):
+        if name:
+            lowered = name.lower()
+            found.setdefault(lowered, name)
+            tokens.append(lowered)
+        elif literal:
+            tokens.append('"')
+    return list(found.values()), tokens
+
+
+def rename_identifiers(code, renaming_map):
+    """Aplica ``renaming_map`` (claves en minúsculas) en una sola pasada, sin tocar literales ni comentarios."""
+    if not renaming_map:
+        return code
+
+    def replace(match):
+        name = match.group(3)
+        if name is None:
+            return match.group(0)
+        return renaming_map.get(name.lower(), name)
+    return _TOKEN.sub(replace, code)
@@ -0,0 +1,143 @@
+"""
+Desofuscación incremental por módulo con caché en disco.
+
+Cada módulo se identifica por el hash de su código descomprimido y de la
+configuración de las pasadas (clase, umbrales, vocabulario, optimizador). Se
+guarda su forma tokenizada (identificadores, símbolos públicos, nombres
+ofuscados) y la última salida junto con el hash de sus dependencias: los
+nombres que reciben, en todo el proyecto, los símbolos públicos que usa.
+
+Al repetir el análisis sólo se vuelven a ejecutar las pasadas de los módulos
+cuyo código cambió o cuyos símbolos dependientes cambiaron de nombre.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+
+from deobfuscator.identifier_scorer import MODEL_PATH, SCORER_VERSION, identifiers
+
+CACHE_VERSION = 1
+
+# Símbolos visibles desde otros módulos: Sub/Function/Property/Const/Enum/Type
+# no privados y variables Public/Global a nivel de módulo
+_PUBLIC_MEMBER = re.compile(
+    r'^[ \t]*(?:(?:Public|Global|Friend)[ \t]+)?(?:Static[ \t]+)?'
+    r'(?:Sub|Function|Property[ \t]+(?:Get|Let|Set)|Const|Enum|Type)[ \t]+([A-Za-z_]\w*)',
+    re.IGNORECASE | re.MULTILINE)
+_PUBLIC_VARIABLE = re.compile(
+    r'^[ \t]*(?:Public|Global)[ \t]+(?!(?:Sub|Function|Property|Const|Enum|Type|Declare|Static)\b)([A-Za-z_]\w*)',
+    re.IGNORECASE | re.MULTILINE)
+
+
+def public_symbols(code):
+    found = {}
+    for pattern in (_PUBLIC_MEMBER, _PUBLIC_VARIABLE):
+        for name in pattern.findall(code):
+            found.setdefault(name.lower(), name)
+    return sorted(found.values(), key=str.lower)
+
+
+def _digest(*parts):
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part.encode('utf-8') if isinstance(part, str) else part)
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+class IncrementalDeobfuscator:
+    def __init__(self, macros, cache_dir, deobfuscator_class=None, thresholds=None, optimize=True):
+        if deobfuscator_class is None:
+            from deobfuscator.vba_deobfuscator import VBADeobfuscator
+            deobfuscator_class = VBADeobfuscator
+        self.macros = macros
+        self.cache_dir = cache_dir
+        self.deobfuscator_class = deobfuscator_class
+        self.thresholds = thresholds
+        self.optimize = optimize
+        self.stats = {'modules': len(macros), 'analysis_reused': 0, 'reused': 0, 'recomputed': 0}
+        self._deobfuscator = deobfuscator_class([], thresholds)
+        self._config_key = self._configuration_key()
+
+    def _configuration_key(self):
+        with open(MODEL_PATH, 'rb') as f:
+            model = hashlib.sha256(f.read()).hexdigest()
+        return _digest(str(CACHE_VERSION), str(SCORER_VERSION),
+                       self.deobfuscator_class.__module__, self.deobfuscator_class.__qualname__,
+                       json.dumps(self._deobfuscator.scorer.thresholds, sort_keys=True), model,
+                       'optimize' if self.optimize else 'plain')
+
+    def deobfuscate(self):
+        """Devuelve la misma lista que ``deobfuscate()`` de la clase configurada."""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        entries = [self._analysis(macro) for macro in self.macros]
+        shared_map = self._shared_map(entries)
+        results = []
+        for macro, entry in zip(self.macros, entries):
+            dependencies = sorted((name, shared_map[name]) for name in entry['identifiers'] if name in shared_map)
+            dependency_key = _digest(json.dumps(dependencies))
+            if entry.get('dependency_key') == dependency_key and entry.get('output') is not None:
+                self.stats['reused'] += 1
+                results.append({'filename': macro['filename'], 'code': entry['output']})
+                continue
+            self.stats['recomputed'] += 1
+            result = self.deobfuscator_class([], self.thresholds).deobfuscate_module(
+                macro, shared_map, set(entry['obfuscated']))
+            if self.optimize:
+                from deobfuscator.vba_optimizer import VBAOptimizer
+                result = VBAOptimizer([result]).optimize()[0]
+            entry['dependency_key'] = dependency_key
+            entry['output'] = result['code']
+            self._store(entry)
+            results.append(result)
+        logging.info("Desofuscación incremental: %d módulo(s), %d reutilizado(s), %d reprocesado(s)",
+                     self.stats['modules'], self.stats['reused'], self.stats['recomputed'])
+        return results
+
+    def _analysis(self, macro):
+        """Forma tokenizada del módulo, de la caché o calculada."""
+        key = _digest(self._config_key, macro['code'])
+        entry = self._load(key)
+        if entry is not None:
+            self.stats['analysis_reused'] += 1
+            return entry
+        found = identifiers(macro['code'])
+        return {
+            'key': key,
+            'identifiers': sorted({name.lower() for name in found}),
+            'public': public_symbols(macro['code']),
+            'obfuscated': sorted(self._deobfuscator.obfuscated_names(found)),
+            'dependency_key': None,
+            'output': None,
+        }
+
+    def _shared_map(self, entries):
+        # Los símbolos públicos ofuscados reciben el mismo nombre en todos los módulos
+        shared_map = {}
+        for entry in entries:
+            obfuscated = {name.lower() for name in entry['obfuscated']}
+            for name in entry['public']:
+                if name.lower() in obfuscated:
+                    shared_map.setdefault(name.lower(), self.deobfuscator_class.shared_name(name))
+        return shared_map
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.json')
+
+    def _load(self, key):
+        try:
+            with open(self._path(key), 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return entry if entry.get('key') == key else None
+
+    def _store(self, entry):
+        path = self._path(entry['key'])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
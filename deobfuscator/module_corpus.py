@@ -0,0 +1,298 @@
+"""
+Caché de módulos desofuscados de todo el corpus, con detección de casi duplicados.
+
+Los libros protegidos con XLtoEXE repiten los mismos módulos cargadores y los
+mismos módulos de negocio con pequeños cambios. Cada módulo procesado se
+guarda con su salida desofuscada y su mapa de símbolos: qué identificadores
+(con su grafía) y qué literales consideró ofuscados o codificados el
+puntuador. Se guarda también su firma MinHash, calculada sobre los tokens
+normalizados (``identifiers_and_tokens``, en shingles de SHINGLE_SIZE tokens), e
+indexada por bandas (LSH) para encontrar módulos parecidos sin compararlo con
+todos los del corpus.
+
+Al desofuscar un módulo:
+
+- si su código ya está en la caché (mismo SHA-256 y misma configuración del
+  puntuador), se reutiliza la salida tal cual;
+- si hay un módulo con similitud estimada >= ``threshold``, se reutiliza su
+  mapa de símbolos y sólo se puntúan los nombres y literales que no tenía;
+- si no, se procesa entero.
+
+La clasificación de cada nombre y de cada literal depende sólo de él, así que
+la salida es la misma que la de VBADeobfuscator + VBAOptimizer.
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import zlib
+
+from deobfuscator.identifier_scorer import MODEL_PATH, SCORER_VERSION, identifiers_and_tokens, string_literals
+
+CORPUS_VERSION = 1
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+SHINGLE_SIZE = 5
+DEFAULT_THRESHOLD = 0.8
+# Candidatos LSH que se comparan con la firma completa (los que comparten más bandas)
+MAX_CANDIDATES = 32
+_CHUNK = 8192
+
+_MAX_HASH = (1 << 32) - 1
+# Multiplicador del hash polinómico de cada shingle (módulo 2**64)
+_SHINGLE_BASE = 0x100000001B3
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS modules (
+    id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL UNIQUE,
+    signature BLOB NOT NULL,
+    symbols TEXT NOT NULL,
+    literals TEXT NOT NULL,
+    output TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS bands (
+    bucket INTEGER NOT NULL,
+    module_id INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS bands_bucket ON bands (bucket);
+"""
+
+_permutations = None
+
+
+def _hash_permutations(np):
+    # Hash multiplicativo ((a*x + b) mod 2**64) >> 32 con ``a`` impar: sin la
+    # operación módulo, que con uint64 es lo más caro de la firma. Semilla fija:
+    # las firmas guardadas siguen valiendo entre ejecuciones
+    global _permutations
+    if _permutations is None:
+        rng = np.random.RandomState(1)
+        _permutations = (rng.randint(0, 1 << 64, NUM_PERM, dtype=np.uint64) | np.uint64(1),
+                         rng.randint(0, 1 << 64, NUM_PERM, dtype=np.uint64))
+    return _permutations
+
+
+def shingle_hashes(tokens):
+    """Hashes de 32 bits distintos de los shingles de SHINGLE_SIZE tokens consecutivos."""
+    import numpy as np
+    vocabulary = {token: index for index, token in enumerate(dict.fromkeys(tokens))}
+    ids = np.fromiter(map(vocabulary.__getitem__, tokens), dtype=np.intp, count=len(tokens))
+    token_hashes = np.array([zlib.crc32(token.encode('utf-8', 'surrogatepass')) for token in vocabulary],
+                            dtype=np.uint64)[ids]
+    width = min(SHINGLE_SIZE, len(tokens))
+    if not width:
+        return token_hashes
+    count = len(tokens) - width + 1
+    # Hash polinómico de cada ventana, calculado para todas a la vez
+    hashes = np.zeros(count, dtype=np.uint64)
+    base = np.uint64(_SHINGLE_BASE)
+    for offset in range(width):
+        hashes = hashes * base + token_hashes[offset:offset + count]
+    return np.unique((hashes ^ (hashes >> np.uint64(32))) & np.uint64(_MAX_HASH))
+
+
+def minhash(tokens):
+    """Firma MinHash (NUM_PERM valores uint32) de los shingles de ``tokens``."""
+    import numpy as np
+    a, b = _hash_permutations(np)
+    hashes = shingle_hashes(tokens)
+    signature = np.full(NUM_PERM, _MAX_HASH, dtype=np.uint64)
+    for start in range(0, hashes.size, _CHUNK):
+        values = (hashes[start:start + _CHUNK, None] * a + b) >> np.uint64(32)
+        signature = np.minimum(signature, values.min(axis=0))
+    return signature.astype(np.uint32)
+
+
+def similarity(first, second):
+    """Similitud de Jaccard estimada: proporción de valores iguales en las firmas."""
+    return float((first == second).mean())
+
+
+def _best_match(signature, signatures, threshold):
+    # Índice y similitud de la firma más parecida (matriz de una firma por fila), o None
+    import numpy as np
+    if not len(signatures):
+        return None
+    scores = (np.asarray(signatures) == signature).mean(axis=1)
+    best = int(scores.argmax())
+    return (best, float(scores[best])) if scores[best] >= threshold else None
+
+
+def _digest(*parts):
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part.encode('utf-8', 'surrogatepass') if isinstance(part, str) else part)
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+class ModuleCorpus:
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Los workers del pool comparten la caché: sólo se bloquea para escribir al final
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(_SCHEMA)
+
+    @staticmethod
+    def buckets(config_key, signature):
+        """Un cubo por banda de ROWS valores; la configuración separa corpus incompatibles."""
+        data = signature.tobytes()
+        size = ROWS * signature.itemsize
+        return [int.from_bytes(hashlib.blake2b(data[band * size:(band + 1) * size],
+                                               digest_size=8, key=config_key.encode()[:64],
+                                               salt=band.to_bytes(16, 'little')).digest(), 'little', signed=True)
+                for band in range(BANDS)]
+
+    @staticmethod
+    def _entry(row):
+        import numpy as np
+        key, signature, symbols, literals, output = row
+        return {'key': key, 'signature': np.frombuffer(signature, dtype=np.uint32), 'symbols': json.loads(symbols),
+                'literals': json.loads(literals), 'output': output}
+
+    def output(self, key):
+        """Salida guardada del módulo con esa clave, o None."""
+        row = self.conn.execute('SELECT output FROM modules WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def nearest(self, signature, buckets, threshold):
+        """(similitud, entrada) del módulo más parecido con similitud >= ``threshold``, o None."""
+        import numpy as np
+        placeholders = ','.join('?' * len(buckets))
+        rows = self.conn.execute(
+            f'SELECT m.id, m.signature FROM modules m JOIN ('
+            f'SELECT module_id, COUNT(*) AS shared FROM bands WHERE bucket IN ({placeholders}) '
+            f'GROUP BY module_id ORDER BY shared DESC LIMIT {MAX_CANDIDATES}) c ON c.module_id = m.id',
+            buckets).fetchall()
+        if not rows:
+            return None
+        # Todas las firmas candidatas se comparan a la vez
+        signatures = np.frombuffer(b''.join(blob for _, blob in rows), dtype=np.uint32).reshape(len(rows), -1)
+        best = _best_match(signature, signatures, threshold)
+        if best is None:
+            return None
+        row = self.conn.execute('SELECT key, signature, symbols, literals, output FROM modules WHERE id = ?',
+                                (rows[best[0]][0],)).fetchone()
+        return best[1], self._entry(row)
+
+    def add(self, entries):
+        """Guarda las entradas nuevas en una sola transacción."""
+        if not entries:
+            return
+        cur = self.conn.cursor()
+        cur.execute('BEGIN IMMEDIATE')
+        try:
+            for entry in entries:
+                cur.execute('INSERT OR IGNORE INTO modules (key, signature, symbols, literals, output) '
+                            'VALUES (?, ?, ?, ?, ?)',
+                            (entry['key'], entry['signature'].tobytes(),
+                             json.dumps(entry['symbols'], ensure_ascii=False),
+                             json.dumps(entry['literals'], ensure_ascii=False), entry['output']))
+                if cur.rowcount:
+                    cur.executemany('INSERT INTO bands (bucket, module_id) VALUES (?, ?)',
+                                    [(bucket, cur.lastrowid) for bucket in entry['buckets']])
+            cur.execute('COMMIT')
+        except BaseException:
+            cur.execute('ROLLBACK')
+            raise
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+class CorpusDeobfuscator:
+    """Devuelve lo mismo que ``VBAOptimizer(VBADeobfuscator(macros).deobfuscate()).optimize()``."""
+
+    def __init__(self, macros, corpus_path, thresholds=None, threshold=DEFAULT_THRESHOLD):
+        from deobfuscator.vba_deobfuscator import VBADeobfuscator
+        self.macros = macros
+        self.corpus_path = corpus_path
+        self.threshold = threshold
+        self.deobfuscator = VBADeobfuscator([], thresholds)
+        self.stats = {'modules': len(macros), 'exact': 0, 'near': 0, 'new': 0, 'scored': 0, 'reused': 0}
+        self._config_key = self._configuration_key()
+        # Cubos LSH de los módulos nuevos de este libro, que aún no están en la caché
+        self._pending_buckets = {}
+
+    def _configuration_key(self):
+        with open(MODEL_PATH, 'rb') as f:
+            model = hashlib.sha256(f.read()).hexdigest()
+        return _digest(str(CORPUS_VERSION), str(SCORER_VERSION),
+                       json.dumps(self.deobfuscator.scorer.thresholds, sort_keys=True), model)
+
+    def deobfuscate(self):
+        results = []
+        pending = {}
+        with ModuleCorpus(self.corpus_path) as corpus:
+            for macro in self.macros:
+                key = _digest(self._config_key, macro['code'])
+                output = pending[key]['output'] if key in pending else corpus.output(key)
+                if output is not None:
+                    self.stats['exact'] += 1
+                else:
+                    names, tokens = identifiers_and_tokens(macro['code'])
+                    signature = minhash(tokens)
+                    buckets = corpus.buckets(self._config_key, signature)
+                    neighbour = self._nearest(corpus, signature, buckets)
+                    entry = self._process(macro, key, names, neighbour[1] if neighbour else None)
+                    entry.update(signature=signature, buckets=buckets)
+                    pending[key] = entry
+                    for bucket in buckets:
+                        self._pending_buckets.setdefault(bucket, []).append(entry)
+                    output = entry['output']
+                results.append({'filename': macro['filename'], 'code': output})
+            corpus.add(list(pending.values()))
+        logging.info("Caché de módulos: %d módulo(s), %d exacto(s), %d casi duplicado(s), %d nuevo(s); "
+                     "%d nombre(s) y literal(es) puntuados, %d reutilizados",
+                     self.stats['modules'], self.stats['exact'], self.stats['near'], self.stats['new'],
+                     self.stats['scored'], self.stats['reused'])
+        return results
+
+    def _nearest(self, corpus, signature, buckets):
+        best = corpus.nearest(signature, buckets, self.threshold)
+        candidates = list({id(entry): entry for bucket in buckets
+                           for entry in self._pending_buckets.get(bucket, ())}.values())
+        match = _best_match(signature, [entry['signature'] for entry in candidates], self.threshold)
+        if match is not None and (best is None or match[1] > best[0]):
+            best = (match[1], candidates[match[0]])
+        return best
+
+    def _classify(self, items, known, classify):
+        flags = {}
+        unknown = [item for item in items if item not in known]
+        flagged = classify(unknown) if unknown else set()
+        for item in items:
+            flags[item] = known[item] if item in known else item in flagged
+        self.stats['scored'] += len(unknown)
+        self.stats['reused'] += len(items) - len(unknown)
+        return flags
+
+    def _process(self, macro, key, names, neighbour):
+        from deobfuscator.vba_optimizer import VBAOptimizer
+
+        code = macro['code']
+        self.stats['near' if neighbour else 'new'] += 1
+        # Los literales se buscan por líneas, igual que al añadir los comentarios; ningún
+        # literal cruza un salto de línea, así que basta una pasada sobre las líneas unidas
+        literals = list(dict.fromkeys(string_literals('\n'.join(code.splitlines()))))
+        symbols = self._classify(names, neighbour['symbols'] if neighbour else {}, self.deobfuscator.obfuscated_names)
+        encoded = self._classify(literals, neighbour['literals'] if neighbour else {},
+                                 self.deobfuscator.encoded_literals)
+        result = self.deobfuscator.deobfuscate_module(
+            macro, obfuscated={name for name, flag in symbols.items() if flag},
+            encoded={literal for literal, flag in encoded.items() if flag}, found=names)
+        result = VBAOptimizer([result]).optimize()[0]
+        return {'key': key, 'symbols': symbols, 'literals': encoded, 'output': result['code']}
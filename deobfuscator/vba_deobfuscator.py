@@ -1,37 +1,79 @@
+import hashlib
 import re
-from oletools import mraptor
+
+from deobfuscator.identifier_scorer import IdentifierScorer, identifiers, rename_identifiers, string_literals
+
+# Nombres genéricos tipo a1, b2, xy12
+_GENERIC_NAME = re.compile(r'[a-z]{1,2}\d{1,3}$', re.IGNORECASE)
 
 class VBADeobfuscator:
-    def __init__(self, macros):
+    def __init__(self, macros, thresholds=None):
         self.macros = macros
         self.renaming_map = {}
+        self.scorer = IdentifierScorer(thresholds)
 
     def deobfuscate(self):
-        deobfuscated_macros = []
-        for macro in self.macros:
-            code = macro['code']
-            code, renaming_map = self._rename_obfuscated_names(code)
-            code = self._add_comments(code)
-            deobfuscated_macros.append({'filename': macro['filename'], 'code': code})
-        return deobfuscated_macros
-
-    def _rename_obfuscated_names(self, code):
-        # Busca nombres tipo a1, b2, c3, etc. y los reemplaza por nombres más descriptivos
-        pattern = re.compile(r'\b([a-z]{1,2}\d{1,3})\b', re.IGNORECASE)
-        found = set(pattern.findall(code))
+        return [self.deobfuscate_module(macro) for macro in self.macros]
+
+    def deobfuscate_module(self, macro, shared_map=None, obfuscated=None, encoded=None, found=None):
+        """
+        Desofusca un módulo. ``shared_map`` fija el nombre de los símbolos públicos
+        compartidos entre módulos; ``obfuscated`` y ``encoded`` (literales
+        codificados) evitan volver a puntuar los nombres y los literales, y
+        ``found`` (``identifiers`` del código) volver a recorrerlo.
+        """
+        code, renaming_map = self._rename_obfuscated_names(macro['code'], shared_map, obfuscated, found)
+        code = self._add_comments(code, encoded)
+        return {'filename': macro['filename'], 'code': code}
+
+    def obfuscated_names(self, names):
+        """Nombres genéricos (a1, b2...) y los que el puntuador considera ofuscados."""
+        names = list(names)
+        return set(self.scorer.obfuscated(names)) | {name for name in names if _GENERIC_NAME.match(name)}
+
+    @staticmethod
+    def shared_name(name):
+        # Depende sólo del nombre original: estable aunque cambien otros módulos
+        return 'var_' + hashlib.sha1(name.lower().encode('utf-8')).hexdigest()[:6]
+
+    def _rename_obfuscated_names(self, code, shared_map=None, obfuscated=None, found=None):
+        # Los literales y comentarios no se tocan
+        shared_map = shared_map or {}
+        if found is None:
+            found = identifiers(code)
+        if obfuscated is None:
+            obfuscated = self.obfuscated_names(found)
         renaming_map = {}
-        for idx, name in enumerate(found):
-            new_name = f'var_{idx+1}'
-            renaming_map[name] = new_name
-            code = re.sub(rf'\b{name}\b', new_name, code)
-        return code, renaming_map
+        local_index = 0
+        # VBA no distingue mayúsculas: un var_N ya declarado en el módulo no se reutiliza
+        in_use = {name.lower() for name in found}
+        for name in found:
+            lowered = name.lower()
+            if lowered in shared_map:
+                renaming_map[lowered] = shared_map[lowered]
+            elif name in obfuscated:
+                local_index += 1
+                while f'var_{local_index}' in in_use:
+                    local_index += 1
+                renaming_map[lowered] = f'var_{local_index}'
+        self.renaming_map.update(renaming_map)
+        return rename_identifiers(code, renaming_map), renaming_map
+
+    def encoded_literals(self, literals):
+        """Literales que el puntuador considera codificados."""
+        return set(self.scorer.suspicious_literals(literals))
 
-    def _add_comments(self, code):
+    def _add_comments(self, code, encoded=None):
         # Añade comentarios en líneas sospechosas (muy cortas, llamadas a funciones, etc.)
+        lines = code.splitlines()
+        if encoded is None:
+            encoded = self.encoded_literals(lit for line in lines for lit in string_literals(line))
         commented = []
-        for line in code.splitlines():
+        for line in lines:
             if re.match(r'^\s*(On Error|GoTo|Call|Shell|CreateObject)', line, re.IGNORECASE):
                 commented.append(f"'{line} ' [Automático: línea potencialmente relevante]")
+            elif encoded and any(lit in encoded for lit in string_literals(line)):
+                commented.append(f"{line} ' [Automático: literal posiblemente codificado]")
             else:
                 commented.append(line)
         return '\n'.join(commented)
@@ -1,14 +1,14 @@
 import os
-import pefile
 import re
 import shutil
 import tempfile
 import zipfile
 
 class EXEDetector:
-    def __init__(self, exe_path):
+    def __init__(self, exe_path, limits=None):
         self.exe_path = exe_path
         self.xlsm_path = None
+        self.limits = limits
 
     def detect_and_extract(self, exe_path=None, working_dir=None):
         """Intenta localizar o extraer un XLSM a partir de un ejecutable."""
@@ -69,8 +69,8 @@ class EXEDetector:
 
     def unzip_if_needed(self, output_dir):
         if zipfile.is_zipfile(self.exe_path):
-            with zipfile.ZipFile(self.exe_path, 'r') as zip_ref:
-                zip_ref.extractall(output_dir)
+            from extractor.zip_handler import ZipHandler
+            ZipHandler.extract_zip(self.exe_path, output_dir, limits=self.limits)
             return True
         return False
 
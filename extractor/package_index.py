@@ -0,0 +1,382 @@
+"""
+Índice del paquete OOXML: se construye una sola vez por trabajo (desde el
+directorio central del ZIP o con un único recorrido del directorio extraído) y
+las etapas lo consultan en lugar de recorrer el árbol con ``os.walk``.
+"""
+import mmap
+import os
+import posixpath
+import xml.etree.ElementTree as ET
+import zipfile
+import zlib
+
+CONTENT_TYPES_PART = '[Content_Types].xml'
+VBA_PROJECT_CONTENT_TYPE = 'application/vnd.ms-office.vbaProject'
+
+_CT_NS = '{http://schemas.openxmlformats.org/package/2006/content-types}'
+_REL_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+# Archivos y carpetas que genera el propio proceso y no forman parte del paquete
+ARTIFACT_FILES = ('proceso.log', 'perfil.json', 'informe.txt', 'informe.json', 'reconstruido.xlsm',
+                  'macros_extraidas.zip', 'macros_extraidas.tar')
+ARTIFACT_DIRS = ('componentes_extraidos', '_indices', 'macros_extraidas')
+
+
+class PackagePart:
+    __slots__ = ('name', 'size', 'crc', 'stat_key')
+
+    def __init__(self, name, size, crc=None, stat_key=None):
+        self.name = name
+        self.size = size
+        self.crc = crc
+        # (tamaño, mtime_ns) del archivo cuando se calculó el CRC
+        self.stat_key = stat_key
+
+    def __repr__(self):
+        return f'PackagePart({self.name!r}, size={self.size})'
+
+
+class Package:
+    """
+    Índice de partes de un paquete .xlsm extraído en ``root``.
+
+    Las búsquedas por nombre, nombre base o extensión son O(1); los tipos de
+    contenido y las relaciones se leen la primera vez que se piden. Los bytes de
+    cada parte se mapean en memoria bajo demanda. Si el paquete sólo existe como
+    ZIP (``root`` es None) las lecturas se hacen desde el archivo comprimido.
+    """
+
+    def __init__(self, root=None, zip_path=None):
+        self.root = root
+        self.zip_path = zip_path
+        self.parts = {}
+        self._by_basename = {}
+        self._maps = {}
+        self._zip = None
+        self._content_types = None
+        self._rels = {}
+
+    # Construcción
+
+    @classmethod
+    def from_directory(cls, root):
+        package = cls(root)
+        package.refresh()
+        return package
+
+    @classmethod
+    def from_zip(cls, zip_path, root=None):
+        """Indexa el directorio central del ZIP; ``root`` es donde se extrajo, si se extrajo."""
+        package = cls(root, zip_path)
+        zf = zipfile.ZipFile(zip_path)
+        try:
+            for info in zf.infolist():
+                if info.is_dir():
+                    continue
+                stat_key = None
+                if posixpath.normpath(info.filename) != info.filename or info.filename.startswith(('/', '../')):
+                    # extractall reubica estas entradas: el recorrido del directorio no las vería así
+                    continue
+                if root:
+                    path = os.path.join(root, info.filename)
+                    if not os.path.isfile(path):
+                        continue
+                    st = os.stat(path)
+                    stat_key = (st.st_size, st.st_mtime_ns)
+                package._add(PackagePart(info.filename, info.file_size, info.CRC, stat_key))
+        except BaseException:
+            zf.close()
+            raise
+        if root:
+            zf.close()
+        else:
+            # Sin extracción, las lecturas reutilizan el directorio central ya leído
+            package._zip = zf
+        return package
+
+    @classmethod
+    def from_working_dir(cls, root, zip_path=None):
+        """
+        Reindexa un directorio de trabajo que las etapas pueden haber modificado ya
+        (p. ej. al retomar un trabajo): tamaños y CRC salen del disco y las partes
+        conservan el orden del ZIP de origen, que es el de la reconstrucción.
+        """
+        package = cls.from_directory(root)
+        if not zip_path or not zipfile.is_zipfile(zip_path):
+            return package
+        with zipfile.ZipFile(zip_path) as zf:
+            order = {info.filename: index for index, info in enumerate(zf.infolist())}
+        parts = package.parts
+        package.parts = {}
+        package._by_basename = {}
+        # Las partes que no venían en el ZIP quedan al final, en el orden del recorrido
+        for name in sorted(parts, key=lambda name: order.get(name, len(order))):
+            package._add(parts[name])
+        package.zip_path = zip_path
+        return package
+
+    @classmethod
+    def coerce(cls, source):
+        """Devuelve ``source`` si ya es un Package; si es una ruta, lo indexa."""
+        if isinstance(source, Package):
+            return source
+        if source and os.path.isfile(source) and zipfile.is_zipfile(source):
+            return cls.from_zip(source)
+        return cls.from_directory(source)
+
+    def refresh(self):
+        """Vuelve a indexar el directorio con un único recorrido."""
+        self.close()
+        self.parts = {}
+        self._by_basename = {}
+        self._content_types = None
+        self._rels = {}
+        if not self.root or not os.path.isdir(self.root):
+            return self
+        for dirpath, dirs, files in os.walk(self.root):
+            rel_dir = os.path.relpath(dirpath, self.root)
+            if rel_dir == '.':
+                rel_dir = ''
+                dirs[:] = [d for d in dirs if d not in ARTIFACT_DIRS]
+            dirs.sort()
+            for file in sorted(files):
+                if not rel_dir and file in ARTIFACT_FILES:
+                    continue
+                name = posixpath.join(rel_dir.replace(os.sep, '/'), file) if rel_dir else file
+                self._add(PackagePart(name, os.path.getsize(os.path.join(dirpath, file))))
+        return self
+
+    def _add(self, part):
+        self.parts[part.name] = part
+        self._by_basename.setdefault(posixpath.basename(part.name).lower(), []).append(part.name)
+
+    # Consultas
+
+    def __contains__(self, name):
+        return name in self.parts
+
+    def __iter__(self):
+        return iter(self.parts)
+
+    def __len__(self):
+        return len(self.parts)
+
+    def names(self, suffixes=None):
+        if not suffixes:
+            return list(self.parts)
+        suffixes = tuple(s.lower() for s in suffixes)
+        return [name for name in self.parts if name.lower().endswith(suffixes)]
+
+    def find(self, basename):
+        """Partes cuyo nombre base coincide (sin distinguir mayúsculas)."""
+        return list(self._by_basename.get(basename.lower(), ()))
+
+    def path(self, name):
+        if not self.root:
+            return None
+        return os.path.join(self.root, *name.split('/'))
+
+    def size(self, name):
+        return self.parts[name].size
+
+    def total_size(self, suffixes=None):
+        return sum(self.parts[name].size for name in self.names(suffixes))
+
+    def crc(self, name):
+        """CRC32 de la parte; se recalcula sólo si el archivo cambió en disco."""
+        part = self.parts[name]
+        if not self.root:
+            return part.crc
+        st = os.stat(self.path(name))
+        stat_key = (st.st_size, st.st_mtime_ns)
+        if part.crc is None or part.stat_key != stat_key:
+            part.crc = zlib.crc32(self.view(name)) & 0xFFFFFFFF
+            part.stat_key = stat_key
+        return part.crc
+
+    def vba_project(self):
+        """Nombre de la parte vbaProject.bin (por tipo de contenido o por nombre)."""
+        for name in self.parts:
+            if self.content_type(name) == VBA_PROJECT_CONTENT_TYPE:
+                return name
+        candidates = self.find('vbaProject.bin')
+        return candidates[0] if candidates else None
+
+    # Tipos de contenido y relaciones
+
+    def content_types(self):
+        if self._content_types is None:
+            defaults, overrides = {}, {}
+            if CONTENT_TYPES_PART in self.parts:
+                root = ET.fromstring(self.read(CONTENT_TYPES_PART))
+                for elem in root.iter(f'{_CT_NS}Default'):
+                    defaults[elem.get('Extension', '').lower()] = elem.get('ContentType')
+                for elem in root.iter(f'{_CT_NS}Override'):
+                    overrides[elem.get('PartName', '').lstrip('/')] = elem.get('ContentType')
+            self._content_types = (defaults, overrides)
+        return self._content_types
+
+    def content_type(self, name):
+        defaults, overrides = self.content_types()
+        if name in overrides:
+            return overrides[name]
+        return defaults.get(posixpath.splitext(name)[1].lstrip('.').lower())
+
+    @staticmethod
+    def rels_name(source):
+        """Parte .rels de ``source`` ('' es el propio paquete)."""
+        directory, base = posixpath.split(source)
+        return posixpath.join(directory, '_rels', f'{base}.rels')
+
+    def relationships(self, source=''):
+        """Relaciones de ``source``: dicts con id, type, target, mode y part (destino resuelto)."""
+        if source not in self._rels:
+            rels = []
+            rels_part = self.rels_name(source)
+            if rels_part in self.parts:
+                base_dir = posixpath.dirname(source)
+                for elem in ET.fromstring(self.read(rels_part)).iter(f'{_REL_NS}Relationship'):
+                    target = elem.get('Target', '')
+                    mode = elem.get('TargetMode', 'Internal')
+                    part = None
+                    if mode != 'External':
+                        if target.startswith('/'):
+                            part = posixpath.normpath(target.lstrip('/'))
+                        else:
+                            part = posixpath.normpath(posixpath.join(base_dir, target))
+                    rels.append({'id': elem.get('Id'), 'type': elem.get('Type'), 'target': target,
+                                 'mode': mode, 'part': part})
+            self._rels[source] = rels
+        return self._rels[source]
+
+    # Lectura y escritura
+
+    def view(self, name):
+        """
+        memoryview de la parte, mapeada en memoria la primera vez. Si otro proceso
+        (una etapa del pool) reemplazó el archivo, se vuelve a mapear; el tamaño
+        del índice se toma siempre del archivo que se mapea.
+        """
+        if name not in self.parts:
+            raise KeyError(f"La parte {name} no está en el paquete")
+        if not self.root:
+            return memoryview(self.read(name))
+        path = self.path(name)
+        cached = self._maps.get(name)
+        if cached is not None:
+            st = os.stat(path)
+            if cached[1] == (st.st_ino, st.st_size, st.st_mtime_ns):
+                return memoryview(cached[0])
+            self._release(name)
+            self._invalidate(name, st.st_size)
+        with open(path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            part = self.parts[name]
+            if part.size != st.st_size or part.stat_key not in (None, (st.st_size, st.st_mtime_ns)):
+                # Reemplazado antes del primer mapeo: el índice aún describe el archivo anterior
+                self._invalidate(name, st.st_size)
+            if st.st_size == 0:
+                return memoryview(b'')
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps[name] = (mapped, (st.st_ino, st.st_size, st.st_mtime_ns))
+        return memoryview(mapped)
+
+    def read(self, name):
+        if name not in self.parts:
+            raise KeyError(f"La parte {name} no está en el paquete")
+        if not self.root:
+            return self._zipfile().read(name)
+        with self.view(name) as view:
+            return bytes(view)
+
+    def read_head(self, name, size):
+        """Primeros ``size`` bytes de la parte; desde el ZIP sólo se descomprime ese tramo."""
+        if name not in self.parts:
+            raise KeyError(f"La parte {name} no está en el paquete")
+        if not self.root:
+            with self._zipfile().open(name) as f:
+                return f.read(size)
+        with open(self.path(name), 'rb') as f:
+            return f.read(size)
+
+    def readinto(self, name, buffer):
+        """Copia la parte en ``buffer`` (p. ej. memoria compartida) sin bytes intermedios."""
+        if name not in self.parts:
+            raise KeyError(f"La parte {name} no está en el paquete")
+        view = memoryview(buffer).cast('B')
+        total = 0
+        opener = self._zipfile().open(name) if not self.root else open(self.path(name), 'rb')
+        with opener as f, view:
+            while total < len(view):
+                count = f.readinto(view[total:])
+                if not count:
+                    break
+                total += count
+        return total
+
+    def _zipfile(self):
+        # Un solo ZipFile abierto por paquete: el directorio central se lee una vez
+        if self._zip is None:
+            self._zip = zipfile.ZipFile(self.zip_path)
+        return self._zip
+
+    def write_part(self, name, data):
+        """
+        Reescribe (o añade) una parte en disco y actualiza el índice.
+
+        Se escribe a un temporal y se reemplaza: los mmap abiertos y los hardlinks
+        de una exportación previa siguen viendo el contenido anterior.
+        """
+        if not self.root:
+            raise ValueError("El paquete no tiene directorio de trabajo donde escribir")
+        self._release(name)
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        if name not in self.parts:
+            self._add(PackagePart(name, len(data)))
+        self._invalidate(name, len(data))
+
+    def _invalidate(self, name, size):
+        # La parte cambió en disco: tamaño nuevo, CRC por recalcular y cachés derivadas fuera
+        part = self.parts[name]
+        part.size, part.crc, part.stat_key = size, None, None
+        if name == CONTENT_TYPES_PART:
+            self._content_types = None
+        elif '/_rels/' in f'/{name}':
+            self._rels = {}
+
+    def _release(self, name):
+        cached = self._maps.pop(name, None)
+        if cached is not None:
+            try:
+                cached[0].close()
+            except BufferError:
+                # Aún hay memoryviews vivas: se libera cuando las suelten
+                pass
+
+    def close(self):
+        for name in list(self._maps):
+            self._release(name)
+        if self._zip is not None:
+            self._zip.close()
+            self._zip = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def __getstate__(self):
+        # Los mmap, el ZIP abierto y las cachés de XML no viajan entre procesos
+        state = self.__dict__.copy()
+        state['_maps'] = {}
+        state['_zip'] = None
+        state['_content_types'] = None
+        state['_rels'] = {}
+        return state
@@ -3,13 +3,17 @@ import os
 from extractor.zip_handler import ZipHandler
 
 class XLSMUnpacker:
-    def __init__(self, input_path, output_dir):
+    def __init__(self, input_path, output_dir, limits=None, depth=0):
         self.input_path = input_path
         self.output_dir = output_dir
+        # Con un .xlsm sacado de otro ZIP (p. ej. un EXE autoextraíble), los mismos
+        # ``limits`` de esa extracción y ``depth`` = 1
+        self.limits = limits
+        self.depth = depth
 
     def unpack(self):
         if zipfile.is_zipfile(self.input_path):
-            ZipHandler.extract_zip(self.input_path, self.output_dir)
+            ZipHandler.extract_zip(self.input_path, self.output_dir, limits=self.limits, depth=self.depth)
         elif os.path.isdir(self.input_path):
             # Ya está extraído
             pass
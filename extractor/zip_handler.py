@@ -1,8 +1,8 @@
-import zipfile
-import os
+from utils.parallel_zip import extract_all
 
 class ZipHandler:
     @staticmethod
-    def extract_zip(zip_path, output_dir):
-        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-            zip_ref.extractall(output_dir)
+    def extract_zip(zip_path, output_dir, workers=None, limits=None, depth=0):
+        # Los miembros se descomprimen en paralelo (ver utils.parallel_zip), dentro
+        # de los límites de ``limits`` (utils.resource_limits)
+        return extract_all(zip_path, output_dir, workers, limits, depth)
@@ -7,15 +7,10 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 import flet as ft
 import shutil
 import tempfile
-from extractor.exe_detector import EXEDetector
-from extractor.xlsm_unpacker import XLSMUnpacker
-from cleaner.protection_remover import ProtectionRemover
-from cleaner.xlt_exe_cleaner import XLtoEXECleaner
-from analyzer.vba_extractor import VBAExtractor
-from deobfuscator.advanced_vba_deobfuscator import AdvancedVBADeobfuscator
-from builder.xlsm_rebuilder import XLSMRebuilder
-from builder.macro_injector import MacroInjector
-from report.report_generator import ReportGenerator
+# Las etapas del pipeline se importan en cada acción para que la ventana abra
+# sin cargar oletools, xlwings ni el resto de dependencias pesadas.
+from utils.helpers import file_size
+from utils.profiler import StageProfiler
 
 # Carpeta de salida fija en el escritorio
 DESKTOP = os.path.join(os.path.expanduser('~'), 'Desktop')
@@ -462,12 +457,18 @@ class AppGUI:
         self.selected_file = None
         self.stage = 0
         self.working_dir = None
+        self.package = None
         self.xlsm_path = None
         self.macros = []
         self.export_dir = os.path.join(OUTPUT_DIR, "macros_extraidas")
+        self.deobfuscation_cache_dir = os.path.join(OUTPUT_DIR, "cache_desofuscacion")
+        self.deobfuscated_dir = os.path.join(OUTPUT_DIR, "macros_desofuscadas")
+        self.deobfuscated_macros = []
         self.last_output_file = None
         self.last_reinsercion_file = None
         self.last_base_name = None
+        self.profile_enabled = False
+        self.profiler = StageProfiler()
         
         # Componentes UI
         self.progress_bar = None
@@ -653,6 +654,18 @@ class AppGUI:
                             alignment=ft.MainAxisAlignment.CENTER,
                             spacing=12,
                         ),
+                        ft.Row(
+                            [
+                                ft.Switch(
+                                    label="Perfilado de etapas",
+                                    value=self.profile_enabled,
+                                    active_color=FuturisticColors.NEON_CYAN,
+                                    on_change=self.toggle_profiling,
+                                    tooltip="Mide tiempos, bytes y memoria por etapa (perfil JSON en DESOFUSCADOS)",
+                                )
+                            ],
+                            alignment=ft.MainAxisAlignment.CENTER,
+                        ),
                         # Barra de progreso para acciones
                         self.action_progress.get_control()
                     ],
@@ -821,6 +834,9 @@ class AppGUI:
                 pass
 
     def clean_temp_dir(self):
+        if self.package:
+            self.package.close()
+            self.package = None
         if self.working_dir and os.path.exists(self.working_dir):
             shutil.rmtree(self.working_dir, ignore_errors=True)
         self.working_dir = None
@@ -881,6 +897,7 @@ class AppGUI:
         self.selected_file = None
         self.stage = 0
         self.working_dir = None
+        self.package = None
         self.xlsm_path = None
         
         # Limpiar la interfaz
@@ -916,6 +933,20 @@ class AppGUI:
         dlg.open = True
         self.page.update()
 
+    def toggle_profiling(self, e):
+        self.profile_enabled = bool(e.control.value)
+        estado = "activado" if self.profile_enabled else "desactivado"
+        self.log_box.add_log(f"⏱️ Perfilado de etapas {estado}")
+
+    def save_profile(self, base_name, timestamp):
+        if not self.profiler.enabled or not self.profiler.records:
+            return None
+        profile_file = os.path.join(OUTPUT_DIR, f"{base_name}_perfil_{timestamp}.json")
+        self.profiler.write_json(profile_file)
+        for line in self.profiler.format_table().splitlines():
+            self.log_box.add_log(f"⏱️ {line}")
+        return profile_file
+
     def analyze_file_auto(self, e):
         if not self.selected_file:
             self.log_box.add_log("⚠️ Seleccione un archivo primero.")
@@ -924,22 +955,36 @@ class AppGUI:
         if not self.validate_file(self.selected_file):
             self.show_snackbar(self.page, "Archivo no válido o extensión no soportada", FuturisticColors.ERROR)
             return
+        from extractor.exe_detector import EXEDetector
+        from extractor.xlsm_unpacker import XLSMUnpacker
+        from extractor.package_index import Package
+        from utils.resource_limits import DEFAULT_LIMITS
+        from cleaner.protection_remover import ProtectionRemover
+        from cleaner.xlt_exe_cleaner import XLtoEXECleaner
+        from analyzer.vba_extractor import VBAExtractor
         try:
             self.progress_bar.set_progress(0.15, True)
             self.log_box.add_log(f"🔍 Analizando automáticamente: {os.path.basename(self.selected_file)}")
             self.clean_temp_dir()
             self.working_dir = tempfile.mkdtemp(prefix="xltoexe_")
+            self.profiler = StageProfiler(self.profile_enabled)
             self.log_box.add_log(f"📂 Directorio de trabajo temporal: {self.working_dir}")
 
             ext = os.path.splitext(self.selected_file)[-1].lower()
+            # Un solo presupuesto de extracción para el EXE y el .xlsm que contiene
+            limits = DEFAULT_LIMITS.for_file()
+            depth = 0
             if ext == '.exe':
                 self.progress_bar.set_progress(0.25)
                 self.log_box.add_log("🤖 Archivo EXE detectado. Extrayendo .xlsm...")
-                self.detector = EXEDetector(self.selected_file)
-                detector_result = self.detector.detect_and_extract(self.selected_file, self.working_dir)
+                self.detector = EXEDetector(self.selected_file, limits)
+                with self.profiler.stage('exe_detect', lambda: file_size(self.selected_file)):
+                    detector_result = self.detector.detect_and_extract(self.selected_file, self.working_dir)
                 self.xlsm_path = detector_result.get('xlsm_path')
                 if not self.xlsm_path:
                     raise ValueError("No se pudo extraer el XLSM del EXE.")
+                # El .xlsm sacado del ZIP del EXE es un ZIP anidado
+                depth = 1 if detector_result.get('extracted') else 0
                 self.log_box.add_log("✅ Archivo .xlsm extraído exitosamente")
             elif ext in ['.xlsm', '.zip', '.xlsx', '.xls']:
                 self.progress_bar.set_progress(0.25)
@@ -951,25 +996,35 @@ class AppGUI:
             # Extraer y preparar el contenido del archivo
             self.progress_bar.set_progress(0.4)
             self.log_box.add_log("📦 Extrayendo contenido del archivo...")
-            XLSMUnpacker(self.xlsm_path, self.working_dir).unpack()
+            with self.profiler.stage('extract', lambda: file_size(self.xlsm_path)):
+                XLSMUnpacker(self.xlsm_path, self.working_dir, limits, depth).unpack()
+                # Índice del paquete: las etapas siguientes no vuelven a recorrer el directorio
+                self.package = Package.from_directory(self.working_dir)
 
             self.progress_bar.set_progress(0.55)
             self.log_box.add_log("🛡️ Eliminando protecciones de workbook y hojas...")
-            ProtectionRemover(self.working_dir).remove_sheet_and_workbook_protection()
+            with self.profiler.stage('protection.sheets_workbook', lambda: self.package.total_size(('.xml',))):
+                ProtectionRemover(self.package).remove_sheet_and_workbook_protection()
 
             self.progress_bar.set_progress(0.65)
             self.log_box.add_log("🔐 Eliminando protección del proyecto VBA...")
-            ProtectionRemover(self.working_dir).remove_vba_project_password()
+            with self.profiler.stage('protection.vba_password', lambda: self.package.total_size(('vbaproject.bin',))):
+                ProtectionRemover(self.package).remove_vba_project_password()
 
             self.progress_bar.set_progress(0.75)
             self.log_box.add_log("🧬 Limpiando rastros de XLtoEXE...")
-            XLtoEXECleaner(self.working_dir).remove_xltoexe_traces()
+            with self.profiler.stage('xltoexe_cleaner'):
+                traces = XLtoEXECleaner(self.package).remove_xltoexe_traces()
+            for trace in traces:
+                self.log_box.add_log(f"   • {trace['part']}: {trace['match']} ({trace['action']})")
 
             self.progress_bar.set_progress(0.85)
             self.log_box.add_log("🔑 Extrayendo macros VBA...")
-            self.vba_extractor = VBAExtractor(self.working_dir)
+            self.vba_extractor = VBAExtractor(self.package)
+            self.deobfuscated_macros = []
             try:
-                self.macros = self.vba_extractor.extract_macros(export_dir=self.export_dir)
+                with self.profiler.stage('vba_extract', lambda: self.package.total_size(('vbaproject.bin',))):
+                    self.macros = self.vba_extractor.extract_macros(export_dir=self.export_dir)
             except Exception as macro_ex:
                 self.log_box.add_log(f"⚠️ No se pudieron extraer macros: {macro_ex}")
                 self.macros = []
@@ -1141,16 +1196,30 @@ class AppGUI:
             self.action_progress.set_progress(0.2, True, "Analizando macros VBA...")
             self.page.update()
             
-            # Simulación de análisis de macros
-            time.sleep(0.5)
             self.action_progress.set_progress(0.4, True, "Aplicando algoritmos de desofuscación...")
             self.log_box.add_log(" Aplicando algoritmos avanzados de desofuscación...")
             self.page.update()
-            
-            # Simulación de limpieza de código
-            time.sleep(0.5)
+
+            # Sólo se reprocesan los módulos cambiados (o cuyos símbolos públicos cambiaron)
+            from deobfuscator.incremental import IncrementalDeobfuscator
+            deobfuscator = IncrementalDeobfuscator(self.macros, self.deobfuscation_cache_dir)
+            with self.profiler.stage('deobfuscate', lambda: sum(len(m['code']) for m in self.macros)):
+                results = deobfuscator.deobfuscate()
+            # Mismo orden que self.macros: se conservan nombre y tipo y se cambia el código.
+            # export_path se rellena al exportarlas: la reinserción importa el .bas desofuscado
+            self.deobfuscated_macros = [dict(macro, code=result['code'], export_path=None)
+                                        for macro, result in zip(self.macros, results)]
+            stats = deobfuscator.stats
             self.action_progress.set_progress(0.7, True, "Limpiando código ofuscado...")
-            self.log_box.add_log(" Limpiando código ofuscado y ofuscación...")
+            self.log_box.add_log(f" Módulos desofuscados: {stats['modules']} "
+                                 f"(reutilizados de la caché: {stats['reused']}, reprocesados: {stats['recomputed']})")
+            from builder.macro_exporter import export_macros
+            with self.profiler.stage('macro_export', lambda: sum(len(m['code']) for m in self.deobfuscated_macros)):
+                export_macros(self.deobfuscated_macros, self.deobfuscated_dir, source=self.selected_file)
+            for macro in self.deobfuscated_macros:
+                self.log_box.add_log(f"   {macro.get('module_name') or macro['filename']}: "
+                                     f"{macro['code'].count(chr(10)) + 1} línea(s)")
+            self.log_box.add_log(f" Código desofuscado guardado en: {self.deobfuscated_dir}")
             self.page.update()
             
             # Actualizar estado y habilitar botones correspondientes
@@ -1190,6 +1259,7 @@ class AppGUI:
             self.show_snackbar(self.page, "Guarde el archivo antes de reinsertar", FuturisticColors.WARNING)
             return
 
+        from builder.macro_injector import MacroInjector
         timestamp = time.strftime("%Y%m%d_%H%M%S")
         base_name = self.last_base_name or os.path.splitext(os.path.basename(self.selected_file or "archivo"))[0]
         reinsercion_file = os.path.join(OUTPUT_DIR, f"{base_name}_reinsercion_{timestamp}.xlsm")
@@ -1201,7 +1271,8 @@ class AppGUI:
             self.log_box.add_log("🔁 Iniciando reinserción manual con Excel visible...")
             self.page.update()
 
-            injector = MacroInjector(self.last_output_file, self.macros, self.export_dir)
+            # Se reinserta el código desofuscado, si ya se desofuscó
+            injector = MacroInjector(self.last_output_file, self.deobfuscated_macros or self.macros, self.export_dir)
             success, message = injector.create_visible_copy(
                 reinsercion_file,
                 show_excel=True,
@@ -1244,6 +1315,10 @@ class AppGUI:
             self.log_box.add_log(" No se encontró el archivo .xlsm para guardar.")
             self.show_snackbar(self.page, "No se encontró el archivo .xlsm para guardar", FuturisticColors.WARNING)
             return
+        from cleaner.xlt_exe_cleaner import XLtoEXECleaner
+        from builder.xlsm_rebuilder import XLSMRebuilder
+        from builder.macro_injector import MacroInjector
+        from report.report_generator import ReportGenerator
 
         try:
             # Deshabilitar temporalmente los botones durante la operación
@@ -1265,14 +1340,17 @@ class AppGUI:
             self.log_box.add_log("🧹 Limpiando rastros de XLtoEXE...")
             self.action_progress.set_progress(0.3, True, "Limpiando rastros...")
             self.page.update()
-            XLtoEXECleaner(self.working_dir).remove_xltoexe_traces()
+            package = self.package or self.working_dir
+            with self.profiler.stage('xltoexe_cleaner'):
+                XLtoEXECleaner(package).remove_xltoexe_traces()
 
             # Reconstruir archivo
             self.action_progress.set_progress(0.55, True, "Reconstruyendo archivo...")
             self.log_box.add_log("📝 Reconstruyendo archivo .xlsm limpio...")
             self.page.update()
-            self.rebuilder = XLSMRebuilder(self.working_dir)
-            self.rebuilder.rebuild(output_file)
+            self.rebuilder = XLSMRebuilder(package)
+            with self.profiler.stage('rebuild', lambda: self.rebuilder.package.total_size()):
+                self.rebuilder.rebuild(output_file)
             self.last_output_file = output_file
 
             # Generar copia con macros visibles si hay módulos disponibles
@@ -1282,8 +1360,9 @@ class AppGUI:
                 self.action_progress.set_progress(0.7, True, "Reinsertando macros visibles...")
                 self.log_box.add_log("🔁 Generando copia con macros reinsertadas...")
                 self.page.update()
-                injector = MacroInjector(output_file, self.macros, self.export_dir)
-                success, message = injector.create_visible_copy(visible_output)
+                injector = MacroInjector(output_file, self.deobfuscated_macros or self.macros, self.export_dir)
+                with self.profiler.stage('macro_injector', lambda: file_size(output_file)):
+                    success, message = injector.create_visible_copy(visible_output)
                 if success:
                     self.log_box.add_log("✅ Copia de reinserción creada correctamente")
                     self.last_reinsercion_file = visible_output
@@ -1296,7 +1375,9 @@ class AppGUI:
             self.log_box.add_log("📋 Generando informe técnico...")
             self.page.update()
             self.reporter = ReportGenerator(self.working_dir)
-            self.reporter.generate(report_file)
+            with self.profiler.stage('report'):
+                self.reporter.generate(report_file)
+            profile_file = self.save_profile(base_name, timestamp)
 
             self.action_progress.set_progress(0.95, True, "Guardando archivos...")
             self.log_box.add_log(f"💾 Guardando archivo limpio: {os.path.basename(output_file)}")
@@ -1317,6 +1398,9 @@ class AppGUI:
                 self.log_box.add_log("")
             self.log_box.add_log("📋 Informe técnico generado en:")
             self.log_box.add_log(f"   {report_file}")
+            if profile_file:
+                self.log_box.add_log("⏱️ Perfil de etapas guardado en:")
+                self.log_box.add_log(f"   {profile_file}")
             self.log_box.add_log("\n🔍 Puede encontrar los archivos en la carpeta 'DESOFUSCADOS' en su escritorio")
             self.log_box.add_log("="*50)
             self.log_box.add_log("\n🎉 ¡Proceso finalizado con éxito!")
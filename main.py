@@ -3,15 +3,9 @@ import argparse
 import os
 import sys
 import logging
-from extractor.xlsm_unpacker import XLSMUnpacker
-from builder.xlsm_rebuilder import XLSMRebuilder
-from builder.manual_exporter import ManualExporter
-from report.report_generator import ReportGenerator
-from analyzer.vba_extractor import VBAExtractor
-from cleaner.protection_remover import ProtectionRemover
-from cleaner.xlt_exe_cleaner import XLtoEXECleaner
-from deobfuscator.vba_deobfuscator import VBADeobfuscator
-from deobfuscator.vba_optimizer import VBAOptimizer
+# Las etapas se importan dentro de cada función: así `main.py --help` y los
+# errores de argumentos no pagan la carga de oletools y compañía.
+from utils.profiler import StageProfiler
 
 def setup_logging(output_dir):
     log_path = os.path.join(output_dir, "proceso.log")
@@ -24,66 +18,160 @@ def setup_logging(output_dir):
         ]
     )
 
-def extraer_archivo(input_path, output_dir):
-    logging.info("Iniciando extracción del archivo.")
-    unpacker = XLSMUnpacker(input_path, output_dir)
-    unpacker.unpack()
-
-def limpiar_protecciones(output_dir):
-    logging.info("Eliminando protecciones y rastros de XLtoEXE.")
-    cleaner = ProtectionRemover(output_dir)
-    cleaner.remove_sheet_and_workbook_protection()
-    cleaner.remove_vba_project_password()
-    xlt_cleaner = XLtoEXECleaner(output_dir)
-    xlt_cleaner.remove_xltoexe_traces()
-
-def procesar_macros(output_dir):
-    logging.info("Extrayendo y desofuscando macros VBA.")
-    vba_analyzer = VBAExtractor(output_dir)
-    macros = vba_analyzer.extract_macros()
-    if macros:
-        deobfuscator = VBADeobfuscator(macros)
-        deobfuscated_macros = deobfuscator.deobfuscate()
-        optimizer = VBAOptimizer(deobfuscated_macros)
-        optimized_macros = optimizer.optimize()
-        # TODO: Sobrescribir vbaProject.bin con macros optimizados
-    else:
-        logging.warning("No se encontraron macros VBA para procesar.")
-
-def reconstruir_o_exportar(output_dir, manual):
-    if manual:
-        logging.info("Extracción manual seleccionada.")
-        exporter = ManualExporter(output_dir)
-        exporter.export()
-    else:
-        logging.info("Reconstruyendo archivo .xlsm limpio.")
-        rebuilder = XLSMRebuilder(output_dir)
-        rebuilder.rebuild()
-
-def generar_informe(output_dir):
-    logging.info("Generando informe final.")
-    reporter = ReportGenerator(output_dir)
-    reporter.generate()
-
 def main():
     parser = argparse.ArgumentParser(description="Desofuscador y extractor de archivos .xlsm protegidos por XLtoEXE.")
-    parser.add_argument('input', help='Archivo .xlsm o carpeta ZIP extraída')
+    parser.add_argument('inputs', nargs='*', metavar='input', help='Archivo(s) .xlsm o carpeta ZIP extraída')
     parser.add_argument('-o', '--output', help='Directorio de salida', default='output')
     parser.add_argument('--manual', action='store_true', help='Extraer componentes manualmente en vez de reconstruir el .xlsm')
+    parser.add_argument('--export-types', help='Con --manual, exportar sólo estos tipos de parte separados por comas (vba,xml,media,other)')
+    parser.add_argument('--prune-ui-images', action='store_true',
+                        help='Al reconstruir, omitir las imágenes de customUI que la cinta no utiliza')
+    parser.add_argument('--deterministic', action='store_true',
+                        help='Reconstrucción reproducible: fechas fijas (o SOURCE_DATE_EPOCH), orden del archivo '
+                             'de origen y compresión estable')
+    parser.add_argument('--export-macros', choices=('dir', 'zip', 'tar'),
+                        help='Guardar los módulos VBA extraídos en macros_extraidas (carpeta, .zip o .tar con manifiesto)')
+    parser.add_argument('--store', metavar='DIR',
+                        help='Guardar el .xlsm y las macros exportadas en este almacén deduplicado por contenido '
+                             '(cada salida queda como un manifiesto)')
+    parser.add_argument('--journal', metavar='PATH',
+                        help='Diario SQLite de trabajos: al relanzar un lote interrumpido se salta lo ya terminado y '
+                             'cada archivo continúa desde su última etapa (guardarlo fuera de --output con un solo '
+                             'archivo)')
+    parser.add_argument('--materialize', nargs=2, metavar=('MANIFEST', 'DEST'),
+                        help='Con --store, reconstruir la salida MANIFEST (p. ej. libro/3fa9c2e81b04d7a6/reconstruido.xlsm) en DEST '
+                             '("-" para la salida estándar)')
+    parser.add_argument('--triage', action='store_true',
+                        help='Sólo clasificar los archivos (y los de las carpetas indicadas) sin extraerlos; '
+                             'imprime un veredicto JSON por línea')
+    parser.add_argument('--profile', action='store_true', help='Medir tiempos y bytes por etapa (perfil.json en el directorio de salida)')
+    parser.add_argument('--profile-memory', action='store_true', help='Incluir conteo de asignaciones con tracemalloc (más lento)')
+    parser.add_argument('--profile-dir', help='Guardar un volcado cProfile por etapa en este directorio')
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help='Usar el orquestador asíncrono aunque haya un solo archivo (por defecto con varios)')
+    parser.add_argument('--jobs', type=int, default=4, help='Archivos procesados a la vez con el orquestador asíncrono')
+    parser.add_argument('--cpu-workers', type=int, help='Procesos para las etapas de CPU (por defecto, núcleos disponibles)')
+    corpus = parser.add_argument_group('índice de macros')
+    corpus.add_argument('--macro-index', metavar='PATH',
+                        help='Índice SQLite de macros: añadir los módulos extraídos (o consultarlo con --search)')
+    corpus.add_argument('--search', metavar='TEXT',
+                        help='Con --macro-index, buscar esta frase (procedimiento, URL, código...) sin procesar nada; '
+                             'imprime un resultado JSON por línea')
+    corpus.add_argument('--search-field', choices=('module', 'procedure', 'literal', 'code'),
+                        help='Buscar sólo en nombres de módulo, procedimientos, literales de cadena o código')
+    corpus.add_argument('--search-limit', type=int, default=50, help='Resultados máximos de --search')
+    corpus.add_argument('--module-cache', metavar='PATH',
+                        help='Caché SQLite de módulos desofuscados: reutiliza los módulos repetidos o casi '
+                             'repetidos entre libros (misma salida)')
+    budgets = parser.add_argument_group('límites por archivo')
+    budgets.add_argument('--max-unpacked-mb', type=int, default=2048,
+                         help='Tamaño descomprimido máximo de un ZIP (MiB)')
+    budgets.add_argument('--max-ratio', type=int, default=200,
+                         help='Proporción de compresión máxima de un miembro de más de 1 MiB')
+    budgets.add_argument('--max-members', type=int, default=10000, help='Miembros máximos de un ZIP')
+    budgets.add_argument('--max-depth', type=int, default=2,
+                         help='Anidamiento máximo de ZIP dentro de ZIP (p. ej. el .xlsm dentro de un EXE)')
+    budgets.add_argument('--timeout', type=float, help='Segundos máximos por archivo')
+    budgets.add_argument('--max-memory-mb', type=int,
+                         help='Memoria máxima por archivo (MiB): del proceso que lo ejecuta o, con varios '
+                              'archivos o --async, de cada proceso de CPU del orquestador')
+    watch = parser.add_argument_group('modo vigilancia')
+    watch.add_argument('--watch', metavar='DIR',
+                       help='Procesar los archivos que lleguen a esta carpeta (salidas y diario en --output)')
+    watch.add_argument('--settle', type=float, default=1.0,
+                       help='Segundos sin cambios para dar un archivo por completo')
+    watch.add_argument('--poll', type=float, metavar='SECONDS',
+                       help='Examinar la carpeta cada SECONDS en lugar de usar inotify (recursos de red)')
+    service = parser.add_argument_group('modo servicio')
+    service.add_argument('--serve', action='store_true', help='Arrancar el servicio local persistente de trabajos')
+    service.add_argument('--socket', help='Ruta del socket Unix donde escuchar')
+    service.add_argument('--port', type=int, help='Puerto HTTP en 127.0.0.1 donde escuchar')
+    service.add_argument('--workers', type=int, default=2, help='Trabajos simultáneos')
+    service.add_argument('--queue-size', type=int, default=16, help='Trabajos en espera antes de rechazar')
     args = parser.parse_args()
 
+    if args.materialize and not args.store:
+        parser.error('--materialize requiere --store')
+    if args.search and not args.macro_index:
+        parser.error('--search requiere --macro-index')
+    if not args.serve and not args.inputs and not args.materialize and not args.watch and not args.search:
+        parser.error('se requiere el archivo de entrada (o --serve, --watch)')
+    if args.serve and not (args.socket or args.port):
+        parser.error('--serve requiere --socket o --port')
+
+    export_types = None
+    if args.export_types:
+        from builder.manual_exporter import PART_TYPES
+        export_types = [t.strip() for t in args.export_types.split(',') if t.strip()]
+        unknown = [t for t in export_types if t not in PART_TYPES]
+        if unknown:
+            parser.error(f"tipos de parte desconocidos: {', '.join(unknown)} (válidos: {', '.join(PART_TYPES)})")
+
+    if args.triage:
+        # Sólo lectura: no se crea el directorio de salida ni el registro
+        import json
+        from analyzer.triage import triage_files
+        for verdict in triage_files(args.inputs, args.jobs):
+            print(json.dumps(verdict, ensure_ascii=False), flush=True)
+        return
+
+    if args.materialize:
+        from builder.output_store import OutputStore
+        name, dest = args.materialize
+        OutputStore(args.store).materialize(name, sys.stdout.buffer if dest == '-' else dest)
+        return
+
+    if args.search:
+        import json
+        from builder.macro_index import MacroIndex
+        if not os.path.isfile(args.macro_index):
+            parser.error(f'no existe el índice de macros {args.macro_index}')
+        with MacroIndex(args.macro_index) as index:
+            for match in index.search(args.search, args.search_field, args.search_limit):
+                print(json.dumps(match, ensure_ascii=False), flush=True)
+        return
+
+    from utils.resource_limits import MiB, ResourceLimits
+    limits = ResourceLimits(args.max_unpacked_mb * MiB, args.max_ratio, args.max_members, args.max_depth, args.timeout,
+                            args.max_memory_mb * MiB if args.max_memory_mb else None)
+
     os.makedirs(args.output, exist_ok=True)
     setup_logging(args.output)
 
-    try:
-        extraer_archivo(args.input, args.output)
-        limpiar_protecciones(args.output)
-        procesar_macros(args.output)
-        reconstruir_o_exportar(args.output, args.manual)
-        generar_informe(args.output)
-        logging.info("Proceso completado correctamente.")
-    except Exception as e:
-        logging.exception(f"Error durante el proceso: {e}")
+    if args.watch:
+        from service.folder_watcher import watch
+        options = {'manual': args.manual, 'export_types': export_types, 'prune_ui_images': args.prune_ui_images,
+                   'export_macros': args.export_macros, 'deterministic': args.deterministic, 'store': args.store,
+                   'macro_index': args.macro_index, 'module_cache': args.module_cache}
+        watch(args.watch, args.output, args.workers, args.settle, args.poll, options, limits)
+        return
+
+    if args.serve:
+        from service.job_server import serve
+        serve(args.output, args.socket, args.port, args.workers, args.queue_size, limits)
+        return
+
+    if len(args.inputs) > 1 or args.use_async:
+        from pipeline.async_orchestrator import run_files
+        results = run_files(args.inputs, args.output, args.manual, args.profile, args.jobs, args.cpu_workers,
+                            export_types, args.prune_ui_images, args.export_macros, args.deterministic, args.store,
+                            limits, args.journal, args.macro_index, args.module_cache, args.profile_memory,
+                            args.profile_dir)
+        failed = [r for r in results if r['status'] != 'ok']
+        for r in failed:
+            logging.error("Falló %s en la etapa %s: %s", r['input'], r['stage'], r['error'])
+        logging.info("%d de %d archivo(s) procesados correctamente.", len(results) - len(failed), len(results))
+        if failed:
+            sys.exit(1)
+        return
+
+    from pipeline.job_runner import run_job
+    profiler = StageProfiler(args.profile, args.profile_memory, args.profile_dir)
+    result = run_job(args.inputs[0], args.output, args.manual, profiler, export_types=export_types,
+                     prune_ui_images=args.prune_ui_images, export_macros=args.export_macros,
+                     deterministic=args.deterministic, store=args.store, limits=limits, journal=args.journal,
+                     macro_index=args.macro_index, module_cache=args.module_cache)
+    if result['status'] != 'ok':
         sys.exit(1)
 
 if __name__ == '__main__':
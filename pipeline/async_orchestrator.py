@@ -0,0 +1,317 @@
+"""
+Orquestación asíncrona del pipeline: las etapas de cada archivo forman un DAG.
+
+La E/S (extracción, limpieza de rastros, reconstrucción, informe) corre en un
+pool de hilos y el trabajo de CPU (XML de protecciones, descompresión VBA,
+desofuscación) en un pool de procesos. Las ramas independientes se solapan:
+la eliminación de protecciones de hojas corre a la vez que la cadena
+contraseña VBA -> extracción -> desofuscación, y varios archivos avanzan en
+paralelo hasta ``max_files``.
+
+Lo que cruza la frontera de procesos no copia datos grandes: el Package viaja
+como índice y rutas (cada worker mapea las partes desde disco) y las macros
+como SharedModules, con el código en memoria compartida.
+"""
+import asyncio
+import functools
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from pipeline import stages
+from pipeline.job_runner import STORED_OUTPUTS, store_prefix, summarize_macros
+from utils.helpers import file_size, process_pool
+from utils.profiler import StageProfiler, profile_call
+from utils.resource_limits import LimitExceeded, ResourceLimits, run_limited
+
+IO = 'io'
+CPU = 'cpu'
+
+# (nombre, dependencias, pool, función, argumentos a partir del contexto).
+# La extracción devuelve el índice del paquete (Package) y las demás etapas lo
+# reciben en lugar de volver a recorrer el directorio de trabajo.
+STAGE_GRAPH = (
+    ('extract', (), IO, stages.etapa_extraer, lambda ctx, r: (ctx['input'], ctx['output_dir'], ctx['limits'])),
+    # El análisis reparte las hojas en el pool de procesos y debe ver el libro
+    # antes de que la limpieza de rastros quite las hojas del cargador
+    ('workbook_scan', ('extract',), IO, stages.etapa_analizar_libro, lambda ctx, r: (r['extract'], ctx['cpu_pool'])),
+    ('protection.sheets_workbook', ('extract',), CPU, stages.etapa_proteccion_hojas, lambda ctx, r: (r['extract'],)),
+    ('protection.vba_password', ('extract',), IO, stages.etapa_password_vba, lambda ctx, r: (r['extract'],)),
+    # La limpieza reescribe workbook.xml y vbaProject.bin, igual que las dos
+    # etapas de protecciones: va detrás de ellas, como en la ejecución secuencial
+    ('xltoexe_cleaner', ('workbook_scan', 'protection.sheets_workbook', 'protection.vba_password'), IO,
+     stages.etapa_rastros_xltoexe, lambda ctx, r: (r['extract'],)),
+    # Las macros se extraen del proyecto ya limpio y pasan de un proceso a otro
+    # por memoria compartida (SharedModules)
+    ('vba_extract', ('xltoexe_cleaner',), CPU, stages.etapa_extraer_macros,
+     lambda ctx, r: (r['extract'], True)),
+    ('deobfuscate', ('vba_extract',), CPU, stages.etapa_desofuscar,
+     lambda ctx, r: (r['vba_extract'], True, ctx['module_cache'])),
+    ('macro_export', ('vba_extract',), IO, stages.etapa_exportar_macros,
+     lambda ctx, r: (r['vba_extract'], ctx['output_dir'], ctx['export_macros'])),
+    ('macro_index', ('vba_extract',), IO, stages.etapa_indexar_macros,
+     lambda ctx, r: (r['vba_extract'], ctx['macro_index'], ctx['input'])),
+    ('output', ('protection.sheets_workbook', 'protection.vba_password', 'xltoexe_cleaner'), IO,
+     stages.etapa_salida,
+     lambda ctx, r: (r['extract'], ctx['manual'], ctx['export_types'], ctx['prune_ui_images'], ctx['deterministic'])),
+    ('store', ('output', 'macro_export'), IO, stages.etapa_almacenar,
+     lambda ctx, r: ({'componentes' if ctx['manual'] else 'reconstruido': r['output'], 'macros': r['macro_export']},
+                     ctx['store'], store_prefix(ctx['input']))),
+    ('report', ('store', 'deobfuscate'), IO, stages.etapa_informe, lambda ctx, r: (ctx['output_dir'],)),
+)
+
+# Con diario: el código de las macros no se guarda en él (se vuelve a extraer al
+# retomar un archivo) y de la extracción y la desofuscación sólo consta que terminaron
+_NOT_JOURNALED = ('vba_extract',)
+_JOURNALED_WITHOUT_VALUE = ('extract', 'deobfuscate')
+
+_STAGE_BYTES = {
+    'extract': lambda ctx, r: file_size(ctx['input']),
+    'workbook_scan': lambda ctx, r: r['extract'].total_size(('.xml',)),
+    'protection.sheets_workbook': lambda ctx, r: r['extract'].total_size(('.xml',)),
+    'protection.vba_password': lambda ctx, r: r['extract'].total_size(('vbaproject.bin',)),
+    'vba_extract': lambda ctx, r: r['extract'].total_size(('vbaproject.bin',)),
+}
+
+
+class AsyncOrchestrator:
+    def __init__(self, io_workers=8, cpu_workers=None, max_files=4, limits=None):
+        self.io_workers = io_workers
+        self.cpu_workers = cpu_workers or os.cpu_count() or 1
+        self.max_files = max(1, int(max_files))
+        # Límites por archivo; la memoria se limita en los procesos del pool
+        self.limits = ResourceLimits.from_options(limits)
+        self._io_pool = None
+        self._cpu_pool = None
+
+    def __enter__(self):
+        self._io_pool = ThreadPoolExecutor(max_workers=self.io_workers, thread_name_prefix='xltoexe-io')
+        self._cpu_pool = process_pool(self.cpu_workers, self.limits.max_memory)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._io_pool.shutdown(wait=True)
+        self._cpu_pool.shutdown(wait=True)
+        return False
+
+    async def _run_stage(self, name, pool, func, args, ctx, results, profiler):
+        loop = asyncio.get_running_loop()
+        executor = self._cpu_pool if pool == CPU else self._io_pool
+        nbytes = _STAGE_BYTES.get(name)
+        limits = ctx['limits']
+        limits.check_deadline(f'la etapa {name}')
+        with profiler.stage(name, (lambda: nbytes(ctx, results)) if nbytes else None, remote=True) as stage:
+            if stage.cprofile_path:
+                # Se perfila donde corre la etapa (hilo o proceso del pool), no el bucle de eventos
+                func = functools.update_wrapper(functools.partial(profile_call, stage.cprofile_path, func), func)
+            if pool == CPU:
+                # El worker se interrumpe solo al agotar el tiempo: no queda ocupado
+                return await loop.run_in_executor(executor, run_limited, func, args, limits.remaining())
+            return await loop.run_in_executor(executor, func, *args)
+
+    async def process_file(self, input_path, output_dir, manual=False, profiler=None, progress=None,
+                           export_types=None, prune_ui_images=False, export_macros=None, deterministic=False,
+                           store=None, journal=None, macro_index=None, module_cache=None):
+        """
+        Procesa un archivo recorriendo el DAG; devuelve el mismo resumen que run_job.
+        Con ``journal`` (JobJournal) se saltan las etapas que ya terminaron; con
+        ``macro_index`` los módulos extraídos se añaden a ese índice de macros y
+        con ``module_cache`` la desofuscación reutiliza los módulos ya vistos.
+        """
+        from pipeline.job_journal import restore_package
+        from report.report_generator import ReportGenerator
+        from utils.shared_buffers import SharedArena, SharedModules, modules_of
+
+        loop = asyncio.get_running_loop()
+        job = None
+        if journal is not None:
+            options = {'manual': bool(manual), 'export_types': export_types, 'prune_ui_images': bool(prune_ui_images),
+                       'export_macros': export_macros, 'deterministic': bool(deterministic), 'store': store,
+                       'macro_index': macro_index}
+            try:
+                # Calcular el hash de la entrada es E/S: no en el bucle de eventos
+                job = await loop.run_in_executor(self._io_pool, journal.job, input_path, output_dir, options)
+            except OSError as exc:
+                logging.warning("No se pudo consultar el diario para %s: %s", input_path, exc)
+            if job is not None and job.result is not None:
+                logging.info("Ya procesado según el diario: %s", input_path)
+                return job.result
+        profiler = profiler or StageProfiler()
+        os.makedirs(output_dir, exist_ok=True)
+        # Bloques de memoria compartida que devuelven los workers: se liberan al terminar
+        arena = SharedArena()
+        ctx = {'input': input_path, 'output_dir': output_dir, 'manual': bool(manual), 'export_types': export_types,
+               'prune_ui_images': bool(prune_ui_images), 'export_macros': export_macros,
+               'deterministic': bool(deterministic), 'store': store, 'macro_index': macro_index,
+               'module_cache': module_cache, 'cpu_pool': self._cpu_pool,
+               'limits': self.limits.for_file()}
+        result = {
+            'input': input_path,
+            'output_dir': output_dir,
+            'manual': bool(manual),
+            'status': 'error',
+            'stage': None,
+            'error': None,
+            'outputs': {},
+            'macros': [],
+            'xltoexe_traces': [],
+            'workbook': None,
+        }
+        results = {}
+        tasks = {}
+        done_count = 0
+
+        async def node(name, deps, pool, func, build_args):
+            nonlocal done_count
+            for dep in deps:
+                await tasks[dep]
+            if name == 'deobfuscate' and not results.get('vba_extract'):
+                logging.warning("No se encontraron macros VBA para procesar.")
+                results[name] = []
+            elif name == 'macro_export' and not (ctx['export_macros'] and results.get('vba_extract')):
+                results[name] = None
+            elif name == 'store' and not ctx['store']:
+                results[name] = None
+            elif name == 'macro_index' and not ctx['macro_index']:
+                results[name] = None
+            elif job is not None and job.done(name):
+                logging.info("Etapa %s de %s ya terminada según el diario", name, input_path)
+                if name == 'extract':
+                    results[name] = await loop.run_in_executor(self._io_pool, restore_package, input_path,
+                                                                 output_dir)
+                else:
+                    results[name] = job.value(name)
+            else:
+                try:
+                    results[name] = await self._run_stage(name, pool, func, build_args(ctx, results), ctx, results,
+                                                          profiler)
+                    if isinstance(results[name], SharedModules):
+                        arena.adopt(results[name].buffer)
+                    if job is not None and name not in _NOT_JOURNALED:
+                        job.record(name, None if name in _JOURNALED_WITHOUT_VALUE else results[name])
+                except Exception:
+                    if result['stage'] is None:
+                        result['stage'] = name
+                    raise
+            done_count += 1
+            if progress:
+                progress(name, done_count / len(STAGE_GRAPH), f'Etapa {name} terminada')
+
+        for name, deps, pool, func, build_args in STAGE_GRAPH:
+            tasks[name] = asyncio.ensure_future(node(name, deps, pool, func, build_args))
+
+        try:
+            try:
+                await asyncio.wait_for(asyncio.gather(*tasks.values()), ctx['limits'].remaining())
+            except asyncio.TimeoutError:
+                raise LimitExceeded(f"Tiempo agotado ({self.limits.timeout:g} s) procesando {input_path}") from None
+            result['macros'] = summarize_macros(modules_of(results.get('vba_extract') or []))
+            result['xltoexe_traces'] = results.get('xltoexe_cleaner') or []
+            result['workbook'] = results.get('workbook_scan')
+            result['outputs']['componentes' if manual else 'reconstruido'] = results['output']
+            if results.get('macro_export'):
+                result['outputs']['macros'] = results['macro_export']
+            if results.get('macro_index'):
+                result['outputs']['indice_macros'] = results['macro_index']
+            if results.get('store') is not None:
+                for key in STORED_OUTPUTS:
+                    result['outputs'].pop(key, None)
+                result['outputs']['almacen'] = results['store']
+            result['outputs']['informe'] = results['report']
+            result['status'] = 'ok'
+            logging.info("Proceso completado correctamente: %s", input_path)
+        except Exception as e:
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            result['error'] = str(e)
+            logging.exception(f"Error durante el proceso de {input_path}: {e}")
+        finally:
+            arena.close()
+            profile_path = stages.guardar_perfil(profiler, output_dir)
+            if profile_path:
+                result['outputs']['perfil'] = profile_path
+                result['profile'] = profiler.summary()
+            result['outputs']['informe_json'] = ReportGenerator(output_dir).generate_json(result)
+            if job is not None:
+                job.finish(result)
+        return result
+
+    async def process_many(self, jobs, profile=False, export_types=None, prune_ui_images=False, export_macros=None,
+                           deterministic=False, store=None, journal=None, macro_index=None, module_cache=None,
+                           trace_memory=False, cprofile_dir=None):
+        """
+        ``jobs`` es una lista de (input_path, output_dir, manual). ``trace_memory``
+        y ``cprofile_dir`` son los de StageProfiler; con varios archivos cada uno
+        vuelca sus perfiles cProfile en un subdirectorio con el nombre de su salida.
+        """
+        import tracemalloc
+
+        semaphore = asyncio.Semaphore(self.max_files)
+
+        def profiler_for(output_dir):
+            dump_dir = cprofile_dir
+            if dump_dir and len(jobs) > 1:
+                dump_dir = os.path.join(dump_dir, os.path.basename(os.path.normpath(output_dir)))
+            return StageProfiler(profile, trace_memory, dump_dir)
+
+        async def limited(input_path, output_dir, manual):
+            async with semaphore:
+                return await self.process_file(input_path, output_dir, manual, profiler_for(output_dir),
+                                               export_types=export_types, prune_ui_images=prune_ui_images,
+                                               export_macros=export_macros, deterministic=deterministic,
+                                               store=store, journal=journal, macro_index=macro_index,
+                                               module_cache=module_cache)
+
+        # Las etapas de varios archivos se solapan: el trazado de memoria dura todo
+        # el lote en vez de que cada etapa lo arranque y lo pare
+        started_tracing = trace_memory and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        try:
+            return await asyncio.gather(*(limited(*job) for job in jobs))
+        finally:
+            if started_tracing:
+                tracemalloc.stop()
+
+
+def output_dirs_for(inputs, output_root):
+    """Asigna un subdirectorio de salida único a cada archivo de entrada."""
+    used = set()
+    dirs = []
+    for path in inputs:
+        stem = os.path.splitext(os.path.basename(os.path.normpath(path)))[0] or 'archivo'
+        candidate, index = stem, 1
+        while candidate in used:
+            index += 1
+            candidate = f'{stem}_{index}'
+        used.add(candidate)
+        dirs.append(os.path.join(output_root, candidate))
+    return dirs
+
+
+def run_files(inputs, output_root, manual=False, profile=False, max_files=4, cpu_workers=None, export_types=None,
+              prune_ui_images=False, export_macros=None, deterministic=False, store=None, limits=None, journal=None,
+              macro_index=None, module_cache=None, profile_memory=False, profile_dir=None):
+    """
+    Punto de entrada síncrono para el CLI. Con ``journal`` (ruta del diario) un
+    lote relanzado tras un fallo sólo hace el trabajo que quedó pendiente.
+    ``profile_memory`` y ``profile_dir`` son los de ``--profile-memory`` y ``--profile-dir``.
+    """
+    from pipeline.job_journal import JobJournal
+
+    if len(inputs) == 1:
+        output_dirs = [output_root]
+    else:
+        output_dirs = output_dirs_for(inputs, output_root)
+    jobs = [(path, out, manual) for path, out in zip(inputs, output_dirs)]
+    owned = journal is not None and not isinstance(journal, JobJournal)
+    journal = JobJournal.coerce(journal)
+    try:
+        with AsyncOrchestrator(cpu_workers=cpu_workers, max_files=max_files, limits=limits) as orchestrator:
+            return asyncio.run(orchestrator.process_many(jobs, profile, export_types, prune_ui_images, export_macros,
+                                                         deterministic, store, journal, macro_index,
+                                                         module_cache, profile_memory, profile_dir))
+    finally:
+        if owned:
+            journal.close()
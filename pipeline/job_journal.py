@@ -0,0 +1,140 @@
+"""
+Diario de trabajos en SQLite para reanudar lotes interrumpidos.
+
+Cada archivo del lote es un trabajo identificado por el SHA-256 de la entrada,
+su directorio de salida y las opciones que cambian el resultado. El diario
+guarda qué etapas de cada trabajo terminaron (con su resultado en JSON, p. ej.
+la ruta de la salida) y el resumen final de los que acabaron. Al relanzar el
+lote con el mismo diario:
+
+- los archivos terminados correctamente no se vuelven a procesar;
+- los que se quedaron a medias (o fallaron) continúan desde la última etapa
+  terminada, sobre el directorio de trabajo que dejaron en disco;
+- si la entrada cambió o se usan otras opciones, el trabajo empieza de cero.
+
+Se escribe una fila por etapa terminada; con WAL el coste por escritura es
+despreciable frente al de la etapa. El Package no se guarda: se vuelve a
+indexar desde el directorio de trabajo, que refleja las etapas ya aplicadas.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from utils.helpers import file_sha256
+
+# Opciones que cambian las salidas de un trabajo
+JOB_OPTIONS = ('manual', 'export_types', 'prune_ui_images', 'export_macros', 'deterministic', 'store', 'macro_index')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    key TEXT PRIMARY KEY,
+    input TEXT NOT NULL,
+    input_sha256 TEXT NOT NULL,
+    output_dir TEXT NOT NULL,
+    status TEXT NOT NULL,
+    result TEXT,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS stages (
+    key TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    value TEXT,
+    finished REAL NOT NULL,
+    PRIMARY KEY (key, stage)
+);
+"""
+
+
+class JournalJob:
+    """Estado de un trabajo en el diario: etapas terminadas y resumen final."""
+
+    def __init__(self, journal, key, stages, result=None):
+        self.journal = journal
+        self.key = key
+        self.stages = stages
+        # Resumen del trabajo si ya terminó correctamente
+        self.result = result
+
+    def done(self, stage):
+        return stage in self.stages
+
+    def value(self, stage):
+        return self.stages.get(stage)
+
+    def record(self, stage, value=None):
+        """Marca ``stage`` como terminada; ``value`` debe poder pasarse a JSON."""
+        self.stages[stage] = value
+        self.journal._execute('INSERT OR REPLACE INTO stages (key, stage, value, finished) VALUES (?, ?, ?, ?)',
+                              (self.key, stage, json.dumps(value, ensure_ascii=False, default=str), time.time()))
+
+    def finish(self, result):
+        status = 'ok' if result['status'] == 'ok' else 'error'
+        self.journal._execute('UPDATE jobs SET status = ?, result = ?, updated = ? WHERE key = ?',
+                              (status, json.dumps(result, ensure_ascii=False, default=str), time.time(), self.key))
+
+
+class JobJournal:
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        # Una conexión compartida por los hilos del proceso, serializada con el lock
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.executescript(_SCHEMA)
+
+    @classmethod
+    def coerce(cls, journal):
+        """Devuelve ``journal`` si ya es un JobJournal; si es una ruta, lo abre."""
+        if journal is None or isinstance(journal, cls):
+            return journal
+        return cls(journal)
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    @staticmethod
+    def job_key(input_sha256, output_dir, options):
+        options = {name: options.get(name) for name in JOB_OPTIONS}
+        data = json.dumps([input_sha256, os.path.abspath(output_dir), options], sort_keys=True, default=str)
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    def job(self, input_path, output_dir, options):
+        """
+        Abre (o retoma) el trabajo de ``input_path``. Si el directorio de trabajo
+        ya no existe, las etapas registradas no sirven y se empieza de cero.
+        """
+        input_sha256 = file_sha256(input_path)
+        key = self.job_key(input_sha256, output_dir, options)
+        rows = self._execute('SELECT status, result FROM jobs WHERE key = ?', (key,))
+        if rows and os.path.isdir(output_dir):
+            status, result = rows[0]
+            if status == 'ok' and result:
+                return JournalJob(self, key, {}, json.loads(result))
+            stages = {stage: json.loads(value) if value is not None else None
+                      for stage, value in self._execute('SELECT stage, value FROM stages WHERE key = ?', (key,))}
+        else:
+            self._execute('DELETE FROM stages WHERE key = ?', (key,))
+            stages = {}
+        self._execute('INSERT OR REPLACE INTO jobs (key, input, input_sha256, output_dir, status, result, updated) '
+                      'VALUES (?, ?, ?, ?, ?, NULL, ?)',
+                      (key, os.path.abspath(input_path), input_sha256, os.path.abspath(output_dir), 'running',
+                       time.time()))
+        return JournalJob(self, key, stages)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def restore_package(input_path, output_dir):
+    """Package de un trabajo retomado: se indexa el directorio de trabajo tal como quedó."""
+    from extractor.package_index import Package
+    return Package.from_working_dir(output_dir, input_path)
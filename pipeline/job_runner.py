@@ -0,0 +1,286 @@
+import logging
+import os
+import threading
+import time
+
+from pipeline.stages import (
+    almacenar_salidas,
+    analizar_libro,
+    exportar_macros,
+    extraer_archivo,
+    generar_informe,
+    guardar_perfil,
+    indexar_macros,
+    limpiar_protecciones,
+    procesar_macros,
+    reconstruir_o_exportar,
+)
+from utils.profiler import StageProfiler
+
+PIPELINE_STAGES = ('extract', 'analysis', 'protection', 'macros', 'output', 'store', 'report')
+# Salidas que se pasan al almacén con ``store``
+STORED_OUTPUTS = ('reconstruido', 'componentes', 'macros')
+# Con ``timeout``, margen para que el proceso hijo se corte con su propia alarma
+# y deje su resumen antes de matarlo
+KILL_GRACE = 5.0
+
+
+def _no_progress(stage, fraction, message):
+    pass
+
+
+def summarize_macros(macros):
+    return [
+        {'module_name': m['module_name'], 'type': m['type'], 'lines': m['code'].count('\n') + 1}
+        for m in macros
+    ]
+
+
+def store_prefix(input_path):
+    """
+    Carpeta de los manifiestos de un archivo dentro del almacén: su nombre y el
+    SHA-256 de su contenido, para que dos libros con el mismo nombre (de carpetas
+    o meses distintos) no compartan manifiestos.
+    """
+    from utils.helpers import file_sha256
+    stem = os.path.splitext(os.path.basename(os.path.normpath(input_path)))[0] or 'archivo'
+    return f'{stem}/{file_sha256(input_path)[:16]}'
+
+
+def run_job(input_path, output_dir, manual=False, profiler=None, progress=None, export_types=None,
+            prune_ui_images=False, export_macros=None, deterministic=False, store=None, limits=None, journal=None,
+            macro_index=None, module_cache=None):
+    """
+    Ejecuta el pipeline completo sobre un archivo y devuelve un resumen estructurado.
+
+    ``progress(stage, fraction, message)`` se invoca al empezar cada etapa y al
+    terminar. Los errores no se propagan: quedan en ``status``/``error``.
+    ``export_types`` limita la exportación manual a ciertos tipos de parte
+    (vba, xml, media, other); ``prune_ui_images`` omite al reconstruir las imágenes
+    de customUI que la cinta no usa; ``export_macros`` (dir, zip o tar) guarda los
+    módulos VBA extraídos en ``macros_extraidas`` con un manifiesto; con
+    ``deterministic`` la reconstrucción da los mismos bytes para la misma entrada.
+    Con ``store`` (ruta de un OutputStore) el .xlsm y las macros exportadas se
+    guardan deduplicados en el almacén y en ``outputs['almacen']`` quedan los
+    nombres de sus manifiestos en lugar de los archivos. ``limits`` (ResourceLimits
+    o diccionario con sus parámetros) acota la extracción y el tiempo del archivo.
+    Con ``journal`` (JobJournal o ruta del diario) un archivo ya terminado no se
+    repite y uno interrumpido continúa desde la última etapa terminada. Con
+    ``macro_index`` (ruta de un MacroIndex) los módulos extraídos se añaden al
+    índice de búsqueda de macros. ``module_cache`` (ruta de un ModuleCorpus)
+    reutiliza la desofuscación de los módulos ya vistos en otros libros.
+
+    Con ``timeout`` o ``max_memory`` en ``limits`` el trabajo corre en un proceso
+    hijo: la memoria se limita en él y, si no termina a tiempo, se mata, también
+    cuando ``run_job`` se llama desde un hilo (servicio, modo vigilancia).
+    """
+    from utils.resource_limits import ResourceLimits
+
+    limits = ResourceLimits.from_options(limits)
+    options = {'manual': manual, 'profiler': profiler, 'export_types': export_types,
+               'prune_ui_images': prune_ui_images, 'export_macros': export_macros, 'deterministic': deterministic,
+               'store': store, 'journal': journal, 'macro_index': macro_index, 'module_cache': module_cache}
+    if limits.timeout or limits.max_memory:
+        # El diario abierto no pasa a otro proceso: el hijo lo abre por su ruta
+        options['journal'] = getattr(journal, 'path', journal)
+        return _run_in_child(input_path, output_dir, progress, limits, options)
+    return _run_job(input_path, output_dir, progress=progress, limits=limits, **options)
+
+
+def _new_result(input_path, output_dir, manual):
+    return {
+        'input': input_path,
+        'output_dir': output_dir,
+        'manual': bool(manual),
+        'status': 'error',
+        'stage': None,
+        'error': None,
+        'outputs': {},
+        'macros': [],
+        'xltoexe_traces': [],
+        'workbook': None,
+    }
+
+
+class _PipeSender:
+    """Envía mensajes al proceso padre; varios hilos del hijo pueden registrar a la vez."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.lock = threading.Lock()
+
+    def send(self, *message):
+        with self.lock:
+            self.conn.send(message)
+
+    def put_nowait(self, record):
+        # Interfaz de cola para logging.handlers.QueueHandler
+        self.send('log', record)
+
+
+def _child_main(conn, input_path, output_dir, limits, options, log_level):
+    from logging.handlers import QueueHandler
+    from utils.resource_limits import limit_memory
+
+    limit_memory(limits.max_memory)
+    sender = _PipeSender(conn)
+    # El registro lo escriben los manejadores del padre (proceso.log, consola)
+    root = logging.getLogger()
+    root.handlers[:] = [QueueHandler(sender)]
+    root.setLevel(log_level)
+
+    def progress(stage, fraction, message):
+        sender.send('progress', stage, fraction, message)
+
+    try:
+        sender.send('result', _run_job(input_path, output_dir, progress=progress, limits=limits, **options))
+    finally:
+        conn.close()
+
+
+def _run_in_child(input_path, output_dir, progress, limits, options):
+    from report.report_generator import ReportGenerator
+    from utils.helpers import process_context
+
+    notify = progress or _no_progress
+    context = process_context()
+    reader, writer = context.Pipe(duplex=False)
+    # No es daemon: el análisis del libro puede repartirse a su vez en procesos
+    child = context.Process(target=_child_main, name='xltoexe-job',
+                            args=(writer, input_path, output_dir, limits, options,
+                                  logging.getLogger().getEffectiveLevel()))
+    child.start()
+    writer.close()
+    deadline = time.monotonic() + limits.timeout + KILL_GRACE if limits.timeout else None
+    stage = None
+    try:
+        while True:
+            if not reader.poll(None if deadline is None else max(0.0, deadline - time.monotonic())):
+                error = f"Tiempo agotado ({limits.timeout:g} s) procesando {input_path}"
+                break
+            try:
+                message = reader.recv()
+            except EOFError:
+                child.join()
+                error = f"El proceso del trabajo terminó sin resultado (código {child.exitcode})"
+                break
+            if message[0] == 'result':
+                return message[1]
+            if message[0] == 'log':
+                logging.getLogger(message[1].name).handle(message[1])
+                continue
+            stage = message[1]
+            notify(*message[1:])
+    finally:
+        reader.close()
+        if child.is_alive():
+            child.kill()
+        child.join()
+    # El hijo no llegó a dejar su resumen: se escribe aquí
+    logging.error("Falló %s en la etapa %s: %s", input_path, stage, error)
+    os.makedirs(output_dir, exist_ok=True)
+    result = _new_result(input_path, output_dir, options['manual'])
+    result['stage'] = stage
+    result['error'] = error
+    result['outputs']['informe_json'] = ReportGenerator(output_dir).generate_json(result)
+    notify('done', 1.0, 'Error')
+    return result
+
+
+def _run_job(input_path, output_dir, manual, profiler, progress, export_types, prune_ui_images, export_macros,
+             deterministic, store, limits, journal, macro_index, module_cache):
+    from pipeline.job_journal import JobJournal, restore_package
+    from report.report_generator import ReportGenerator
+    from utils.resource_limits import MiB
+
+    profiler = profiler or StageProfiler()
+    notify = progress or _no_progress
+    limits = limits.for_file()
+    job = None
+    if journal is not None:
+        options = {'manual': bool(manual), 'export_types': export_types, 'prune_ui_images': bool(prune_ui_images),
+                   'export_macros': export_macros, 'deterministic': bool(deterministic), 'store': store,
+                   'macro_index': macro_index}
+        try:
+            job = JobJournal.coerce(journal).job(input_path, output_dir, options)
+        except OSError as exc:
+            # Sin entrada legible no hay nada que retomar: el error lo dará la extracción
+            logging.warning("No se pudo consultar el diario para %s: %s", input_path, exc)
+        if job is not None and job.result is not None:
+            logging.info("Ya procesado según el diario: %s", input_path)
+            notify('done', 1.0, 'Completado')
+            return job.result
+    os.makedirs(output_dir, exist_ok=True)
+    result = _new_result(input_path, output_dir, manual)
+    total = len(PIPELINE_STAGES)
+
+    def begin(index, message):
+        limits.check_deadline(f'la etapa {PIPELINE_STAGES[index]}')
+        result['stage'] = PIPELINE_STAGES[index]
+        notify(PIPELINE_STAGES[index], index / total, message)
+
+    def step(index, message, run, restore=None):
+        # Etapa ya terminada en una ejecución anterior: se toma su resultado del diario
+        stage = PIPELINE_STAGES[index]
+        if job is not None and job.done(stage):
+            logging.info("Etapa %s ya terminada según el diario", stage)
+            value = job.value(stage)
+            return restore(value) if restore else value
+        begin(index, message)
+        value = run()
+        if job is not None:
+            job.record(stage, None if restore else value)
+        return value
+
+    def run_macros():
+        macros = procesar_macros(package, profiler, module_cache)
+        done = {'macros': summarize_macros(macros), 'export': None, 'index': None}
+        if export_macros and macros:
+            done['export'] = exportar_macros(macros, output_dir, export_macros, profiler)
+        if macro_index:
+            done['index'] = indexar_macros(macros, macro_index, input_path, profiler)
+        return done
+
+    try:
+        # En el hilo principal, una alarma corta la etapa en curso al agotarse el tiempo
+        with limits.alarm():
+            package = step(0, 'Extrayendo archivo', lambda: extraer_archivo(input_path, output_dir, profiler, limits),
+                           lambda value: restore_package(input_path, output_dir))
+            result['workbook'] = step(1, 'Analizando el libro', lambda: analizar_libro(package, profiler))
+            result['xltoexe_traces'] = step(2, 'Eliminando protecciones',
+                                            lambda: limpiar_protecciones(package, profiler))
+            macros = step(3, 'Extrayendo y desofuscando macros', run_macros)
+            result['macros'] = macros['macros']
+            if macros['export']:
+                result['outputs']['macros'] = macros['export']
+            if macros.get('index'):
+                result['outputs']['indice_macros'] = macros['index']
+            key = 'componentes' if manual else 'reconstruido'
+            result['outputs'][key] = step(4, 'Exportando componentes' if manual else 'Reconstruyendo .xlsm',
+                                          lambda: reconstruir_o_exportar(package, manual, profiler, export_types,
+                                                                         prune_ui_images, deterministic))
+            if store:
+                outputs = {name: result['outputs'].pop(name) for name in STORED_OUTPUTS if name in result['outputs']}
+                result['outputs']['almacen'] = step(5, 'Guardando en el almacén',
+                                                    lambda: almacenar_salidas(outputs, store, store_prefix(input_path),
+                                                                              profiler))
+            result['outputs']['informe'] = step(6, 'Generando informe', lambda: generar_informe(output_dir, profiler))
+        result['status'] = 'ok'
+        result['stage'] = None
+        logging.info("Proceso completado correctamente.")
+    except Exception as e:
+        if isinstance(e, MemoryError) and limits.max_memory:
+            result['error'] = f"Memoria agotada (máximo {limits.max_memory // MiB} MiB)"
+        else:
+            result['error'] = str(e)
+        logging.exception(f"Error durante el proceso: {e}")
+    finally:
+        profile_path = guardar_perfil(profiler, output_dir)
+        if profile_path:
+            result['outputs']['perfil'] = profile_path
+            result['profile'] = profiler.summary()
+        result['outputs']['informe_json'] = ReportGenerator(output_dir).generate_json(result)
+        if job is not None:
+            job.finish(result)
+        notify('done', 1.0, 'Completado' if result['status'] == 'ok' else 'Error')
+    return result
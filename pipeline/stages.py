@@ -0,0 +1,171 @@
+import logging
+import os
+
+from utils.helpers import file_size
+from utils.profiler import StageProfiler
+
+_DISABLED_PROFILER = StageProfiler()
+
+# Etapas elementales: cada una hace una sola operación y sólo recibe argumentos
+# serializables, para poder ejecutarse en un pool de hilos o de procesos.
+# ``package`` es el Package que devuelve la extracción (o la ruta del directorio
+# de trabajo, que se indexa al vuelo).
+
+def etapa_extraer(input_path, output_dir, limits=None):
+    import zipfile
+    from extractor.package_index import Package
+    from extractor.xlsm_unpacker import XLSMUnpacker
+    XLSMUnpacker(input_path, output_dir, limits).unpack()
+    if zipfile.is_zipfile(input_path):
+        return Package.from_zip(input_path, output_dir)
+    return Package.from_directory(output_dir)
+
+def etapa_analizar_libro(package, executor=None):
+    from analyzer.workbook_scanner import WorkbookScanner
+    return WorkbookScanner(package, executor=executor).scan()
+
+def etapa_proteccion_hojas(package):
+    from cleaner.protection_remover import ProtectionRemover
+    ProtectionRemover(package).remove_sheet_and_workbook_protection()
+
+def etapa_password_vba(package):
+    from cleaner.protection_remover import ProtectionRemover
+    return ProtectionRemover(package).remove_vba_project_password()
+
+def etapa_rastros_xltoexe(package):
+    from cleaner.xlt_exe_cleaner import XLtoEXECleaner
+    return XLtoEXECleaner(package).remove_xltoexe_traces()
+
+# Con ``shared`` (etapas que corren en el pool de procesos) las macros viajan
+# como SharedModules: el código queda en memoria compartida y sólo se
+# serializan los metadatos.
+
+def _shared_modules(macros, shared):
+    if not shared or not macros:
+        return macros
+    from utils.shared_buffers import SharedModules
+    return SharedModules(macros)
+
+def _modules(macros):
+    if isinstance(macros, list) or macros is None:
+        return macros
+    from utils.shared_buffers import modules_of
+    return modules_of(macros)
+
+def etapa_extraer_macros(package, shared=False):
+    from analyzer.vba_extractor import VBAExtractor
+    return _shared_modules(VBAExtractor(package).extract_macros(), shared)
+
+def etapa_desofuscar(macros, shared=False, module_cache=None):
+    if module_cache:
+        # Misma salida, reutilizando los módulos ya vistos en otros libros
+        from deobfuscator.module_corpus import CorpusDeobfuscator
+        return _shared_modules(CorpusDeobfuscator(_modules(macros), module_cache).deobfuscate(), shared)
+    from deobfuscator.vba_deobfuscator import VBADeobfuscator
+    from deobfuscator.vba_optimizer import VBAOptimizer
+    deobfuscated_macros = VBADeobfuscator(_modules(macros)).deobfuscate()
+    return _shared_modules(VBAOptimizer(deobfuscated_macros).optimize(), shared)
+
+def etapa_exportar_macros(macros, output_dir, fmt):
+    from builder.macro_exporter import DEFAULT_NAME, export_macros
+    if not macros or not fmt:
+        return None
+    macros = _modules(macros)
+    return export_macros(macros, os.path.join(output_dir, DEFAULT_NAME), fmt)
+
+def etapa_indexar_macros(macros, index_path, input_path):
+    from builder.macro_index import index_macros
+    if not index_path:
+        return None
+    return index_macros(index_path, input_path, _modules(macros) or [])
+
+def etapa_salida(package, manual, export_types=None, prune_ui_images=False, deterministic=False):
+    if manual:
+        from builder.manual_exporter import ManualExporter
+        return ManualExporter(package, part_types=export_types).export()
+    from builder.xlsm_rebuilder import XLSMRebuilder
+    rebuilder = XLSMRebuilder(package, prune_customui_images=prune_ui_images, deterministic=deterministic)
+    rebuilder.rebuild()
+    return os.path.join(rebuilder.working_dir, 'reconstruido.xlsm')
+
+def etapa_almacenar(outputs, store_dir, prefix):
+    from builder.output_store import store_outputs
+    if not store_dir:
+        return {}
+    return store_outputs(store_dir, prefix, outputs)
+
+def etapa_informe(output_dir):
+    from report.report_generator import ReportGenerator
+    ReportGenerator(output_dir).generate()
+    return os.path.join(output_dir, 'informe.txt')
+
+# Etapas compuestas usadas por la ejecución secuencial (CLI y servicio)
+
+def extraer_archivo(input_path, output_dir, profiler=_DISABLED_PROFILER, limits=None):
+    logging.info("Iniciando extracción del archivo.")
+    with profiler.stage('extract', lambda: file_size(input_path)):
+        return etapa_extraer(input_path, output_dir, limits)
+
+def analizar_libro(package, profiler=_DISABLED_PROFILER):
+    logging.info("Analizando hojas, nombres definidos y fórmulas.")
+    with profiler.stage('workbook_scan', lambda: package.total_size(('.xml',))):
+        return etapa_analizar_libro(package)
+
+def limpiar_protecciones(package, profiler=_DISABLED_PROFILER):
+    logging.info("Eliminando protecciones y rastros de XLtoEXE.")
+    with profiler.stage('protection.sheets_workbook', lambda: package.total_size(('.xml',))):
+        etapa_proteccion_hojas(package)
+    with profiler.stage('protection.vba_password', lambda: package.total_size(('vbaproject.bin',))):
+        etapa_password_vba(package)
+    with profiler.stage('xltoexe_cleaner'):
+        return etapa_rastros_xltoexe(package)
+
+def procesar_macros(package, profiler=_DISABLED_PROFILER, module_cache=None):
+    logging.info("Extrayendo y desofuscando macros VBA.")
+    with profiler.stage('vba_extract', lambda: package.total_size(('vbaproject.bin',))):
+        macros = etapa_extraer_macros(package)
+    if macros:
+        with profiler.stage('deobfuscate', lambda: sum(len(m['code']) for m in macros)):
+            optimized_macros = etapa_desofuscar(macros, module_cache=module_cache)
+        # TODO: Sobrescribir vbaProject.bin con macros optimizados
+    else:
+        logging.warning("No se encontraron macros VBA para procesar.")
+    return macros
+
+def exportar_macros(macros, output_dir, fmt, profiler=_DISABLED_PROFILER):
+    logging.info("Exportando %d módulo(s) VBA (%s).", len(macros), fmt)
+    with profiler.stage('macro_export', lambda: sum(len(m['code']) for m in macros)):
+        return etapa_exportar_macros(macros, output_dir, fmt)
+
+def indexar_macros(macros, index_path, input_path, profiler=_DISABLED_PROFILER):
+    logging.info("Añadiendo %d módulo(s) VBA al índice de macros.", len(macros))
+    with profiler.stage('macro_index', lambda: sum(len(m['code']) for m in macros)):
+        return etapa_indexar_macros(macros, index_path, input_path)
+
+def reconstruir_o_exportar(package, manual, profiler=_DISABLED_PROFILER, export_types=None, prune_ui_images=False,
+                           deterministic=False):
+    if manual:
+        logging.info("Extracción manual seleccionada.")
+        with profiler.stage('manual_export', package.total_size):
+            return etapa_salida(package, manual, export_types)
+    logging.info("Reconstruyendo archivo .xlsm limpio.")
+    with profiler.stage('rebuild', package.total_size):
+        return etapa_salida(package, manual, prune_ui_images=prune_ui_images, deterministic=deterministic)
+
+def almacenar_salidas(outputs, store_dir, prefix, profiler=_DISABLED_PROFILER):
+    logging.info("Guardando las salidas en el almacén %s.", store_dir)
+    with profiler.stage('store', lambda: sum(file_size(p) for p in outputs.values() if p and os.path.isfile(p))):
+        return etapa_almacenar(outputs, store_dir, prefix)
+
+def generar_informe(output_dir, profiler=_DISABLED_PROFILER):
+    logging.info("Generando informe final.")
+    with profiler.stage('report'):
+        return etapa_informe(output_dir)
+
+def guardar_perfil(profiler, output_dir):
+    if not profiler.enabled:
+        return None
+    logging.info("Perfil de etapas:\n%s", profiler.format_table())
+    path = profiler.write_json(os.path.join(output_dir, 'perfil.json'))
+    logging.info("Perfil guardado en %s", path)
+    return path
@@ -1,3 +1,4 @@
+import json
 import os
 
 class ReportGenerator:
@@ -10,3 +11,10 @@ class ReportGenerator:
             f.write('INFORME DE DESOFUSCACIÓN Y LIMPIEZA\n')
             f.write('Directorio de trabajo: %s\n' % self.working_dir)
             # Aquí se pueden agregar detalles de los cambios realizados
+
+    def generate_json(self, summary, output_path=None):
+        # Versión estructurada del informe para integraciones (servicio, lotes)
+        report_path = output_path or os.path.join(self.working_dir, 'informe.json')
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2, ensure_ascii=False, default=str)
+        return report_path
@@ -0,0 +1,327 @@
+"""
+Modo vigilancia: procesa los archivos que llegan a una carpeta.
+
+Los eventos llegan por inotify (Linux, vía ctypes) sin recorrer la carpeta; si
+inotify no está disponible, o con ``poll_interval`` (necesario en recursos de
+red donde otras máquinas escriben y el kernel local no ve los cambios), se
+examina la carpeta cada ``poll_interval`` segundos. Sólo se mira el primer
+nivel de la carpeta.
+
+Un archivo se da por completo cuando pasan ``settle`` segundos sin eventos y
+su tamaño y fecha no cambian; los nombres temporales (``.tmp``, ``.part``,
+``~$...``, ocultos) se ignoran. Los archivos listos entran en una cola con
+prioridad por tamaño (los pequeños primero) que atienden ``workers`` hilos con
+``run_job``.
+
+Cada archivo se procesa en ``<salida>/<nombre>`` y cada paso queda en el
+diario ``<salida>/_vigilancia.jsonl``. Al arrancar se lee el diario y se
+examina la carpeta una vez: lo que llegó con el servicio parado se procesa y lo
+ya terminado (mismo tamaño y fecha) no se repite.
+"""
+import ctypes
+import ctypes.util
+import importlib
+import itertools
+import json
+import logging
+import os
+import queue
+import select
+import struct
+import threading
+import time
+
+from analyzer.triage import TRIAGE_EXTENSIONS
+from pipeline.job_runner import run_job
+from service.job_server import WARM_MODULES
+
+JOURNAL_NAME = '_vigilancia.jsonl'
+DEFAULT_SETTLE = 1.0
+DEFAULT_POLL_INTERVAL = 2.0
+
+_IGNORED_PREFIXES = ('.', '~$')
+_IGNORED_SUFFIXES = ('.tmp', '.part', '.partial', '.crdownload', '.download', '.filepart')
+
+# inotify(7)
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+_WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+_EVENT = struct.Struct('iIII')
+_READ_SIZE = 64 * 1024
+
+
+class InotifyWatcher:
+    """Nombres de los archivos de ``path`` con actividad, leídos de inotify."""
+
+    def __init__(self, path):
+        libc_name = ctypes.util.find_library('c')
+        if not libc_name:
+            raise OSError("No se encontró la libc para usar inotify")
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError("inotify no está disponible en esta plataforma")
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 falló")
+        if libc.inotify_add_watch(self.fd, os.fsencode(path), _WATCH_MASK) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f"No se pudo vigilar {path}")
+
+    def wait(self, timeout):
+        """
+        Espera hasta ``timeout`` segundos; devuelve los nombres con eventos, o
+        None si la cola del kernel se desbordó y hay que volver a examinar la carpeta.
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        names = []
+        try:
+            data = os.read(self.fd, _READ_SIZE)
+        except BlockingIOError:
+            return []
+        offset = 0
+        while offset + _EVENT.size <= len(data):
+            _wd, mask, _cookie, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                return None
+            if name:
+                names.append(os.fsdecode(name))
+        return names
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+def is_candidate(name):
+    lower = name.lower()
+    return (lower.endswith(TRIAGE_EXTENSIONS) and not lower.startswith(_IGNORED_PREFIXES)
+            and not lower.endswith(_IGNORED_SUFFIXES))
+
+
+class FolderWatcher:
+    def __init__(self, watch_dir, output_root, workers=2, settle=DEFAULT_SETTLE, poll_interval=None, options=None,
+                 limits=None):
+        self.watch_dir = os.path.abspath(watch_dir)
+        self.output_root = os.path.abspath(output_root)
+        self.workers = max(1, int(workers))
+        self.settle = settle
+        self.poll_interval = poll_interval
+        # Mismas opciones que un trabajo del servicio (manual, export_macros, store, macro_index...)
+        self.options = options or {}
+        self.limits = limits
+        self.journal_path = os.path.join(self.output_root, JOURNAL_NAME)
+        self.queue = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._pending = {}
+        self._finished = {}
+        self._queued = set()
+        self._used_dirs = set()
+        self._threads = []
+        # Reentrante: al encolar (con el lock tomado) también se escribe el diario
+        self._lock = threading.RLock()
+
+    # Diario
+
+    def _journal(self, event, **data):
+        entry = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'event': event, **data}
+        line = json.dumps(entry, ensure_ascii=False, default=str) + '\n'
+        with self._lock:
+            with open(self.journal_path, 'a', encoding='utf-8') as f:
+                f.write(line)
+
+    def _load_journal(self):
+        try:
+            with open(self.journal_path, 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if entry.get('event') in ('done', 'error'):
+                self._finished[entry['path']] = (entry.get('size'), entry.get('mtime_ns'))
+            if entry.get('output_dir'):
+                self._used_dirs.add(entry['output_dir'])
+
+    # Detección
+
+    def _touch(self, name):
+        """Actividad en ``name``: se vuelve a esperar ``settle`` segundos."""
+        if not is_candidate(name):
+            return
+        path = os.path.join(self.watch_dir, name)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return
+        self._pending[path] = (time.monotonic() + self.settle, (st.st_size, st.st_mtime_ns))
+
+    def _scan(self):
+        with os.scandir(self.watch_dir) as entries:
+            for entry in entries:
+                if not is_candidate(entry.name) or not entry.is_file():
+                    continue
+                st = entry.stat()
+                key = (st.st_size, st.st_mtime_ns)
+                if self._finished.get(entry.path) == key or entry.path in self._queued:
+                    continue
+                if self._pending.get(entry.path, (0, None))[1] != key:
+                    self._pending[entry.path] = (time.monotonic() + self.settle, key)
+
+    def _check_pending(self):
+        now = time.monotonic()
+        for path, (deadline, key) in list(self._pending.items()):
+            if deadline > now:
+                continue
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                # Borrado o renombrado antes de terminar de copiarse
+                del self._pending[path]
+                continue
+            current = (st.st_size, st.st_mtime_ns)
+            if current != key or not st.st_size:
+                # Aún cambia (o está vacío): otra espera
+                self._pending[path] = (now + self.settle, current)
+                continue
+            del self._pending[path]
+            if self._finished.get(path) != current and path not in self._queued:
+                self._enqueue(path, current)
+
+    def _next_timeout(self):
+        if not self._pending:
+            return 1.0
+        return max(0.05, min(deadline for deadline, _ in self._pending.values()) - time.monotonic())
+
+    # Cola y workers
+
+    def _output_dir(self, path):
+        stem = os.path.splitext(os.path.basename(path))[0] or 'archivo'
+        candidate, index = stem, 1
+        while os.path.join(self.output_root, candidate) in self._used_dirs \
+                or os.path.exists(os.path.join(self.output_root, candidate)):
+            index += 1
+            candidate = f'{stem}_{index}'
+        output_dir = os.path.join(self.output_root, candidate)
+        self._used_dirs.add(output_dir)
+        return output_dir
+
+    def _enqueue(self, path, key):
+        output_dir = self._output_dir(path)
+        self._queued.add(path)
+        # Prioridad por tamaño: un archivo grande no retrasa a los pequeños que llegan detrás
+        self.queue.put((key[0], next(self._sequence), path, key, output_dir))
+        self._journal('queued', path=path, size=key[0], mtime_ns=key[1], output_dir=output_dir)
+        logging.info("En cola: %s (%d bytes)", path, key[0])
+
+    def _worker_loop(self):
+        while True:
+            _size, _seq, path, key, output_dir = self.queue.get()
+            if path is None:
+                return
+            self._journal('started', path=path, size=key[0], mtime_ns=key[1], output_dir=output_dir)
+            started = time.monotonic()
+            try:
+                result = run_job(path, output_dir, bool(self.options.get('manual')), None, None,
+                                 self.options.get('export_types'), bool(self.options.get('prune_ui_images')),
+                                 self.options.get('export_macros'), bool(self.options.get('deterministic')),
+                                 self.options.get('store'), self.limits,
+                                 macro_index=self.options.get('macro_index'),
+                                 module_cache=self.options.get('module_cache'))
+            except Exception as exc:  # run_job ya captura los errores del pipeline
+                logging.exception("Fallo inesperado procesando %s", path)
+                result = {'status': 'error', 'error': str(exc), 'outputs': {}}
+            event = 'done' if result['status'] == 'ok' else 'error'
+            self._journal(event, path=path, size=key[0], mtime_ns=key[1], output_dir=output_dir,
+                          elapsed_s=round(time.monotonic() - started, 3), error=result.get('error'),
+                          outputs=result.get('outputs'))
+            with self._lock:
+                self._finished[path] = key
+                self._queued.discard(path)
+
+    def start(self):
+        os.makedirs(self.output_root, exist_ok=True)
+        self._load_journal()
+        for module in WARM_MODULES:
+            try:
+                importlib.import_module(module)
+            except ImportError as exc:
+                logging.warning("No se pudo precargar %s: %s", module, exc)
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._worker_loop, name=f'xltoexe-watch-{index + 1}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        # Los avisos de parada van por delante de cualquier archivo (tamaño >= 0): cada
+        # worker termina el archivo en curso y sale. Los que quedan en cola no se
+        # pierden: sin 'done' en el diario, el examen al arrancar los vuelve a encolar.
+        pending = self.queue.qsize()
+        for _ in self._threads:
+            self.queue.put((-1, next(self._sequence), None, None, None))
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        if pending:
+            logging.info("%d archivo(s) en cola quedan para el próximo arranque", pending)
+
+    def run(self, stop_event=None):
+        """Vigila hasta Ctrl+C (o hasta que se active ``stop_event``)."""
+        stop_event = stop_event or threading.Event()
+        self.start()
+        watcher = None
+        if not self.poll_interval:
+            try:
+                watcher = InotifyWatcher(self.watch_dir)
+            except OSError as exc:
+                logging.warning("inotify no disponible (%s); se examinará la carpeta periódicamente", exc)
+        interval = self.poll_interval or DEFAULT_POLL_INTERVAL
+        logging.info("Vigilando %s con %s (%d worker(s)); diario en %s", self.watch_dir,
+                     'inotify' if watcher else f'sondeo cada {interval:g} s', self.workers, self.journal_path)
+        with self._lock:
+            self._scan()
+        next_scan = time.monotonic() + interval
+        try:
+            while not stop_event.is_set():
+                if watcher is not None:
+                    names = watcher.wait(self._next_timeout())
+                    with self._lock:
+                        if names is None:
+                            logging.warning("Se perdieron eventos de inotify; examinando la carpeta")
+                            self._scan()
+                        else:
+                            for name in names:
+                                self._touch(name)
+                        self._check_pending()
+                else:
+                    stop_event.wait(max(0.0, min(self._next_timeout(), next_scan - time.monotonic())))
+                    with self._lock:
+                        if time.monotonic() >= next_scan:
+                            self._scan()
+                            next_scan = time.monotonic() + interval
+                        self._check_pending()
+        except KeyboardInterrupt:
+            logging.info("Deteniendo la vigilancia...")
+        finally:
+            if watcher is not None:
+                watcher.close()
+            self.stop()
+
+
+def watch(watch_dir, output_root, workers=2, settle=DEFAULT_SETTLE, poll_interval=None, options=None, limits=None):
+    """Arranca el modo vigilancia y bloquea hasta Ctrl+C."""
+    if not os.path.isdir(watch_dir):
+        raise ValueError(f"No existe la carpeta a vigilar: {watch_dir}")
+    FolderWatcher(watch_dir, output_root, workers, settle, poll_interval, options, limits).run()
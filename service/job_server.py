@@ -0,0 +1,432 @@
+"""
+Servicio local persistente: mantiene workers calientes y acepta trabajos por
+socket Unix o HTTP en localhost.
+
+Protocolo socket Unix: una línea JSON por petición; la respuesta son líneas JSON
+(eventos ``queued``, ``progress``, ``done`` o ``rejected``).
+
+    {"input": "/ruta/libro.xlsm", "options": {"manual": false, "profile": true}}
+    {"input": "/ruta/libro.xlsm", "options": {"manual": true, "export_types": ["vba", "xml"]}}
+    {"input": "/ruta/libro.xlsm", "options": {"export_macros": "zip", "deterministic": true}}
+    {"input": "/ruta/libro.xlsm", "options": {"export_macros": "dir", "store": "almacen"}}
+    {"input": "/ruta/libro.xlsm", "options": {"macro_index": "macros.sqlite", "output_dir": "libro"}}
+    {"input": "/ruta/libro.xlsm", "options": {"module_cache": "modulos.sqlite"}}
+    {"input": "/ruta/libro.xlsm", "options": {"limits": {"timeout": 60, "max_unpacked": 536870912}}}
+    {"filename": "libro.xlsm", "data_b64": "...", "options": {}}
+
+``options['limits']`` sólo reduce los límites del servicio (nunca los sube ni
+los quita). Con ``timeout`` o ``max_memory`` en los límites cada trabajo corre
+en un proceso hijo, que se mata si no termina a tiempo (ver pipeline.job_runner).
+
+Las rutas en las que escribe un trabajo (``output_dir``, ``store``,
+``macro_index``, ``module_cache``) son relativas al directorio de salida del
+servicio y no pueden salir de él. Los archivos subidos se guardan en
+``_entradas`` y se borran al terminar su trabajo.
+
+HTTP (sólo 127.0.0.1):
+
+    POST /jobs           cuerpo JSON (Content-Type: application/json), o bytes crudos
+                         con Content-Type: application/octet-stream y ?filename=...&manual=1
+    GET  /status         estado de la cola y de los workers
+
+Cualquier otro Content-Type se rechaza (415): un formulario o un ``fetch`` en
+modo ``no-cors`` de una página web no puede enviar trabajos al servicio. Las
+peticiones cuya cabecera Host no sea ``localhost`` o ``127.0.0.1`` con el puerto
+del servicio se rechazan (403, protección frente a DNS rebinding), y los cuerpos
+sin Content-Length válido o mayores que ``MAX_REQUEST_BYTES`` no se leen (411/413).
+
+La respuesta de POST /jobs es NDJSON en streaming con los mismos eventos. Si la
+cola está llena se rechaza de inmediato (HTTP 503 + Retry-After) para que el
+cliente aplique backpressure.
+"""
+import base64
+import importlib
+import json
+import logging
+import os
+import queue
+import re
+import socketserver
+import stat
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from pipeline.job_runner import run_job
+from utils.profiler import StageProfiler
+
+WARM_MODULES = (
+    'oletools.olevba',
+    'extractor.xlsm_unpacker',
+    'cleaner.protection_remover',
+    'cleaner.xlt_exe_cleaner',
+    'analyzer.vba_extractor',
+    'deobfuscator.vba_deobfuscator',
+    'deobfuscator.vba_optimizer',
+    'builder.xlsm_rebuilder',
+    'builder.manual_exporter',
+    'report.report_generator',
+)
+
+_TERMINAL_EVENTS = ('done', 'rejected')
+# Opciones con rutas en las que escribe el trabajo: siempre dentro de output_root
+_PATH_OPTIONS = ('output_dir', 'store', 'macro_index', 'module_cache')
+# Tamaño máximo del cuerpo de una petición HTTP (un libro en base64 ocupa 4/3 de su tamaño)
+MAX_REQUEST_BYTES = 256 * 1024 * 1024
+_LOCAL_HOSTS = ('localhost', '127.0.0.1')
+
+
+class QueueFullError(RuntimeError):
+    pass
+
+
+class Job:
+    def __init__(self, input_path, output_dir, options):
+        self.id = uuid.uuid4().hex[:12]
+        self.input_path = input_path
+        self.output_dir = output_dir
+        self.options = options
+        # Archivo subido con la petición: se borra al terminar
+        self.uploaded = False
+        self.events = queue.Queue()
+        self.submitted_at = time.monotonic()
+
+    def emit(self, event, **data):
+        self.events.put({'job': self.id, 'event': event, **data})
+
+    def stream(self):
+        """Produce los eventos del trabajo hasta el evento final."""
+        while True:
+            event = self.events.get()
+            yield event
+            if event['event'] in _TERMINAL_EVENTS:
+                return
+
+
+class JobServer:
+    """Cola acotada + pool de workers con los motores ya importados."""
+
+    def __init__(self, output_root, workers=2, queue_size=16, limits=None):
+        from utils.resource_limits import ResourceLimits
+        self.output_root = os.path.abspath(output_root)
+        # Límites por defecto de cada trabajo; ``options['limits']`` sólo puede hacerlos más estrictos
+        self.limits = ResourceLimits.from_options(limits)
+        self.workers = max(1, int(workers))
+        self.queue = queue.Queue(maxsize=max(1, int(queue_size)))
+        self._threads = []
+        self._lock = threading.Lock()
+        self._running = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._inputs_dir = os.path.join(self.output_root, '_entradas')
+
+    def warm_up(self):
+        for module in WARM_MODULES:
+            try:
+                importlib.import_module(module)
+            except ImportError as exc:
+                logging.warning("No se pudo precargar %s: %s", module, exc)
+
+    def start(self):
+        os.makedirs(self._inputs_dir, exist_ok=True)
+        self.warm_up()
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._worker_loop, name=f'xltoexe-worker-{index + 1}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logging.info("Servicio iniciado con %d worker(s) y cola de %d", self.workers, self.queue.maxsize)
+
+    def stop(self):
+        for _ in self._threads:
+            self.queue.put(None)
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self._threads = []
+
+    def _confined(self, path, option):
+        """Ruta absoluta de ``path`` (relativa a output_root); ValueError si sale de output_root."""
+        resolved = os.path.realpath(os.path.join(self.output_root, path))
+        if os.path.commonpath([resolved, os.path.realpath(self.output_root)]) != os.path.realpath(self.output_root):
+            raise ValueError(f"La opción '{option}' debe quedar dentro de {self.output_root}: {path}")
+        return resolved
+
+    def submit(self, request):
+        """Valida la petición y la encola; lanza QueueFullError si no hay sitio."""
+        options = dict(request.get('options') or {})
+        for option in _PATH_OPTIONS:
+            if options.get(option):
+                options[option] = self._confined(str(options[option]), option)
+        if request.get('data_b64') is not None or request.get('data') is not None:
+            data = request.get('data')
+            if data is None:
+                data = base64.b64decode(request['data_b64'])
+            filename = os.path.basename(request.get('filename') or 'entrada.xlsm')
+            filename = re.sub(r'[^\w.\-]', '_', filename)
+            job = Job(None, None, options)
+            input_path = os.path.join(self._inputs_dir, f'{job.id}_{filename}')
+            with open(input_path, 'wb') as f:
+                f.write(data)
+            job.input_path = input_path
+            job.uploaded = True
+        elif request.get('input'):
+            input_path = os.path.abspath(request['input'])
+            if not os.path.exists(input_path):
+                raise ValueError(f"No existe el archivo de entrada: {input_path}")
+            job = Job(input_path, None, options)
+        else:
+            raise ValueError("La petición debe incluir 'input' o 'data_b64'")
+
+        job_output = options.get('output_dir') or os.path.join(self.output_root, job.id)
+        job.output_dir = os.path.abspath(job_output)
+        try:
+            self.queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                self._rejected += 1
+            self._discard_upload(job)
+            raise QueueFullError("Cola llena; reintente más tarde")
+        job.emit('queued', position=self.queue.qsize(), input=job.input_path, output_dir=job.output_dir)
+        return job
+
+    @staticmethod
+    def _discard_upload(job):
+        if not job.uploaded:
+            return
+        try:
+            os.remove(job.input_path)
+        except OSError as exc:
+            logging.warning("No se pudo borrar la entrada subida %s: %s", job.input_path, exc)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'running': self._running,
+                'queued': self.queue.qsize(),
+                'queue_size': self.queue.maxsize,
+                'completed': self._completed,
+                'failed': self._failed,
+                'rejected': self._rejected,
+            }
+
+    def _worker_loop(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            with self._lock:
+                self._running += 1
+            try:
+                self._run(job)
+            finally:
+                with self._lock:
+                    self._running -= 1
+
+    def _run(self, job):
+        started = time.monotonic()
+        job.emit('started', waited_s=round(started - job.submitted_at, 4))
+        profiler = StageProfiler(enabled=bool(job.options.get('profile')))
+
+        def progress(stage, fraction, message):
+            job.emit('progress', stage=stage, fraction=round(fraction, 3), message=message)
+
+        try:
+            result = run_job(job.input_path, job.output_dir, bool(job.options.get('manual')), profiler, progress,
+                             job.options.get('export_types'), bool(job.options.get('prune_ui_images')),
+                             job.options.get('export_macros'), bool(job.options.get('deterministic')),
+                             job.options.get('store'), self.limits.tightened(job.options.get('limits')),
+                             macro_index=job.options.get('macro_index'),
+                             module_cache=job.options.get('module_cache'))
+        except Exception as exc:  # run_job ya captura los errores del pipeline
+            logging.exception("Fallo inesperado en el trabajo %s", job.id)
+            result = {'status': 'error', 'error': str(exc), 'outputs': {}}
+        finally:
+            self._discard_upload(job)
+        with self._lock:
+            if result['status'] == 'ok':
+                self._completed += 1
+            else:
+                self._failed += 1
+        job.emit('done', status=result['status'], elapsed_s=round(time.monotonic() - started, 4), result=result)
+
+
+def _write_json_line(stream, payload):
+    stream.write(json.dumps(payload, ensure_ascii=False, default=str).encode('utf-8') + b'\n')
+    stream.flush()
+
+
+class _UnixRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        if not line.strip():
+            return
+        try:
+            job = self.server.job_server.submit(json.loads(line))
+        except QueueFullError as exc:
+            _write_json_line(self.wfile, {'event': 'rejected', 'reason': str(exc), 'retry_after_s': 1})
+            return
+        except (ValueError, KeyError, TypeError) as exc:
+            _write_json_line(self.wfile, {'event': 'rejected', 'reason': str(exc)})
+            return
+        try:
+            for event in job.stream():
+                _write_json_line(self.wfile, event)
+        except (BrokenPipeError, ConnectionResetError):
+            logging.warning("El cliente del trabajo %s se desconectó; el trabajo continúa", job.id)
+
+
+class _HTTPRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'DesofuscadorXLtoEXE'
+
+    def log_message(self, format, *args):
+        logging.info("HTTP %s - %s", self.address_string(), format % args)
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False, default=str).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _reject(self, status, reason):
+        # El cuerpo no se ha leído: la conexión no se puede reutilizar
+        self.close_connection = True
+        self._send_json(status, {'event': 'rejected', 'reason': reason}, {'Connection': 'close'})
+
+    def _host_allowed(self):
+        """True si Host es localhost o 127.0.0.1 con el puerto en el que escucha el servicio."""
+        port = self.server.server_address[1]
+        allowed = {f'{host}:{port}' for host in _LOCAL_HOSTS}
+        if port == 80:
+            allowed.update(_LOCAL_HOSTS)
+        if (self.headers.get('Host') or '').strip().lower() in allowed:
+            return True
+        self._reject(403, 'Host no permitido; use localhost o 127.0.0.1 con el puerto del servicio')
+        return False
+
+    def _content_length(self):
+        """Longitud del cuerpo o None (tras responder 411/413) si falta, no es válida o es excesiva."""
+        try:
+            length = int(self.headers.get('Content-Length', ''))
+        except ValueError:
+            self._reject(411, 'Se requiere una cabecera Content-Length válida')
+            return None
+        if length < 0:
+            self._reject(411, 'Se requiere una cabecera Content-Length válida')
+            return None
+        if length > MAX_REQUEST_BYTES:
+            self._reject(413, f'El cuerpo supera el máximo de {MAX_REQUEST_BYTES} bytes')
+            return None
+        return length
+
+    def do_GET(self):
+        if not self._host_allowed():
+            return
+        if urlparse(self.path).path == '/status':
+            self._send_json(200, self.server.job_server.stats())
+        else:
+            self._send_json(404, {'error': 'Ruta no encontrada'})
+
+    def do_POST(self):
+        if not self._host_allowed():
+            return
+        url = urlparse(self.path)
+        if url.path != '/jobs':
+            self.close_connection = True
+            self._send_json(404, {'error': 'Ruta no encontrada'}, {'Connection': 'close'})
+            return
+        content_type = self.headers.get('Content-Type', '').split(';')[0].strip().lower()
+        if content_type not in ('application/json', 'application/octet-stream'):
+            # text/plain o un formulario no pasan por el preflight CORS del navegador
+            self._reject(415, 'Content-Type debe ser application/json o application/octet-stream')
+            return
+        length = self._content_length()
+        if length is None:
+            return
+        body = self.rfile.read(length)
+        try:
+            if content_type == 'application/octet-stream':
+                query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+                options = {'manual': query.get('manual') in ('1', 'true'), 'profile': query.get('profile') in ('1', 'true')}
+                request = {'filename': query.get('filename'), 'data': body, 'options': options}
+            else:
+                request = json.loads(body or b'{}')
+            job = self.server.job_server.submit(request)
+        except QueueFullError as exc:
+            self._send_json(503, {'event': 'rejected', 'reason': str(exc)}, {'Retry-After': '1'})
+            return
+        except (ValueError, KeyError, TypeError) as exc:
+            self._send_json(400, {'event': 'rejected', 'reason': str(exc)})
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson; charset=utf-8')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        try:
+            for event in job.stream():
+                chunk = json.dumps(event, ensure_ascii=False, default=str).encode('utf-8') + b'\n'
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+                self.wfile.flush()
+            self.wfile.write(b'0\r\n\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            logging.warning("El cliente del trabajo %s se desconectó; el trabajo continúa", job.id)
+
+
+def _remove_stale_socket(path):
+    """Borra el socket Unix que haya en ``path``; si es otra cosa, no la toca."""
+    try:
+        mode = os.lstat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise ValueError(f"{path} existe y no es un socket Unix; indique otra ruta en --socket")
+    os.remove(path)
+
+
+def serve(output_root, socket_path=None, port=None, workers=2, queue_size=16, limits=None):
+    """Arranca el servicio y bloquea hasta Ctrl+C."""
+    if not socket_path and not port:
+        raise ValueError("Indique --socket o --port para el modo servicio")
+    job_server = JobServer(output_root, workers, queue_size, limits)
+
+    servers = []
+    if socket_path:
+        if not hasattr(socketserver, 'ThreadingUnixStreamServer'):
+            raise ValueError("Los sockets Unix no están disponibles en esta plataforma; use --port")
+        _remove_stale_socket(socket_path)
+        unix_server = socketserver.ThreadingUnixStreamServer(socket_path, _UnixRequestHandler)
+        unix_server.daemon_threads = True
+        unix_server.job_server = job_server
+        servers.append(unix_server)
+        logging.info("Escuchando en el socket Unix %s", socket_path)
+    if port:
+        http_server = ThreadingHTTPServer(('127.0.0.1', int(port)), _HTTPRequestHandler)
+        http_server.daemon_threads = True
+        http_server.job_server = job_server
+        servers.append(http_server)
+        logging.info("Escuchando en http://127.0.0.1:%d", http_server.server_address[1])
+
+    job_server.start()
+    threads = [threading.Thread(target=s.serve_forever, daemon=True) for s in servers]
+    for thread in threads:
+        thread.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        logging.info("Deteniendo el servicio...")
+    finally:
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+        job_server.stop()
+        if socket_path:
+            _remove_stale_socket(socket_path)
@@ -10,3 +10,55 @@ def is_xlsm_or_zip(path):
 
 def is_exe(path):
     return path.lower().endswith('.exe')
+
+def file_size(path):
+    return os.path.getsize(path) if os.path.isfile(path) else 0
+
+def dir_size(path, suffixes=None):
+    # Suma el tamaño de los archivos bajo path (opcionalmente filtrando por sufijo)
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for file in files:
+            if suffixes and not file.lower().endswith(suffixes):
+                continue
+            total += os.path.getsize(os.path.join(root, file))
+    return total
+
+def file_sha256(path):
+    # SHA-256 del contenido; en una carpeta ZIP ya extraída, de nombres, tamaños y fechas
+    import hashlib
+    digest = hashlib.sha256()
+    if os.path.isdir(path):
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                st = os.stat(os.path.join(dirpath, filename))
+                rel = os.path.relpath(os.path.join(dirpath, filename), path)
+                digest.update(f'{rel}\0{st.st_size}\0{st.st_mtime_ns}\n'.encode('utf-8', 'surrogateescape'))
+        return digest.hexdigest()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(1024 * 1024)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def process_context():
+    # Con 'fork' el hijo hereda los locks que otros hilos tengan tomados (p. ej. el
+    # de importación de las etapas que se cargan al vuelo) y puede quedarse
+    # bloqueado; 'forkserver' crea los procesos desde un servidor sin hilos
+    import multiprocessing
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context()
+
+def process_pool(max_workers=None, max_memory=None):
+    from concurrent.futures import ProcessPoolExecutor
+    context = process_context()
+    if not max_memory:
+        return ProcessPoolExecutor(max_workers=max_workers, mp_context=context)
+    # Cada worker limita su propia memoria (ver utils.resource_limits)
+    from utils.resource_limits import limit_memory
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=context, initializer=limit_memory,
+                               initargs=(max_memory,))
@@ -0,0 +1,375 @@
+"""
+Motor ZIP con varios hilos para extraer y reconstruir paquetes.
+
+zlib libera el GIL al comprimir, descomprimir y calcular el CRC, así que las
+partes se procesan en paralelo con un pool de hilos:
+
+- Al extraer, cada miembro se descomprime en su propio hilo, leyendo los datos
+  comprimidos con un descriptor de archivo propio.
+- Al escribir, cada miembro se parte en bloques de ``chunk_size`` que se
+  comprimen por separado (como pigz: cada bloque usa los últimos 32 KiB del
+  anterior como diccionario y termina con Z_SYNC_FLUSH) y se concatenan. Las
+  cabeceras locales y el directorio central se escriben en el orden en que se
+  añadieron los miembros, así que el archivo no depende del número de hilos.
+"""
+import os
+import struct
+import time
+import zipfile
+import zlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+CHUNK_SIZE = 1024 * 1024
+READ_SIZE = 1024 * 1024
+_WINDOW = 32 * 1024
+# Bloques comprimidos o pendientes de escribir por hilo
+_INFLIGHT_PER_WORKER = 4
+
+_LOCAL_HEADER = struct.Struct('<4s2B4HL2L2H')
+_CENTRAL_HEADER = struct.Struct('<4s4B4HL2L5H2L')
+_END_RECORD = struct.Struct('<4s4H2LH')
+_END_RECORD64 = struct.Struct('<4sQ2H2L4Q')
+_END_LOCATOR64 = struct.Struct('<4sLQL')
+_ZIP64_LIMIT = (1 << 31) - 1
+_UTF8_FLAG = 0x800
+_WINDOWS_ILLEGAL = str.maketrans(':<>|"?*', '_______')
+
+
+def default_workers():
+    return min(8, os.cpu_count() or 1)
+
+
+def _completed(value):
+    future = Future()
+    future.set_result(value)
+    return future
+
+
+def _run(pool, function, *args):
+    # Sin pool (un solo hilo) se ejecuta en el momento con la misma interfaz
+    if pool is not None:
+        return pool.submit(function, *args)
+    return _completed(function(*args))
+
+
+# Extracción
+
+def member_target(info, output_dir):
+    """Ruta de destino de ``info``, saneada igual que ``ZipFile.extractall``."""
+    arcname = info.filename.replace('/', os.path.sep)
+    if os.path.altsep:
+        arcname = arcname.replace(os.path.altsep, os.path.sep)
+    arcname = os.path.splitdrive(arcname)[1]
+    invalid = ('', os.path.curdir, os.path.pardir)
+    arcname = os.path.sep.join(x for x in arcname.split(os.path.sep) if x not in invalid)
+    if os.path.sep == '\\':
+        # Caracteres no válidos en Windows y puntos finales, como hace zipfile
+        parts = (x.rstrip('.') for x in arcname.translate(_WINDOWS_ILLEGAL).split(os.path.sep))
+        arcname = os.path.sep.join(x for x in parts if x)
+    return os.path.normpath(os.path.join(output_dir, arcname))
+
+
+def seek_member_data(src, info):
+    """Sitúa ``src`` al comienzo de los datos (comprimidos) del miembro ``info``."""
+    src.seek(info.header_offset)
+    header = src.read(_LOCAL_HEADER.size)
+    if len(header) != _LOCAL_HEADER.size or header[:4] != b'PK\x03\x04':
+        raise zipfile.BadZipFile(f"Cabecera local incorrecta en {info.filename}")
+    fields = _LOCAL_HEADER.unpack(header)
+    src.seek(fields[10] + fields[11], os.SEEK_CUR)
+
+
+def _copy_member(zip_path, info, target, limits):
+    with open(zip_path, 'rb') as src:
+        seek_member_data(src, info)
+        remaining = info.compress_size
+        decompressor = zlib.decompressobj(-15) if info.compress_type == zipfile.ZIP_DEFLATED else None
+        crc = written = 0
+        with open(target, 'wb') as dst:
+            while remaining:
+                chunk = src.read(min(READ_SIZE, remaining))
+                if not chunk:
+                    raise zipfile.BadZipFile(f"Datos truncados en {info.filename}")
+                remaining -= len(chunk)
+                if decompressor is not None:
+                    # Como mucho lo que queda por declarar (+1 para detectar el exceso)
+                    chunk = decompressor.decompress(chunk, info.file_size - written + 1)
+                written += len(chunk)
+                limits.check_member(info, written)
+                crc = zlib.crc32(chunk, crc)
+                dst.write(chunk)
+            if decompressor is not None:
+                tail = decompressor.flush()
+                written += len(tail)
+                limits.check_member(info, written)
+                crc = zlib.crc32(tail, crc)
+                dst.write(tail)
+    if crc != info.CRC:
+        raise zipfile.BadZipFile(f"CRC incorrecto en {info.filename}")
+
+
+def _extract_member(zip_path, info, target, limits):
+    if info.flag_bits & 0x1 or info.compress_type not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+        # Cifrado u otro método (bzip2, lzma): se deja a zipfile, que no lee más
+        # allá del tamaño declarado
+        with zipfile.ZipFile(zip_path) as zf, zf.open(info) as src, open(target, 'wb') as dst:
+            while True:
+                chunk = src.read(READ_SIZE)
+                if not chunk:
+                    break
+                limits.check_deadline(f'la extracción de {info.filename}')
+                dst.write(chunk)
+        return
+    _copy_member(zip_path, info, target, limits)
+
+
+def extract_all(zip_path, output_dir, workers=None, limits=None, depth=0):
+    """
+    Equivale a ``ZipFile(zip_path).extractall(output_dir)``; devuelve los nombres
+    extraídos. ``limits`` (ResourceLimits, por defecto DEFAULT_LIMITS) se
+    comprueba antes de escribir nada y mientras se descomprime; ``depth`` es el
+    nivel de anidamiento del ZIP (0 si no viene de dentro de otro). Sin
+    ``limits`` cada llamada tiene su propio presupuesto.
+    """
+    from utils.resource_limits import DEFAULT_LIMITS
+
+    workers = workers or default_workers()
+    limits = limits or DEFAULT_LIMITS.for_file()
+    with zipfile.ZipFile(zip_path) as zf:
+        infos = zf.infolist()
+    limits.check_archive(infos, depth, os.path.basename(zip_path))
+    # Nombres repetidos (frecuentes en muestras manipuladas): como en extractall, gana
+    # el último; varios hilos no pueden escribir a la vez el mismo destino
+    by_target = {}
+    for info in infos:
+        target = member_target(info, output_dir)
+        if info.is_dir():
+            os.makedirs(target, exist_ok=True)
+            continue
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        key = os.path.normcase(target)
+        by_target.pop(key, None)
+        by_target[key] = (info, target)
+    files = list(by_target.values())
+    extracted = [info.filename for info, _target in files]
+    # Los miembros grandes primero: el último hilo no se queda solo con el más lento
+    files.sort(key=lambda item: item[0].compress_size, reverse=True)
+    if workers <= 1 or len(files) <= 1:
+        for info, target in files:
+            _extract_member(zip_path, info, target, limits)
+    else:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='xltoexe-unzip') as pool:
+            futures = [pool.submit(_extract_member, zip_path, info, target, limits) for info, target in files]
+            try:
+                for future in futures:
+                    future.result()
+            except BaseException:
+                # Falla rápido: los miembros que aún no empezaron no se extraen
+                for future in futures:
+                    future.cancel()
+                raise
+    return extracted
+
+
+# Escritura
+
+def _deflate_chunk(data, dictionary, level, last):
+    if dictionary is not None:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15, zdict=dictionary)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+class ZipEntry:
+    __slots__ = ('name', 'size', 'date_time', 'external_attr', 'method', 'zip64',
+                 'header_offset', 'crc', 'compress_size', 'flags', 'started')
+
+    def __init__(self, name, size, date_time, external_attr, method):
+        self.name = name
+        self.size = size
+        self.date_time = date_time
+        self.external_attr = external_attr
+        self.method = method
+        # Mismo criterio que zipfile: el tamaño comprimido podría superar al original
+        self.zip64 = size * 1.05 > _ZIP64_LIMIT
+        self.header_offset = 0
+        self.crc = 0
+        self.compress_size = 0
+        self.flags = 0 if name.isascii() else _UTF8_FLAG
+        self.started = False
+
+
+def _dos_time(date_time):
+    year, month, day, hour, minute, second = date_time
+    return (hour << 11) | (minute << 5) | (second // 2), ((year - 1980) << 9) | (month << 5) | day
+
+
+def local_header(entry):
+    """Cabecera local de ``entry`` (con el CRC y los tamaños que tenga en ese momento)."""
+    name = entry.name.encode('utf-8' if entry.flags & _UTF8_FLAG else 'ascii')
+    dostime, dosdate = _dos_time(entry.date_time)
+    if entry.zip64:
+        extra = struct.pack('<HHQQ', 1, 16, entry.size, entry.compress_size)
+        size = compress_size = 0xFFFFFFFF
+        version = 45
+    else:
+        extra = b''
+        size, compress_size = entry.size, entry.compress_size
+        version = 20
+    return _LOCAL_HEADER.pack(b'PK\x03\x04', version, 0, entry.flags, entry.method, dostime, dosdate,
+                              entry.crc, compress_size, size, len(name), len(extra)) + name + extra
+
+
+def central_header(entry):
+    """Entrada del directorio central de ``entry``."""
+    name = entry.name.encode('utf-8' if entry.flags & _UTF8_FLAG else 'ascii')
+    dostime, dosdate = _dos_time(entry.date_time)
+    fields = []
+    size, compress_size, offset = entry.size, entry.compress_size, entry.header_offset
+    if entry.zip64 or size > _ZIP64_LIMIT:
+        fields.append(size)
+        size = 0xFFFFFFFF
+    if entry.zip64 or compress_size > _ZIP64_LIMIT:
+        fields.append(compress_size)
+        compress_size = 0xFFFFFFFF
+    if offset > _ZIP64_LIMIT:
+        fields.append(offset)
+        offset = 0xFFFFFFFF
+    extra = struct.pack(f'<HH{len(fields)}Q', 1, 8 * len(fields), *fields) if fields else b''
+    version = 45 if fields else 20
+    return _CENTRAL_HEADER.pack(b'PK\x01\x02', version, 3, version, 0, entry.flags, entry.method,
+                                dostime, dosdate, entry.crc, compress_size, size, len(name), len(extra),
+                                0, 0, 0, entry.external_attr, offset) + name + extra
+
+
+def end_records(count, start, end):
+    """Registros finales (ZIP64 si hace falta) de un directorio central entre ``start`` y ``end``."""
+    size = end - start
+    records = b''
+    if count > 0xFFFF or size > _ZIP64_LIMIT or start > _ZIP64_LIMIT:
+        records += _END_RECORD64.pack(b'PK\x06\x06', 44, 45, 45, 0, 0, count, count, size, start)
+        records += _END_LOCATOR64.pack(b'PK\x06\x07', 0, end, 1)
+        count, size, start = min(count, 0xFFFF), min(size, 0xFFFFFFFF), min(start, 0xFFFFFFFF)
+    return records + _END_RECORD.pack(b'PK\x05\x06', 0, 0, count, count, size, start, 0)
+
+
+class ParallelZipWriter:
+    """
+    Escribe un ZIP comprimiendo en paralelo. ``add`` acepta bytes o cualquier
+    objeto con interfaz de buffer (por ejemplo la vista mapeada de una parte);
+    el buffer debe seguir válido hasta ``close``.
+    """
+
+    def __init__(self, path, workers=None, level=zlib.Z_DEFAULT_COMPRESSION, chunk_size=CHUNK_SIZE):
+        self.path = path
+        self.workers = workers or default_workers()
+        self.level = level
+        self.chunk_size = chunk_size
+        self.entries = []
+        self._fp = open(path, 'wb')
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='xltoexe-zip') \
+            if self.workers > 1 else None
+        self._pending = deque()
+        self._inflight = deque()
+        self._window = self.workers * _INFLIGHT_PER_WORKER
+
+    def add(self, name, data, date_time=None, external_attr=0o600 << 16, compress_type=zipfile.ZIP_DEFLATED):
+        view = memoryview(data).cast('B')
+        entry = ZipEntry(name, len(view), date_time or time.localtime(time.time())[:6], external_attr, compress_type)
+        self.entries.append(entry)
+        if compress_type == zipfile.ZIP_STORED or not len(view):
+            self._pending.append((entry, view, None, True))
+        else:
+            starts = range(0, len(view), self.chunk_size)
+            for start in starts:
+                dictionary = view[max(0, start - _WINDOW):start] if start else None
+                last = start + self.chunk_size >= len(view)
+                self._pending.append((entry, view[start:start + self.chunk_size], dictionary, last))
+        self._pump()
+        self._write_ready(block=False)
+
+    def add_file(self, name, path, data=None, compress_type=zipfile.ZIP_DEFLATED):
+        """Como ``ZipFile.write``: fecha y permisos del archivo; ``data`` evita volver a leerlo."""
+        st = os.stat(path)
+        date_time = time.localtime(st.st_mtime)[:6]
+        if date_time[0] < 1980:
+            date_time = (1980, 1, 1, 0, 0, 0)
+        if data is None:
+            with open(path, 'rb') as f:
+                data = f.read()
+        self.add(name, data, date_time, (st.st_mode & 0xFFFF) << 16, compress_type)
+
+    def _pump(self):
+        while self._pending and len(self._inflight) < self._window:
+            entry, chunk, dictionary, last = self._pending.popleft()
+            if entry.method == zipfile.ZIP_STORED:
+                future = _completed(chunk)
+            else:
+                future = _run(self._pool, _deflate_chunk, chunk, dictionary, self.level, last)
+            self._inflight.append((entry, chunk, future, last))
+
+    def _write_ready(self, block):
+        while self._inflight and (block or self._inflight[0][2].done()):
+            entry, chunk, future, last = self._inflight.popleft()
+            compressed = future.result()
+            if not entry.started:
+                # Cabecera provisional: el CRC y el tamaño comprimido se corrigen al terminar
+                entry.started = True
+                entry.header_offset = self._fp.tell()
+                self._fp.write(local_header(entry))
+            entry.crc = zlib.crc32(chunk, entry.crc)
+            entry.compress_size += len(compressed)
+            self._fp.write(compressed)
+            if last:
+                self._finish_entry(entry)
+            self._pump()
+
+    def _finish_entry(self, entry):
+        if not entry.zip64 and entry.compress_size > _ZIP64_LIMIT:
+            raise zipfile.LargeZipFile(f"{entry.name}: el tamaño comprimido necesita ZIP64")
+        end = self._fp.tell()
+        self._fp.seek(entry.header_offset)
+        self._fp.write(local_header(entry))
+        self._fp.seek(end)
+
+    def close(self):
+        """Escribe lo pendiente y el directorio central; devuelve ``path``."""
+        if self._fp is None:
+            return self.path
+        try:
+            while self._pending or self._inflight:
+                self._pump()
+                self._write_ready(block=True)
+            start = self._fp.tell()
+            for entry in self.entries:
+                self._fp.write(central_header(entry))
+            self._fp.write(end_records(len(self.entries), start, self._fp.tell()))
+        finally:
+            self._shutdown()
+        return self.path
+
+    def abort(self):
+        """Cierra sin escribir el directorio central (el archivo queda incompleto)."""
+        self._pending.clear()
+        self._inflight.clear()
+        self._shutdown()
+
+    def _shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
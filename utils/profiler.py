@@ -0,0 +1,182 @@
+import json
+import os
+import re
+import threading
+import time
+import tracemalloc
+
+
+class _NullStage:
+    """Etapa vacía usada cuando el perfilado está desactivado (coste casi nulo)."""
+
+    __slots__ = ()
+    cprofile_path = None
+
+    def add_bytes(self, nbytes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+# Hilos con un cProfile activo: en un mismo hilo sólo puede haber uno, aunque
+# las etapas sean de perfiladores distintos (varios archivos en un bucle asyncio)
+_CPROFILE_THREADS = set()
+
+
+class _ActiveStage:
+    def __init__(self, profiler, name, nbytes, remote=False):
+        self.profiler = profiler
+        self.name = name
+        self.nbytes = nbytes
+        self.remote = remote
+        # Con ``remote``, ruta donde quien ejecuta la etapa vuelca su cProfile
+        self.cprofile_path = profiler._cprofile_path(name) if remote and profiler.cprofile_dir else None
+        self._start = 0.0
+        self._snapshot = None
+        self._owns_tracemalloc = False
+        self._cprofile = None
+
+    def add_bytes(self, nbytes):
+        self.nbytes = (self.nbytes or 0) + int(nbytes or 0)
+
+    def __enter__(self):
+        if callable(self.nbytes):
+            try:
+                self.nbytes = self.nbytes()
+            except OSError:
+                self.nbytes = None
+        if self.profiler.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._owns_tracemalloc = True
+            tracemalloc.reset_peak()
+            self._snapshot = tracemalloc.take_snapshot()
+        if self.profiler.cprofile_dir and not self.remote and threading.get_ident() not in _CPROFILE_THREADS:
+            import cProfile
+            _CPROFILE_THREADS.add(threading.get_ident())
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self._start
+        record = {
+            'stage': self.name,
+            'seconds': round(elapsed, 6),
+            'bytes': self.nbytes,
+            'mb_per_s': None,
+            'ok': exc_type is None,
+        }
+        if self.nbytes and elapsed > 0:
+            record['mb_per_s'] = round(self.nbytes / elapsed / (1024 * 1024), 3)
+
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            _CPROFILE_THREADS.discard(threading.get_ident())
+            record['cprofile'] = self.profiler._dump_cprofile(self.name, self._cprofile)
+        elif self.cprofile_path and os.path.exists(self.cprofile_path):
+            record['cprofile'] = self.cprofile_path
+
+        if self._snapshot is not None:
+            _, peak = tracemalloc.get_traced_memory()
+            after = tracemalloc.take_snapshot()
+            diff = after.compare_to(self._snapshot, 'filename')
+            record['alloc_blocks'] = sum(stat.count_diff for stat in diff if stat.count_diff > 0)
+            record['alloc_bytes'] = sum(stat.size_diff for stat in diff if stat.size_diff > 0)
+            record['peak_bytes'] = peak
+            if self._owns_tracemalloc:
+                tracemalloc.stop()
+
+        self.profiler.records.append(record)
+        return False
+
+
+class StageProfiler:
+    """
+    Instrumentación ligera por etapa del pipeline.
+
+    Registra tiempos monotónicos, bytes procesados y, opcionalmente, asignaciones
+    de memoria (tracemalloc) y volcados de cProfile por etapa. Desactivado, cada
+    etapa devuelve un contexto vacío compartido.
+    """
+
+    def __init__(self, enabled=False, trace_memory=False, cprofile_dir=None):
+        self.enabled = bool(enabled or trace_memory or cprofile_dir)
+        self.trace_memory = trace_memory
+        self.cprofile_dir = cprofile_dir
+        self.records = []
+        self._dumps = 0
+
+    def stage(self, name, nbytes=None, remote=False):
+        """
+        Devuelve un context manager que mide la etapa ``name``.
+
+        ``nbytes`` puede ser un entero o un callable; el callable sólo se evalúa
+        con el perfilado activo, para no recorrer disco cuando está apagado.
+        ``remote`` indica que la etapa se ejecuta en otro hilo o proceso: el
+        cProfile no se activa aquí y el contexto ofrece ``cprofile_path`` para
+        que quien la ejecute lo vuelque con ``profile_call``.
+        """
+        if not self.enabled:
+            return _NULL_STAGE
+        return _ActiveStage(self, name, nbytes, remote)
+
+    def _cprofile_path(self, name):
+        # Numeradas al empezar: las etapas concurrentes no comparten nombre de volcado
+        self._dumps += 1
+        safe_name = re.sub(r'[^\w-]', '_', name)
+        return os.path.join(self.cprofile_dir, f"{self._dumps:02d}_{safe_name}.prof")
+
+    def _dump_cprofile(self, name, profile):
+        os.makedirs(self.cprofile_dir, exist_ok=True)
+        path = self._cprofile_path(name)
+        profile.dump_stats(path)
+        return path
+
+    def total_seconds(self):
+        return round(sum(r['seconds'] for r in self.records), 6)
+
+    def summary(self):
+        return {
+            'total_seconds': self.total_seconds(),
+            'trace_memory': bool(self.trace_memory),
+            'stages': list(self.records),
+        }
+
+    def format_table(self):
+        lines = [f"{'Etapa':<32}{'Segundos':>12}{'Bytes':>14}{'MB/s':>10}{'Pico mem':>14}"]
+        for r in self.records:
+            lines.append(
+                f"{r['stage']:<32}{r['seconds']:>12.4f}"
+                f"{r['bytes'] if r['bytes'] is not None else '-':>14}"
+                f"{r['mb_per_s'] if r['mb_per_s'] is not None else '-':>10}"
+                f"{r.get('peak_bytes', '-'):>14}"
+            )
+        lines.append(f"{'TOTAL':<32}{self.total_seconds():>12.4f}")
+        return '\n'.join(lines)
+
+    def write_json(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.summary(), f, indent=2, ensure_ascii=False)
+        return path
+
+
+def profile_call(path, func, *args):
+    """Ejecuta ``func(*args)`` con cProfile en el hilo o proceso actual y vuelca el perfil en ``path``."""
+    import cProfile
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        return func(*args)
+    finally:
+        profile.disable()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        profile.dump_stats(path)
@@ -0,0 +1,193 @@
+"""
+Límites de recursos por archivo.
+
+Una muestra maliciosa o corrupta no debe llenar el disco ni bloquear un worker:
+
+- Al extraer un ZIP se comprueba el directorio central antes de escribir nada
+  (número de miembros, tamaño descomprimido total, proporción de compresión
+  de cada miembro y profundidad de anidamiento) y, mientras se descomprime, que
+  ningún miembro produzca más bytes de los que declara. Los miembros y bytes se
+  suman entre todos los ZIP que se extraen para un mismo archivo (p. ej. el de
+  un EXE autoextraíble y el .xlsm que contiene): el presupuesto es uno solo.
+- ``timeout`` limita el tiempo total por archivo: se comprueba entre etapas y
+  durante la extracción, y en el hilo principal o en los procesos del pool se
+  interrumpe además con una alarma (SIGALRM).
+- ``max_memory`` limita el espacio de direcciones (RLIMIT_AS) del proceso que
+  ejecuta el trabajo o las etapas de CPU.
+
+``run_job`` ejecuta en un proceso hijo los trabajos con ``timeout`` o
+``max_memory`` (ver pipeline.job_runner), así que ambos se cumplen también desde
+los hilos del servicio y del modo vigilancia.
+
+Los límites de extracción están activos por defecto; el tiempo y la memoria,
+no. Superar un límite lanza ``LimitExceeded`` y el archivo falla sin retrasar
+al resto de la cola.
+"""
+import copy
+import signal
+import threading
+import time
+
+MiB = 1024 * 1024
+
+DEFAULT_MAX_UNPACKED = 2048 * MiB
+DEFAULT_MAX_RATIO = 200
+DEFAULT_MAX_MEMBERS = 10000
+DEFAULT_MAX_DEPTH = 2
+# La proporción sólo se comprueba en miembros que descomprimen más de esto:
+# las partes XML pequeñas comprimen mucho sin ser peligrosas
+RATIO_MIN_SIZE = 1 * MiB
+
+
+class LimitExceeded(RuntimeError):
+    pass
+
+
+class ResourceLimits:
+    def __init__(self, max_unpacked=DEFAULT_MAX_UNPACKED, max_ratio=DEFAULT_MAX_RATIO,
+                 max_members=DEFAULT_MAX_MEMBERS, max_depth=DEFAULT_MAX_DEPTH, timeout=None, max_memory=None):
+        self.max_unpacked = max_unpacked
+        self.max_ratio = max_ratio
+        self.max_members = max_members
+        self.max_depth = max_depth
+        self.timeout = timeout
+        self.max_memory = max_memory
+        self.deadline = None
+        # Consumido por el archivo en curso (ver for_file)
+        self.unpacked = 0
+        self.members = 0
+
+    @classmethod
+    def from_options(cls, options):
+        """Desde un diccionario (p. ej. las opciones de un trabajo del servicio); None usa los valores por defecto."""
+        if isinstance(options, cls):
+            return options
+        return cls(**(options or {}))
+
+    def tightened(self, options):
+        """
+        Copia con los valores de ``options`` (diccionario) que sean más estrictos.
+        Un cliente del servicio sólo puede reducir los límites, nunca subirlos ni
+        quitarlos: None o un valor mayor dejan el del servidor.
+        """
+        limits = copy.copy(self)
+        for key, value in (options or {}).items():
+            if key not in _TUNABLE:
+                raise ValueError(f"Límite desconocido: {key}")
+            if value is None:
+                continue
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                raise ValueError(f"Límite no numérico: {key}={value!r}")
+            current = getattr(limits, key)
+            setattr(limits, key, value if current is None else min(current, value))
+        return limits
+
+    def for_file(self):
+        """Copia con el reloj del archivo en marcha (si hay ``timeout``) y el consumo a cero."""
+        limits = copy.copy(self)
+        limits.deadline = time.monotonic() + self.timeout if self.timeout else None
+        limits.unpacked = 0
+        limits.members = 0
+        return limits
+
+    def remaining(self):
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def check_deadline(self, what='el proceso'):
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise LimitExceeded(f"Tiempo agotado ({self.timeout:g} s) durante {what}")
+
+    # Extracción
+
+    def check_archive(self, infos, depth=0, name='el ZIP'):
+        """
+        Valida el directorio central antes de extraer nada; ``depth`` es el nivel de
+        anidamiento (0 si el ZIP no salió de dentro de otro). Miembros y bytes se
+        suman a lo ya extraído para el mismo archivo.
+        """
+        if depth > self.max_depth:
+            raise LimitExceeded(f"{name}: anidamiento de ZIP mayor que {self.max_depth}")
+        members = self.members + len(infos)
+        if members > self.max_members:
+            raise LimitExceeded(f"{name}: {members} miembros en total (máximo {self.max_members})")
+        total = self.unpacked
+        for info in infos:
+            total += info.file_size
+            if total > self.max_unpacked:
+                raise LimitExceeded(f"{name}: más de {self.max_unpacked // MiB} MiB descomprimidos")
+            if info.file_size > RATIO_MIN_SIZE and info.file_size > self.max_ratio * max(1, info.compress_size):
+                ratio = info.file_size // max(1, info.compress_size)
+                raise LimitExceeded(f"{name}: {info.filename} comprime {ratio}:1 (máximo {self.max_ratio}:1)")
+        self.members = members
+        self.unpacked = total
+
+    def check_member(self, info, written):
+        """Durante la extracción: un miembro no puede dar más bytes de los que declara."""
+        if written > info.file_size:
+            raise LimitExceeded(f"{info.filename}: descomprime más de los {info.file_size} bytes declarados")
+        self.check_deadline(f'la extracción de {info.filename}')
+
+    # Tiempo y memoria en el proceso que ejecuta el trabajo
+
+    def alarm(self):
+        """Context manager que interrumpe con LimitExceeded al agotarse el tiempo."""
+        return _Alarm(self.remaining())
+
+
+DEFAULT_LIMITS = ResourceLimits()
+# Límites que se pueden ajustar por trabajo (ver ``tightened``)
+_TUNABLE = ('max_unpacked', 'max_ratio', 'max_members', 'max_depth', 'timeout', 'max_memory')
+
+
+class _Alarm:
+    # SIGALRM sólo existe en POSIX y sólo se puede instalar desde el hilo principal;
+    # en otro caso quedan las comprobaciones entre etapas
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self._previous = None
+
+    def __enter__(self):
+        if self.seconds is None or not hasattr(signal, 'setitimer') \
+                or threading.current_thread() is not threading.main_thread():
+            self.seconds = None
+            return self
+        if self.seconds <= 0:
+            raise LimitExceeded("Tiempo por archivo agotado")
+        self._previous = signal.signal(signal.SIGALRM, self._expired)
+        signal.setitimer(signal.ITIMER_REAL, self.seconds)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.seconds is not None:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, self._previous)
+        return False
+
+    def _expired(self, signum, frame):
+        raise LimitExceeded("Tiempo por archivo agotado")
+
+
+def limit_memory(max_memory):
+    """Inicializador de los procesos del pool: limita su espacio de direcciones."""
+    if not max_memory:
+        return
+    try:
+        import resource
+    except ImportError:
+        # Windows: sin RLIMIT_AS
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if hard != resource.RLIM_INFINITY:
+        max_memory = min(max_memory, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (max_memory, hard))
+
+
+def run_limited(func, args, seconds):
+    """Ejecuta ``func(*args)`` en un worker con alarma de ``seconds`` (None: sin límite)."""
+    try:
+        with _Alarm(seconds):
+            return func(*args)
+    except MemoryError:
+        raise LimitExceeded(f"Memoria agotada en {func.__name__}") from None
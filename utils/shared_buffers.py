@@ -0,0 +1,167 @@
+"""
+Buffers en memoria compartida para pasar datos a los procesos del pool.
+
+Un ``SharedBuffer`` se serializa como el nombre del bloque y su tamaño: al
+cruzar la frontera de procesos no se copian los datos, el otro proceso mapea el
+mismo bloque y lo lee con ``view()``. Quien crea los bloques los registra en un
+``SharedArena`` que los libera (``unlink``) al terminar el trabajo; los bloques
+que crea un worker para devolver resultados los adopta el proceso principal.
+
+``SharedModules`` usa un único bloque para el código de todos los módulos VBA
+de un libro, de modo que la lista de macros viaja entre la extracción, la
+desofuscación y el proceso principal sin volver a serializar el código.
+"""
+import io
+from multiprocessing import shared_memory
+
+
+def _attach(name):
+    try:
+        # Python 3.13+: el proceso que sólo lee no debe registrar el bloque
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+class SharedBuffer:
+    """Bloque de memoria compartida de ``size`` bytes."""
+
+    def __init__(self, name, size, shm=None):
+        self.name = name
+        self.size = size
+        self._shm = shm
+
+    @classmethod
+    def allocate(cls, size):
+        # SharedMemory no admite tamaño 0
+        shm = shared_memory.SharedMemory(create=True, size=max(1, size))
+        return cls(shm.name, size, shm)
+
+    @classmethod
+    def from_bytes(cls, data):
+        view = memoryview(data).cast('B')
+        buffer = cls.allocate(len(view))
+        buffer._shm.buf[:len(view)] = view
+        return buffer
+
+    def view(self):
+        """memoryview del contenido (mapea el bloque la primera vez)."""
+        if self._shm is None:
+            self._shm = _attach(self.name)
+        return self._shm.buf[:self.size]
+
+    def close(self):
+        """Deja de mapear el bloque en este proceso (las vistas deben estar liberadas)."""
+        if self._shm is not None:
+            self._shm.close()
+            self._shm = None
+
+    def unlink(self):
+        """Libera el bloque del sistema; lo hace quien lo creó o lo adoptó."""
+        shm = self._shm or _attach(self.name)
+        self._shm = None
+        shm.close()
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+
+    def __getstate__(self):
+        return {'name': self.name, 'size': self.size}
+
+    def __setstate__(self, state):
+        self.__init__(state['name'], state['size'])
+
+    def __repr__(self):
+        return f'SharedBuffer({self.name!r}, size={self.size})'
+
+
+class BufferReader(io.RawIOBase):
+    """Lectura tipo archivo sobre un buffer, sin copiarlo entero (para iterparse)."""
+
+    def __init__(self, view):
+        self._view = memoryview(view).cast('B')
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        chunk = self._view[self._pos:self._pos + len(b)]
+        b[:len(chunk)] = chunk
+        self._pos += len(chunk)
+        return len(chunk)
+
+    def close(self):
+        self._view.release()
+        super().close()
+
+
+class SharedArena:
+    """Bloques de un trabajo: se liberan todos juntos al salir del ``with``."""
+
+    def __init__(self):
+        self.buffers = []
+
+    def allocate(self, size):
+        return self.adopt(SharedBuffer.allocate(size))
+
+    def share(self, data):
+        return self.adopt(SharedBuffer.from_bytes(data))
+
+    def adopt(self, buffer):
+        """Toma la propiedad de ``buffer`` (p. ej. uno creado por un worker)."""
+        if buffer is not None:
+            self.buffers.append(buffer)
+        return buffer
+
+    def close(self):
+        while self.buffers:
+            self.buffers.pop().unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+class SharedModules:
+    """
+    Lista de macros cuyo código vive en un bloque compartido. Se serializan sólo
+    los metadatos (nombre, tipo, rango en el bloque); ``macros()`` devuelve la
+    lista con el código, decodificado directamente desde el bloque.
+    """
+
+    def __init__(self, macros, encoding='utf-8'):
+        encoded = [(macro.get('code') or '').encode(encoding, 'surrogatepass') for macro in macros]
+        self.encoding = encoding
+        self.buffer = SharedBuffer.allocate(sum(len(code) for code in encoded))
+        self.entries = []
+        offset = 0
+        view = self.buffer.view()
+        try:
+            for macro, code in zip(macros, encoded):
+                view[offset:offset + len(code)] = code
+                meta = {key: value for key, value in macro.items() if key != 'code'}
+                self.entries.append((meta, offset, len(code)))
+                offset += len(code)
+        finally:
+            view.release()
+
+    def macros(self):
+        view = self.buffer.view()
+        try:
+            return [dict(meta, code=str(view[offset:offset + size], self.encoding, 'surrogatepass'))
+                    for meta, offset, size in self.entries]
+        finally:
+            view.release()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def modules_of(macros):
+    """Lista de macros de ``macros``, venga como lista o como SharedModules."""
+    return macros.macros() if isinstance(macros, SharedModules) else macros